@@ -2,9 +2,27 @@
 # Part 1 - Install packages
 # ==============================================================================
 import os # For managing environment variables
+import re # For splitting questions into words when ranking context rows
+import io # For wrapping streamed bytes as text
+import gzip # For decompressing bulk downloads incrementally
+import json # For parsing bulk JSON downloads one record at a time
+import random # For adding jitter to retry backoff delays
+import threading # For guarding shared transport counters
+import time # For measuring request latency and sleeping between retries
+from concurrent.futures import ThreadPoolExecutor # For prefetching the next result page
+from email.utils import parsedate_to_datetime # For parsing HTTP-date Retry-After headers
 import requests # For making HTTP requests to external APIs (brreg)
+from requests.adapters import HTTPAdapter # For configuring the keep-alive connection pool
+from brreg_cache import ResponseCache # Optional disk-backed cache for API responses
+from token_budget import count_tokens # Local token counting for the prompt budget
+from completions import create_completion # Chat completions, streamed when the GUI asks for it
+from llm_cache import data_version, get_completion_cache # Shared cache of completion replies
+from gui_worker import GuiWorker # Runs requests off the Tk thread
+from perf_metrics import metrics # Per-stage timings of the Brreg requests and prompt building
 from openai import AzureOpenAI # for interacting with Azure OpenAI GPT models
 import csv # For writing CSV files
+from collections import namedtuple # For compact fixed-schema extracted records
+from itertools import chain, islice # For writing records in batches
 import tkinter as tk # For creating graphical user interface (GUI)
 from tkinter import scrolledtext # For creating a scrollable text widget in the GUI
 
@@ -23,16 +41,137 @@ client = AzureOpenAI(
 )
 
 # ==============================================================================
-# Part 3 - BrregAPI Class for Brønnøysund Register Centre API
+# Part 3 - HTTP Transport Layer for the Brreg API
 # ==============================================================================
+class HTTPTransport:
+    """Pooled keep-alive HTTP transport with retries and latency counters.
+
+    Any object with a compatible get(url, headers=None, params=None, stream=False)
+    method returning a requests-style response can be passed to BrregAPI instead.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504) # Statuses that are worth retrying
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=60,
+                 max_retries=4, backoff_factor=0.5, max_backoff=60):
+        # One session keeps TCP+TLS connections to data.brreg.no alive between calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.timeout = (connect_timeout, read_timeout) # (connect, read) timeouts in seconds
+        self.max_retries = max_retries # Number of retries after the first attempt
+        self.backoff_factor = backoff_factor # Base delay for exponential backoff
+        self.max_backoff = max_backoff # Upper bound for any single retry delay
+
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def get(self, url, headers=None, params=None, stream=False):
+        """Send a GET request, retrying connection errors and retryable statuses"""
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, params=params,
+                                            stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(time.perf_counter() - start, None)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                self._record(time.perf_counter() - start, response.status_code)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                response.close() # Release the connection back to the pool before waiting
+
+            attempt += 1
+            with self._lock:
+                self.stats["retries"] += 1
+            time.sleep(delay)
+
+    def _backoff(self, attempt):
+        """Exponential backoff with full jitter"""
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    def _retry_after(self, response):
+        """Return the delay requested by a 429/503 Retry-After header, if any"""
+        if response.status_code not in (429, 503):
+            return None
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            delay = float(value) # Delay given in seconds
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value) # Delay given as an HTTP date
+            except (TypeError, ValueError):
+                return None
+            delay = retry_at.timestamp() - time.time()
+        return min(self.max_backoff, max(0.0, delay))
+
+    def _record(self, elapsed, status_code):
+        """Update the per-request latency counters"""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["total_seconds"] += elapsed
+            self.stats["max_seconds"] = max(self.stats["max_seconds"], elapsed)
+            key = status_code if status_code is not None else "connection_error"
+            self.stats["status_counts"][key] = self.stats["status_counts"].get(key, 0) + 1
+
+    def reset_stats(self):
+        """Reset the latency and retry counters"""
+        with self._lock:
+            self.stats = {
+                "requests": 0, # Number of HTTP attempts, including retries
+                "retries": 0, # Number of attempts that were retried
+                "total_seconds": 0.0, # Sum of the latency of all attempts
+                "max_seconds": 0.0, # Slowest single attempt
+                "status_counts": {}, # Number of responses per status code
+            }
+
+    def latency_summary(self):
+        """Return a copy of the counters including the average latency"""
+        with self._lock:
+            summary = dict(self.stats, status_counts=dict(self.stats["status_counts"]))
+        requests_made = summary["requests"]
+        summary["avg_seconds"] = summary["total_seconds"] / requests_made if requests_made else 0.0
+        return summary
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+# ==============================================================================
+# Part 4 - BrregAPI Class for Brønnøysund Register Centre API
+# ==============================================================================
+# Columns produced by BrregAPI.iter_extract/extract_data and written by save_to_csv, in order
+ENTITY_FIELDS = (
+    'organisasjonsnummer', 'navn', 'organisasjonsform', 'registreringsdatoEnhetsregisteret',
+    'naeringskode1', 'forretningsadresse', 'postnummer', 'poststed', 'kommune', 'kommunenummer',
+    'epostadresse', 'telefon', 'hjemmeside', 'stiftelsesdato', 'sisteInnsendteAarsregnskap',
+)
+EntityRecord = namedtuple('EntityRecord', ENTITY_FIELDS) # Tuple-backed, so no per-record dict of keys
+
 class BrregAPI:
     BASE_URL = "https://data.brreg.no" # Base URL for Brreg API
+    MAX_SEARCH_RESULTS = 10000 # Brreg rejects pages beyond the first 10000 search hits
 
-    def __init__(self):
+    def __init__(self, transport=None, cache=None):
         # Initialize the necessary headers for API requests
         self.headers = {
             "Accept": "application/vnd.brreg.enhetsregisteret.enhet.v2+json"
         }
+        # Reuse one pooled transport for all requests made through this instance
+        self.transport = transport if transport is not None else HTTPTransport()
+        # Optional ResponseCache, consulted by _get for cacheable endpoints
+        self.cache = cache
 
     # Method to fetch general services from the root API
     def fetch_services(self):
@@ -40,13 +179,20 @@ class BrregAPI:
         url = f"{self.BASE_URL}/enhetsregisteret/api"
         return self._get(url)
 
-    # Method to search for entities by name
-    def search_entities(self, name):
-        """GET /api/enheter - Search for entities"""
+    # Method to search for entities by name and other filters (e.g. kommunenummer, naeringskode)
+    def search_entities(self, name=None, **filters):
+        """GET /api/enheter - Search for entities (first page only)"""
         url = f"{self.BASE_URL}/enhetsregisteret/api/enheter"
-        params = {"navn": name}
+        params = self._search_params(name, filters)
         return self._get(url, params)
 
+    # Method to lazily iterate over every page of an entity search
+    def iter_entities(self, name=None, page_size=100, **filters):
+        """GET /api/enheter - Yield every matching entity, following the result pages"""
+        url = f"{self.BASE_URL}/enhetsregisteret/api/enheter"
+        params = self._search_params(name, filters)
+        return self._iter_pages(url, params, "enheter", page_size)
+
     # Method to fetch details for specific entities using organization number
     def fetch_entity(self, orgnr):
         """GET /api/enheter/{orgnr} - Fetch a specific entity"""
@@ -66,22 +212,40 @@ class BrregAPI:
         return self._get(url)
 
     # Method to download data of entities in different formats (e.g., JSON, CSV, XLSX)
-    def download_entities(self, file_format="json"):
-        """GET /api/enheter/lastned - Download entities in various formats (JSON, CSV, XLSX)"""
+    def download_entities(self, file_format="json", dest=None, on_chunk=None):
+        """GET /api/enheter/lastned - Download entities in various formats (JSON, CSV, XLSX)
+
+        Without dest/on_chunk the whole file is returned as bytes. With dest the file is
+        streamed to disk (resuming a partial download), and on_chunk receives each chunk.
+        """
         url = f"{self.BASE_URL}/enhetsregisteret/api/enheter/lastned"
         if file_format == "csv":
             url += "/csv" # If CSV format is required, append/CSV to the URL
         elif file_format == "xlsx":
             url += "/regneark" # If XLSX (spreadsheet) format is requested, append / regneark
-        return self._get(url, stream=True) # Stream the response for large files
+        return self._download(url, dest, on_chunk) # Stream the response for large files
+
+    # Method to parse the entity download one record at a time
+    def iter_entities_dump(self, source=None, file_format="json"):
+        """Yield entities from a downloaded dump file, or straight from the API if source is None"""
+        if source is None:
+            return self._iter_remote_dump(f"{self.BASE_URL}/enhetsregisteret/api/enheter/lastned", file_format)
+        return iter_dump_records(source, file_format)
 
     # Method to search for sub-entities using Brreg API
-    def search_sub_entities(self, name):
-        """GET /api/underenheter - Search for sub-entities"""
+    def search_sub_entities(self, name=None, **filters):
+        """GET /api/underenheter - Search for sub-entities (first page only)"""
         url = f"{self.BASE_URL}/enhetsregisteret/api/underenheter"
-        params = {"navn": name}
+        params = self._search_params(name, filters)
         return self._get(url, params)
 
+    # Method to lazily iterate over every page of a sub-entity search
+    def iter_sub_entities(self, name=None, page_size=100, **filters):
+        """GET /api/underenheter - Yield every matching sub-entity, following the result pages"""
+        url = f"{self.BASE_URL}/enhetsregisteret/api/underenheter"
+        params = self._search_params(name, filters)
+        return self._iter_pages(url, params, "underenheter", page_size)
+
     # Method to fetch details of a specific sub-entity using its organization number
     def fetch_sub_entity(self, orgnr):
         """GET /api/underenheter/{orgnr} - Fetch a specific sub-entity"""
@@ -89,32 +253,47 @@ class BrregAPI:
         return self._get(url)
 
     # Method to download data of sub-entities in various formats
-    def download_sub_entities(self, file_format="json"):
+    def download_sub_entities(self, file_format="json", dest=None, on_chunk=None):
         """GET /api/underenheter/lastned - Download sub-entities in various formats (JSON, CSV, XLSX)"""
         url = f"{self.BASE_URL}/enhetsregisteret/api/underenheter/lastned"
         if file_format == "csv":
             url += "/csv"
         elif file_format == "xlsx":
             url += "/regneark"
-        return self._get(url, stream=True)
+        return self._download(url, dest, on_chunk)
+
+    # Method to parse the sub-entity download one record at a time
+    def iter_sub_entities_dump(self, source=None, file_format="json"):
+        """Yield sub-entities from a downloaded dump file, or straight from the API if source is None"""
+        if source is None:
+            return self._iter_remote_dump(f"{self.BASE_URL}/enhetsregisteret/api/underenheter/lastned", file_format)
+        return iter_dump_records(source, file_format)
 
     # Method to fetch updates for entities
-    def fetch_entity_updates(self):
-        """GET /api/oppdateringer/enheter - Fetch updated entities"""
+    def fetch_entity_updates(self, since_date=None, since_id=None, page=None, size=None):
+        """GET /api/oppdateringer/enheter - Fetch updated entities (from a date and/or update id)"""
         url = f"{self.BASE_URL}/enhetsregisteret/api/oppdateringer/enheter"
-        return self._get(url)
+        return self._get(url, self._update_params(since_date, since_id, page, size))
 
     # Method to fetch updates for sub-entities
-    def fetch_sub_entity_updates(self):
-        """GET /api/oppdateringer/underenheter - Fetch updated sub-entities"""
+    def fetch_sub_entity_updates(self, since_date=None, since_id=None, page=None, size=None):
+        """GET /api/oppdateringer/underenheter - Fetch updated sub-entities (from a date and/or update id)"""
         url = f"{self.BASE_URL}/enhetsregisteret/api/oppdateringer/underenheter"
-        return self._get(url)
+        return self._get(url, self._update_params(since_date, since_id, page, size))
 
     # Method to fetch updates of roles in entities
-    def fetch_role_updates(self):
-        """GET /api/oppdateringer/roller - Fetch role updates"""
+    def fetch_role_updates(self, after_time=None, after_id=None, size=None):
+        """GET /api/oppdateringer/roller - Fetch role updates (after a time and/or event id)"""
         url = f"{self.BASE_URL}/enhetsregisteret/api/oppdateringer/roller"
-        return self._get(url)
+        params = {"afterTime": after_time, "afterId": after_id, "size": size}
+        return self._get(url, {key: value for key, value in params.items() if value is not None})
+
+    # Helper method for building the query parameters of the update feeds
+    @staticmethod
+    def _update_params(since_date, since_id, page, size):
+        """since_date is an ISO 8601 timestamp, since_id the first oppdateringsid to return"""
+        params = {"dato": since_date, "oppdateringsid": since_id, "page": page, "size": size}
+        return {key: value for key, value in params.items() if value is not None}
 
     # Method to fetch all organization forms available in Brreg
     def fetch_org_forms(self):
@@ -141,10 +320,19 @@ class BrregAPI:
         return self._get(url)
 
     # Method to download the total inventory of roles for all entities
-    def download_total_roles(self):
+    def download_total_roles(self, dest=None, on_chunk=None):
         """GET /api/roller/totalbestand - Download total inventory of roles for all entities"""
         url = f"{self.BASE_URL}/enhetsregisteret/api/roller/totalbestand"
-        return self._get(url)
+        if dest is None and on_chunk is None:
+            return self._get(url)
+        return self.stream_download(url, dest=dest, on_chunk=on_chunk)
+
+    # Method to parse the total roles inventory one organisation at a time
+    def iter_total_roles_dump(self, source=None):
+        """Yield {organisasjonsnummer, rollegrupper} documents from a downloaded file, or straight from the API"""
+        if source is None:
+            return self._iter_remote_dump(f"{self.BASE_URL}/enhetsregisteret/api/roller/totalbestand", "json")
+        return iter_dump_records(source, "json")
 
     # Method to fetch the different types of roles in the brreg API
     def fetch_role_types(self):
@@ -172,185 +360,600 @@ class BrregAPI:
         return self._get(url, params)
 
     # Method to download CSV for all political parties registered
-    def download_political_parties_csv(self):
+    def download_political_parties_csv(self, dest=None, on_chunk=None):
         """GET /partiregisteret/api/lastned/csv - Download total inventory of political parties in CSV format"""
         url = f"{self.BASE_URL}/partiregisteret/api/lastned/csv"
-        return self._get(url, stream=True)
+        return self._download(url, dest, on_chunk)
 
     # Method to download CSV of all non-profit organizations registered
-    def download_non_profit_orgs_csv(self):
+    def download_non_profit_orgs_csv(self, dest=None, on_chunk=None):
         """GET /frivillighetsregisteret/api/lastned/csv - Download total inventory of non-profit organisations in CSV format"""
         url = f"{self.BASE_URL}/frivillighetsregisteret/api/lastned/csv"
-        return self._get(url, stream=True)
+        return self._download(url, dest, on_chunk)
+
+    # Helper method for building search parameters from a name and keyword filters
+    @staticmethod
+    def _search_params(name, filters):
+        """Build query parameters, joining list values (e.g. several kommunenummer) with commas"""
+        params = {"navn": name} if name else {}
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = ",".join(str(v) for v in value)
+            params[key] = value
+        return params
+
+    # Helper method for iterating over paginated search results
+    def _iter_pages(self, url, params, embedded_key, page_size):
+        """Yield items from every result page while the next page is fetched in the background.
+
+        The last page is known from the page metadata; a page that cannot be fetched raises
+        RuntimeError, so a failed request never looks like the end of the results.
+        """
+        params = dict(params, page=0, size=page_size)
+        executor = ThreadPoolExecutor(max_workers=1) # Only the next page is ever in flight
+        try:
+            future = executor.submit(self._get, url, params)
+            while future is not None:
+                page = future.result()
+                if page is None:
+                    raise RuntimeError(f"Could not fetch page {params['page']} of {url}")
+
+                # Start fetching the next page before handing out the items of this one
+                next_params = self._next_page_params(page, params)
+                if next_params is None:
+                    future = None
+                else:
+                    next_link = page.get("_links", {}).get("next", {}).get("href")
+                    if next_link:
+                        # The next link already carries every query parameter
+                        future = executor.submit(self._get, next_link)
+                    else:
+                        future = executor.submit(self._get, url, next_params)
+                    params = next_params
+
+                for item in page.get("_embedded", {}).get(embedded_key, []):
+                    yield item
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _next_page_params(self, page, params):
+        """Return the params of the page after `page`, or None if it was the last reachable page"""
+        meta = page.get("page", {})
+        number = meta.get("number", params["page"])
+        size = meta.get("size", params["size"])
+        if number + 1 >= meta.get("totalPages", 0):
+            return None
+        if (number + 2) * size > self.MAX_SEARCH_RESULTS:
+            remaining = meta.get("totalElements", 0) - (number + 1) * size
+            print(f"Note: Brreg only returns the first {self.MAX_SEARCH_RESULTS} matches, narrow the search "
+                  f"or use the bulk download for the remaining {remaining}.")
+            return None
+        return dict(params, page=number + 1)
+
+    # Helper method choosing between the buffered and the streaming download path
+    def _download(self, url, dest, on_chunk):
+        """Return the file as bytes, or stream it to dest/on_chunk if either is given"""
+        if dest is None and on_chunk is None:
+            return self._get(url, stream=True)
+        return self.stream_download(url, dest=dest, on_chunk=on_chunk)
+
+    # Method to stream a large file to disk and/or a callback without buffering it in memory
+    def stream_download(self, url, dest=None, on_chunk=None, chunk_size=1024 * 1024, resume=True):
+        """Stream url to dest (via dest + '.part') and/or on_chunk, resuming with Range requests.
+
+        Returns dest (or the number of bytes received if no dest is given), or None on failure.
+        """
+        part_path = f"{dest}.part" if dest else None
+        meta_path = f"{dest}.part.meta" if dest else None
+        offset = 0
+        validator = None # ETag/Last-Modified of the partial file, so a newer dump is not appended to it
+        if part_path and resume and os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding="utf-8") as meta_file:
+                    validator = meta_file.read().strip() or None
+
+        attempts = 0
+        while True:
+            headers = dict(self.headers)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                if validator:
+                    headers["If-Range"] = validator
+            try:
+                response = self.transport.get(url, headers=headers, stream=True)
+            except requests.RequestException as e:
+                print(f"Error: {e}")
+                return None
+
+            with response:
+                if response.status_code == 416 and offset and part_path:
+                    break # The partial file already holds the whole download
+                if response.status_code not in (200, 206):
+                    print(f"Error: {response.status_code}")
+                    return None
+                if response.status_code == 200 and offset:
+                    # The server ignored the range (or the file changed), so start over
+                    if on_chunk is not None and not part_path:
+                        print("Error: server does not support resuming this download")
+                        return None
+                    offset = 0
+
+                file_obj = None
+                if part_path:
+                    validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+                    with open(meta_path, "w", encoding="utf-8") as meta_file:
+                        meta_file.write(validator or "")
+                    file_obj = open(part_path, "ab" if offset else "wb")
+                try:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        if file_obj is not None:
+                            file_obj.write(chunk)
+                        if on_chunk is not None:
+                            on_chunk(chunk)
+                        offset += len(chunk)
+                except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                    # The connection dropped mid-download, so continue from the current offset
+                    attempts += 1
+                    if attempts > getattr(self.transport, "max_retries", 3):
+                        print(f"Error: {e}")
+                        return None
+                    continue
+                finally:
+                    if file_obj is not None:
+                        file_obj.close()
+            break
+
+        if not part_path:
+            return offset
+        os.replace(part_path, dest)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        return dest
+
+    # Helper method for parsing a bulk download straight from the HTTP stream
+    def _iter_remote_dump(self, url, file_format):
+        """Yield records from a bulk download endpoint without writing it to disk"""
+        if file_format == "csv":
+            url += "/csv"
+        try:
+            response = self.transport.get(url, headers=self.headers, stream=True)
+        except requests.RequestException as e:
+            print(f"Error: {e}")
+            return
+        with response:
+            if response.status_code != 200:
+                print(f"Error: {response.status_code}")
+                return
+            response.raw.decode_content = True # Undo any transfer Content-Encoding
+            response.raw.auto_close = False # Report EOF instead of failing when gzip reads past the end
+            yield from iter_dump_records(response.raw, file_format)
 
     # Helper method for making GET requests and handling responses
     def _get(self, url, params=None, stream=False):
         """Helper method for making GET requests"""
-        response = requests.get(url, headers=self.headers, params=params, stream=stream)
-        if response.status_code == 200:
-            # Return JSON resposne for non-streaming content or content for streamed responses
-            return response.json() if not stream else response.content
-        else:
-            # Print error message and return None in case of failure
-            print(f"Error: {response.status_code}")
-            return None
+        with metrics.span("brreg_get", url=url) as span:
+            headers = self.headers
+            cache_key = entry = None
+            if self.cache is not None and not stream:
+                cache_key, entry = self.cache.lookup(url, params, self.headers)
+                if entry is not None:
+                    if entry.fresh:
+                        span.set(cache_hits=1)
+                        return entry.json() # Served from the cache without a request
+                    headers = dict(self.headers, **entry.validators()) # Ask the server if the entry is still valid
+
+            try:
+                response = self.transport.get(url, headers=headers, params=params, stream=stream)
+            except requests.RequestException as e:
+                # Print error message and return None if the request could not be completed
+                print(f"Error: {e}")
+                span.fail()
+                return None
+            span.set(status=str(response.status_code)) # Logged, not summed
+            if response.status_code == 304 and entry is not None:
+                self.cache.refresh(cache_key, url)
+                span.set(cache_revalidated=1)
+                return entry.json()
+            if response.status_code == 200:
+                if cache_key is not None:
+                    self.cache.store(cache_key, url, response)
+                span.set(bytes=len(response.content))
+                # Return JSON resposne for non-streaming content or content for streamed responses
+                return response.json() if not stream else response.content
+            else:
+                # Print error message and return None in case of failure
+                print(f"Error: {response.status_code}")
+                span.fail()
+                return None
 
     @staticmethod
-    def extract_data(json_data):
-        if not json_data:
-            return []
+    def iter_extract(entities):
+        """Yield one EntityRecord per entity from a result page or any iterable of entities"""
+        if not entities:
+            return
+        if isinstance(entities, dict):
+            embedded = entities.get('_embedded', {}) # Brreg leaves out _embedded when nothing matched
+            entities = embedded.get('enheter') or embedded.get('underenheter') or []
 
-        entities = json_data['_embedded']['enheter']
-        extracted_data = []
         for entity in entities:
-            data = {
-                'organisasjonsnummer': entity.get('organisasjonsnummer', ''),
-                'navn': entity.get('navn', ''),
-                'organisasjonsform': entity.get('organisasjonsform', {}).get('beskrivelse', ''),
-                'registreringsdatoEnhetsregisteret': entity.get('registreringsdatoEnhetsregisteret', ''),
-                'naeringskode1': entity.get('naeringskode1', {}).get('beskrivelse', ''),
-                'forretningsadresse': ', '.join(entity.get('forretningsadresse', {}).get('adresse', [])),
-                'postnummer': entity.get('forretningsadresse', {}).get('postnummer', ''),
-                'poststed': entity.get('forretningsadresse', {}).get('poststed', ''),
-                'kommune': entity.get('forretningsadresse', {}).get('kommune', ''),
-                'kommunenummer': entity.get('forretningsadresse', {}).get('kommunenummer', ''),
-                'epostadresse': entity.get('epostadresse', ''),
-                'telefon': entity.get('telefon', ''),
-                'hjemmeside': entity.get('hjemmeside', ''),
-                'stiftelsesdato': entity.get('stiftelsesdato', ''),
-                'sisteInnsendteAarsregnskap': entity.get('sisteInnsendteAarsregnskap', ''),
-            }
-            extracted_data.append(data)
-        return extracted_data
+            # Sub-entities have a beliggenhetsadresse instead of a forretningsadresse
+            address = entity.get('forretningsadresse') or entity.get('beliggenhetsadresse') or {}
+            yield EntityRecord(
+                entity.get('organisasjonsnummer', ''),
+                entity.get('navn', ''),
+                entity.get('organisasjonsform', {}).get('beskrivelse', ''),
+                entity.get('registreringsdatoEnhetsregisteret', ''),
+                entity.get('naeringskode1', {}).get('beskrivelse', ''),
+                ', '.join(address.get('adresse', [])),
+                address.get('postnummer', ''),
+                address.get('poststed', ''),
+                address.get('kommune', ''),
+                address.get('kommunenummer', ''),
+                entity.get('epostadresse', ''),
+                entity.get('telefon', ''),
+                entity.get('hjemmeside', ''),
+                entity.get('stiftelsesdato', ''),
+                entity.get('sisteInnsendteAarsregnskap', ''),
+            )
+
+    @staticmethod
+    def extract_data(json_data):
+        """Return the extracted records of a result page as a list of dicts"""
+        return [record._asdict() for record in BrregAPI.iter_extract(json_data)]
 
     # Save data to CSV file
     def save_to_csv(self, data,
-                    filename='/Users/helenewiese-hansen/Library/CloudStorage/OneDrive-NorwegianSchoolofEconomics/BAN443/pythonProject/.venv/bin/python /Users/helenewiese-hansen/Downloads/financial_report_bot.csv'):
-        if not data:
+                    filename='/Users/helenewiese-hansen/Library/CloudStorage/OneDrive-NorwegianSchoolofEconomics/BAN443/pythonProject/.venv/bin/python /Users/helenewiese-hansen/Downloads/financial_report_bot.csv',
+                    batch_size=5000):
+        """Write any iterable of EntityRecords/tuples (or dicts) to CSV in buffered batches"""
+        rows = iter(data or ())
+        first = next(rows, None)
+        if first is None:
             print("No data available to save.")
             return
 
-        keys = data[0].keys()
+        # Records use the fixed ENTITY_FIELDS header, dicts keep their own keys as before
+        is_dict = isinstance(first, dict)
+        keys = list(first.keys()) if is_dict else list(getattr(first, '_fields', ENTITY_FIELDS))
 
         # Open the file with UTF-8 with BOM to ensure Excel handles encoding correctly
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as output_file:
-            dict_writer = csv.DictWriter(output_file, fieldnames=keys, quoting=csv.QUOTE_MINIMAL)
-            dict_writer.writeheader()
-            dict_writer.writerows(data)
+        count = 0
+        with open(filename, 'w', newline='', encoding='utf-8-sig', buffering=1024 * 1024) as output_file:
+            writer = csv.writer(output_file, quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(keys)
+            rows = chain([first], rows)
+            if is_dict:
+                rows = ([row.get(key, '') for key in keys] for row in rows)
+            while True:
+                batch = list(islice(rows, batch_size)) # Hold at most one batch in memory
+                if not batch:
+                    break
+                writer.writerows(batch)
+                count += len(batch)
+
+        print(f"Data saved to {filename} ({count} rows)")
+        return count
+
+    # Save entity documents to a typed, columnar Parquet or Arrow file
+    def save_to_parquet(self, entities, filename, **options):
+        """Write raw entities with typed, dictionary-encoded columns (see brreg_export.export_entities)"""
+        from brreg_export import export_entities # Imported here since brreg_export builds on this module
+        return export_entities(entities, filename, **options)
+
+
+# ==============================================================================
+# Part 5 - Streaming Parser for Bulk Downloads
+# ==============================================================================
+def iter_dump_records(source, file_format="json", read_size=64 * 1024):
+    """Yield one record at a time from a (gzipped) JSON or CSV bulk download.
 
-        print(f"Data saved to {filename}")
+    source is a file path or a binary file object. Gzip is detected from the magic bytes,
+    so both the compressed download and an uncompressed copy can be parsed.
+    """
+    if file_format not in ("json", "csv"):
+        raise ValueError(f"Cannot stream-parse the '{file_format}' format, use 'json' or 'csv'")
 
+    own_file = isinstance(source, (str, os.PathLike))
+    raw = open(source, "rb") if own_file else source
+    try:
+        buffered = raw if hasattr(raw, "peek") else io.BufferedReader(raw)
+        if buffered.peek(2)[:2] == b"\x1f\x8b":
+            buffered = gzip.GzipFile(fileobj=buffered, mode="rb")
+        text = io.TextIOWrapper(buffered, encoding="utf-8", newline="")
+        if file_format == "csv":
+            yield from csv.DictReader(text)
+        else:
+            yield from _iter_json_array(text, read_size)
+    finally:
+        if own_file:
+            raw.close()
+
+def _iter_json_array(text, read_size):
+    """Incrementally decode the objects of a top-level JSON array"""
+    decoder = json.JSONDecoder()
+    buffer = text.read(read_size).lstrip("\ufeff \t\r\n")
+    if not buffer:
+        return
+    if buffer[0] != "[":
+        raise ValueError("Expected the bulk download to contain a JSON array")
+    pos = 1
+    eof = False
+    while True:
+        # Skip whitespace and separators between records
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            if pos >= len(buffer):
+                raise json.JSONDecodeError("Need more data", buffer, pos)
+            record, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Bulk download ended in the middle of a record")
+            # Drop consumed text and read more so the buffer never holds more than a few records
+            chunk = text.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield record
 
 # ==============================================================================
-# Part 4 - Function to ask Azure OpenAI a question based on brreg data
+# Part 6 - Function to ask Azure OpenAI a question based on brreg data
 # ==============================================================================
-def ask_azure_openai(question, brreg_data):
+CONTEXT_TOKEN_BUDGET = 6000 # Maximum number of tokens of Brreg data sent with a question
+
+@metrics.timed("brreg_context")
+def build_brreg_context(records, question, max_tokens=CONTEXT_TOKEN_BUDGET):
+    """Serialize extracted records as a compact table that fits within max_tokens.
+
+    The column names are written once as a header, columns that are empty for every record
+    are dropped, and if the records do not fit, the ones sharing most words with the question
+    are kept (ties keep the Brreg order), skipping rows too long for the remaining budget.
+    """
+    rows = [record._asdict() if hasattr(record, '_asdict') else record for record in records]
+    if not rows:
+        return "No matching entities were found."
+
+    columns = [key for key in rows[0] if any(row.get(key) for row in rows)]
+    header = " | ".join(columns)
+    budget = max_tokens - count_tokens(header) - 20 # Leave room for the truncation note
+
+    def cell(value):
+        return str(value or '').replace("|", "/").replace("\n", " ")
+
+    lines = [" | ".join(cell(row.get(key)) for key in columns) for row in rows]
+
+    # Rank the rows by how many words of the question they contain
+    words = {word for word in re.findall(r"\w+", question.lower()) if len(word) > 2}
+    order = sorted(range(len(lines)), key=lambda i: -sum(word in lines[i].lower() for word in words))
+
+    kept = []
+    for i in order:
+        cost = count_tokens(lines[i]) + 1
+        if cost > budget:
+            continue # A shorter, less relevant row may still fit
+        budget -= cost
+        kept.append(i)
+    kept.sort() # Present the kept rows in their original order
+
+    context = "\n".join([header] + [lines[i] for i in kept])
+    if len(kept) < len(lines):
+        context += f"\n(Showing the {len(kept)} most relevant of {len(lines)} entities.)"
+    return context
+
+def ask_azure_openai(question, brreg_data, max_context_tokens=CONTEXT_TOKEN_BUDGET, on_token=None, cancel_event=None):
     """
     This function sends a user question along with brreg data as context to Azure OpenAI
-    and returns a response.
+    and returns a response. With on_token, the response is streamed to on_token as it arrives.
     """
+    # Fingerprint the data before it is cut down for the question, for the near-duplicate cache
+    version = data_version(brreg_data)
+
+    # Serialize the records compactly within the token budget (pre-built text is used as is)
+    if not isinstance(brreg_data, str):
+        brreg_data = build_brreg_context(brreg_data, question, max_context_tokens)
+
     # Prepare the prompt for OpenAI by combining Brreg data with the user question
     prompt = f"The following is data from the Brønnøysund Register Centre:\n\n{brreg_data}\n\nAnswer the following question: {question}"
 
     try:
-        # Make a request using the AzureOpenAI client
-        response = client.chat.completions.create(
-            model="GPT4o-API",  # Deployment name
-            messages=[
+        # Make a request using the AzureOpenAI client and extract the response content
+        return create_completion(
+            client,
+            [
                 {"role": "system", "content": "You are a helpful assistant analyzing financial reports."},
                 {"role": "user", "content": prompt}
             ],
+            on_token=on_token, # Called with each streamed piece of the answer
+            cancel_event=cancel_event, # Stops the stream when set
+            cache=get_completion_cache(), # Repeated or rephrased questions over the same data are answered at once
+            question=question,
+            data_version=version,
+            model="GPT4o-API",  # Deployment name
             max_tokens=1000, # Limit the responses to 1000 tokens
             temperature=0.3 # Adjust the creativity level of the response
         )
 
-        # Extract and return the response content
-        content = response.choices[0].message.content
-        return content
-
     except Exception as e:
         # Handle errors during the API request
         return f"Error with OpenAI API: {str(e)}"
 
 # ==============================================================================
-# Part 5 - Function to handle the chat interaction
+# Part 7 - Function to handle the chat interaction
 # ==============================================================================
-def chat_interaction():
+def get_brreg_api():
+    """Return the local snapshot API if BRREG_LOCAL_DB points to one, otherwise the live API.
+
+    The live API caches responses on disk when BRREG_CACHE_PATH is set.
     """
-    Handles the interaction between the user and the chatbot. Retrieves the user's question
-    and calls the appropriate function to get data from Brreg and OpenAI.
+    db_path = os.getenv("BRREG_LOCAL_DB")
+    if db_path and os.path.exists(db_path):
+        from brreg_store import LocalBrregAPI # Imported here since brreg_store builds on this module
+        return LocalBrregAPI(db_path)
+    cache_path = os.getenv("BRREG_CACHE_PATH")
+    return BrregAPI(cache=ResponseCache(cache_path) if cache_path else None)
+
+def stream_answer(task, question, brreg_data):
+    """Ask Azure OpenAI on the worker thread, posting the answer to the chat display as it streams in"""
+    streamed = []
+
+    def on_token(text):
+        streamed.append(text)
+        task.post(write, text)
+
+    answer = ask_azure_openai(question, brreg_data, on_token=on_token, cancel_event=task.cancel_event)
+    if task.cancelled:
+        return " (cancelled)"
+    return answer if answer != "".join(streamed) else "" # Errors are not streamed, so show them here
+
+_analytics = None
+
+def get_brreg_analytics():
+    """Load the columnar aggregates file at BRREG_ANALYTICS_PATH on first use (off unless the variable is set)"""
+    global _analytics
+    path = os.getenv("BRREG_ANALYTICS_PATH")
+    if _analytics is None and path and os.path.exists(path):
+        from brreg_analytics import BrregAnalytics # Imported here since brreg_analytics builds on this module
+        _analytics = BrregAnalytics.load(path)
+    return _analytics
+
+def answer_aggregate(task, question, entity_name=None):
+    """Answer counts and breakdowns over the whole register from exact aggregates, or return None"""
+    analytics = get_brreg_analytics()
+    if analytics is None:
+        return None
+    from brreg_analytics import parse_aggregate_question, describe_aggregate
+    query = parse_aggregate_question(question, analytics, entity_name)
+    if query is None:
+        return None
+    return stream_answer(task, question, describe_aggregate(analytics, query))
+
+def write(text):
+    """Append text to the chat display (only called on the Tk thread)"""
+    chat_display.insert(tk.END, text)
+    chat_display.see(tk.END)
+
+def answer_question(task, question, entity_name):
     """
-    # Retrieve the user's question from the input field
-    question = question_entry.get()
+    Runs on the worker thread: fetches the Brreg data if needed and streams the answer.
+    Every update of the chat display is posted back to the Tk thread.
+    """
+    # Counts and breakdowns over the whole register are computed exactly instead of from one search
+    answer = answer_aggregate(task, question, entity_name)
+    if answer is not None:
+        return answer
 
-    # Check if the user has entered a question
-    if not question:
-        chat_display.insert(tk.END, "Bot: Please enter a question.\n\n")
-        return
+    if not hasattr(chat_interaction, "brreg_data") and not entity_name:
+        return "Please enter an entity name."
 
     # Fetching data for the first time, if not already fetched
     if not hasattr(chat_interaction, "brreg_data"):
-        entity_name = entity_entry.get()
-        if not entity_name:
-            chat_display.insert(tk.END, "Bot: Please enter an entity name.\n\n")
-            return
-
-        brreg_api = BrregAPI()
+        brreg_api = get_brreg_api()
         json_data = brreg_api.search_entities(entity_name)
 
         if not json_data:
-            chat_display.insert(tk.END, f"Bot: Could not retrieve data for {entity_name} from brreg.\n\n")
-            return
+            return f"Could not retrieve data for {entity_name} from brreg."
 
         extracted_data = brreg_api.extract_data(json_data)
         chat_interaction.brreg_data = extracted_data
 
-        # Save to CSV if the question involves "download CSV"
+        # Save to CSV if the question involves "download CSV", streaming every result page
         if "download" in question.lower() and "csv" in question.lower():
-            brreg_api.save_to_csv(extracted_data, filename=f"{entity_name}_entities_clean.csv")
-            chat_display.insert(tk.END,
-                                f"Bot: Data for {entity_name} has been downloaded in clean CSV format for Excel.\n\n")
-            return
+            all_records = brreg_api.iter_extract(brreg_api.iter_entities(entity_name))
+            try:
+                brreg_api.save_to_csv(all_records, filename=f"{entity_name}_entities_clean.csv")
+            except RuntimeError as e:
+                return f"The CSV for {entity_name} is incomplete: {e}"
+            return f"Data for {entity_name} has been downloaded in clean CSV format for Excel."
 
-    # Send the user's question along with the Brreg data to Azure OpenAI for analysis
-    answer = ask_azure_openai(question, chat_interaction.brreg_data)
+    if task.cancelled:
+        return "(cancelled)"
 
-    # Display the user's question and the chatbot's answer in the chat display
-    chat_display.insert(tk.END, f"You: {question}\n")
-    chat_display.insert(tk.END, f"Bot: {answer}\n\n")
+    # Send the user's question along with the Brreg data to Azure OpenAI, showing tokens as they arrive
+    return stream_answer(task, question, chat_interaction.brreg_data)
+
+def chat_interaction():
+    """
+    Handles the interaction between the user and the chatbot. Retrieves the user's question
+    and runs the Brreg and OpenAI requests on the worker thread, so the window stays responsive.
+    """
+    # Retrieve the user's question from the input field
+    question = question_entry.get()
+
+    # Check if the user has entered a question
+    if not question:
+        write("Bot: Please enter a question.\n\n")
+        return
+
+    if worker.busy:
+        write("Bot: Please wait for the current answer, or press Cancel.\n\n")
+        return
+
+    entity_name = entity_entry.get()
+
+    # Display the user's question right away; the answer is appended as it streams in
+    write(f"You: {question}\nBot: ")
 
     # Clear the question input field for the next question
     question_entry.delete(0, tk.END)
 
-    # Scroll to the bottom of the chat display to show the latest question
-    chat_display.see(tk.END)
+    worker.submit(answer_question, question, entity_name,
+                  on_done=lambda text: write(f"{text}\n\n"),
+                  on_error=lambda e: write(f"Error: {str(e)}\n\n"))
+
+def cancel_interaction():
+    """Stop the request that is running, if any"""
+    worker.cancel()
 
 # ==============================================================================
-# Part 6 - GUI Setup using Tkinter
+# Part 8 - GUI Setup using Tkinter
 # ==============================================================================
-# Create the main window for the chatbot
-root = tk.Tk()
-root.title("Brreg Chatbot") # Set the title of the window
-root.geometry("600x400") # Set the dimensions of the window
-
-# Create the labels and input fields for entity name and questions
-entity_label = tk.Label(root, text="Entity Name:")
-entity_label.pack() # Display the label on the window
-entity_entry = tk.Entry(root, width=50) # Create an entry field for the entity name
-entity_entry.pack() # Add the entry field to the window
-
-question_label = tk.Label(root, text="Question:")
-question_label.pack() # Display the label on the window
-question_entry = tk.Entry(root, width=50) # Create an entry field for the question
-question_entry.pack() # Add the entry field to the window
-
-# Create the "Ask" button that will trigger the chat interaction
-chat_button = tk.Button(root, text="Ask", command=chat_interaction)
-chat_button.pack() # Display the button on the window
-
-# Create a scrollable text box to display the conversation
-chat_display = scrolledtext.ScrolledText(root, wrap=tk.WORD, width=70, height=20)
-chat_display.pack(padx=10, pady=10) # Add padding around the text box for a clean layout
-
-# Start the Tkinter main even loop, which keeps the GUI running
-root.mainloop()
+def main():
+    """Build the chatbot window and start the Tkinter event loop"""
+    # The widgets are module-level so chat_interaction can reach them
+    global root, entity_entry, question_entry, chat_display, worker
+
+    # Create the main window for the chatbot
+    root = tk.Tk()
+    root.title("Brreg Chatbot") # Set the title of the window
+    root.geometry("600x400") # Set the dimensions of the window
+
+    # Create the labels and input fields for entity name and questions
+    entity_label = tk.Label(root, text="Entity Name:")
+    entity_label.pack() # Display the label on the window
+    entity_entry = tk.Entry(root, width=50) # Create an entry field for the entity name
+    entity_entry.pack() # Add the entry field to the window
+
+    question_label = tk.Label(root, text="Question:")
+    question_label.pack() # Display the label on the window
+    question_entry = tk.Entry(root, width=50) # Create an entry field for the question
+    question_entry.pack() # Add the entry field to the window
+
+    # Create the "Ask" button that will trigger the chat interaction
+    chat_button = tk.Button(root, text="Ask", command=chat_interaction)
+    chat_button.pack() # Display the button on the window
+
+    # Create the "Cancel" button that stops the running request
+    cancel_button = tk.Button(root, text="Cancel", command=cancel_interaction)
+    cancel_button.pack() # Display the button on the window
+
+    # Create a scrollable text box to display the conversation
+    chat_display = scrolledtext.ScrolledText(root, wrap=tk.WORD, width=70, height=20)
+    chat_display.pack(padx=10, pady=10) # Add padding around the text box for a clean layout
+
+    # Run the requests on a background thread and poll for their results from the event loop
+    worker = GuiWorker(root)
+
+    # Start the Tkinter main even loop, which keeps the GUI running
+    root.mainloop()
+
+# Run the main function when the script is executed, so the BrregAPI can be imported by other modules
+if __name__ == '__main__':
+    main()
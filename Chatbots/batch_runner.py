@@ -0,0 +1,308 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For checking for an earlier output file
+import json # For the JSONL output
+import time # For the rate limiter and timings
+import random # For adding jitter to retry delays
+import argparse # For the command line batch runs
+import threading # For sharing the rate limiter between worker threads
+from concurrent.futures import ThreadPoolExecutor, as_completed # For concurrent completions
+import openai # For recognizing rate limit and transient API errors
+from completions import create_completion # Chat completions shared by both chatbots
+from key_figures import answer_from_key_figures, key_figure_context # Metric questions answered from the statement tables
+from llm_cache import get_completion_cache # Shared cache of completion replies
+from perf_metrics import metrics # Per-stage timings, token usage and cache hits
+from report_retrieval import as_report_text # For building the BM25 index of large reports up front
+from token_budget import count_tokens # For estimating the tokens of each request
+import financial_report_bot as bot # Report lookup, ingestion and the prompt used by the GUI
+
+# ==============================================================================
+# Part 2 - Requests and Tokens per Minute Rate Limiter
+# ==============================================================================
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by all worker threads.
+
+    After a 429 every worker pauses and the rates are cut back; while requests succeed they
+    grow back to the configured limits.
+    """
+
+    def __init__(self, rpm, tpm, burst_seconds=10, min_factor=0.1):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst_seconds = burst_seconds # Azure evaluates the limits over short windows, so bursts are kept small
+        self.min_factor = min_factor
+        self.factor = 1.0 # Share of the configured rates currently used
+        self._requests = self._request_capacity()
+        self._tokens = self._token_capacity()
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"throttled": 0, "waits": 0, "wait_seconds": 0.0}
+
+    def _request_capacity(self):
+        return max(1.0, self.rpm * self.burst_seconds / 60)
+
+    def _token_capacity(self):
+        return max(1.0, self.tpm * self.burst_seconds / 60)
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self._request_capacity(), self._requests + elapsed * self.rpm * self.factor / 60)
+        self._tokens = min(self._token_capacity(), self._tokens + elapsed * self.tpm * self.factor / 60)
+
+    def acquire(self, tokens):
+        """Block until a request of about `tokens` tokens may be sent"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self._paused_until - now
+                # A request larger than a burst waits for a full bucket, is charged in full and leaves
+                # the bucket in debt, so the requests after it wait until the tokens per minute are paid back
+                needed = min(tokens, self._token_capacity())
+                if delay <= 0:
+                    if self._requests >= 1 and self._tokens >= needed:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        if waited:
+                            self.stats["waits"] += 1
+                            self.stats["wait_seconds"] += waited
+                        return
+                    per_second = self.factor / 60
+                    delay = max((1 - self._requests) / (self.rpm * per_second),
+                                (needed - self._tokens) / (self.tpm * per_second), 0.01)
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self, retry_after=None):
+        """Pause every worker after a 429 and cut the rates"""
+        with self._lock:
+            now = time.monotonic()
+            self.factor = max(self.min_factor, self.factor * 0.7)
+            self._paused_until = max(self._paused_until, now + (retry_after or 10))
+            self._requests = self._tokens = 0.0
+            self.stats["throttled"] += 1
+
+    def succeeded(self):
+        """Let the rates grow back after a successful request"""
+        with self._lock:
+            self.factor = min(1.0, self.factor + 0.02)
+
+def retry_after_seconds(error):
+    """Read the Retry-After delay of an API error, if the response has one"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+# ==============================================================================
+# Part 3 - Batch Runner with Checkpointing to JSONL
+# ==============================================================================
+class BatchRunner:
+    """Answers a fixed set of questions for many reports, writing one JSON line per answer.
+
+    The output file doubles as the checkpoint: (report, question) pairs already answered
+    successfully are skipped when a run is started again with the same output file.
+    """
+
+    def __init__(self, output_path, rpm=60, tpm=60000, concurrency=8, max_retries=6,
+                 max_context_tokens=bot.REPORT_TOKEN_BUDGET, use_key_figures=True, reports_per_batch=8):
+        self.output_path = output_path
+        self.limiter = RateLimiter(rpm, tpm)
+        self.concurrency = concurrency # Completions in flight at the same time
+        self.max_retries = max_retries
+        self.max_context_tokens = max_context_tokens
+        self.use_key_figures = use_key_figures # Answer metric questions from the key figure store when possible
+        self.reports_per_batch = reports_per_batch # Reports ingested together (and held in memory)
+        self.cache = get_completion_cache()
+        self.stats = {"answered": 0, "failed": 0, "skipped": 0, "cached": 0, "key_figures": 0}
+
+    def completed(self):
+        """Return the (report, question) pairs answered successfully by earlier runs"""
+        done = set()
+        if not os.path.exists(self.output_path):
+            return done
+        with open(self.output_path, encoding="utf-8") as output:
+            for line in output:
+                try:
+                    record = json.loads(line)
+                except ValueError: # A line cut off by an interrupted run
+                    continue
+                if record.get("status") == "ok":
+                    done.add((record["report"], record["question"]))
+        return done
+
+    def complete(self, request):
+        """Run one completion under the rate limits, retrying 429s and transient errors"""
+        if self.cache is not None:
+            key, near_key = self.cache.keys(**request)
+            reply = self.cache.get(key, near_key)
+            if reply is not None:
+                metrics.record("completion", cache_hits=1)
+                return reply, "cache"
+            metrics.record("completion", cache_misses=1)
+
+        tokens = sum(count_tokens(message["content"]) for message in request["messages"]) + request["max_tokens"]
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                reply = create_completion(bot.get_client(), **request)
+            except openai.RateLimitError as e:
+                if attempt == self.max_retries:
+                    raise
+                self.limiter.throttled(retry_after_seconds(e))
+            except (openai.APIConnectionError, openai.InternalServerError):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
+            else:
+                self.limiter.succeeded()
+                if self.cache is not None and reply:
+                    self.cache.put(key, near_key, reply)
+                return reply, "model"
+
+    def answer(self, blob_name, report, question):
+        """Answer one question about one report and return its output record"""
+        started = time.monotonic()
+        record = {"report": blob_name, "question": question}
+        try:
+            answer, key_figures = None, ""
+            if self.use_key_figures:
+                answer = answer_from_key_figures(question, [blob_name], bot.get_key_figure_store())
+                key_figures = key_figure_context(question, [blob_name], bot.get_key_figure_store()) if answer is None else ""
+                source = "key_figures"
+            if answer is None:
+                request = bot.build_report_request(question, {blob_name: report}, self.max_context_tokens, key_figures)
+                answer, source = self.complete(request)
+            record.update(status="ok", answer=answer, source=source)
+        except Exception as e:
+            record.update(status="error", error=f"{type(e).__name__}: {e}")
+        record["seconds"] = round(time.monotonic() - started, 3)
+        return record
+
+    def _ingest(self, blobs):
+        """Ingest a batch of reports and build the BM25 index of those too large to send whole.
+
+        Returns ({blob name: ReportText}, {blob name: error}). If the batch fails, its reports are
+        ingested one at a time, so a missing or corrupt PDF only fails its own questions.
+        """
+        errors = {}
+        try:
+            reports = bot.ingest_reports(blobs)
+        except Exception:
+            reports = {}
+            for blob_name, etag in blobs.items():
+                try:
+                    reports.update(bot.ingest_reports({blob_name: etag}))
+                except Exception as e:
+                    errors[blob_name] = f"{type(e).__name__}: {e}"
+        for blob_name, report in reports.items():
+            if count_tokens(report.text) > self.max_context_tokens:
+                bot.get_report_index_store().get(as_report_text(blob_name, report)) # Built once, not by every question
+        return reports, errors
+
+    def run(self, report_names, questions, on_record=None):
+        """Answer every question for every report (given as 'Company 2020' or as blob names)"""
+        catalog = bot.get_report_catalog()
+        catalog.refresh() # One paginated listing instead of a lookup per report
+        done = self.completed()
+
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            def write(record):
+                self.stats["answered" if record["status"] == "ok" else "failed"] += 1
+                if record.get("source") in ("cache", "key_figures"):
+                    self.stats["cached" if record["source"] == "cache" else "key_figures"] += 1
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush() # Every finished answer survives an interruption
+                if on_record is not None:
+                    on_record(record)
+
+            # Resolve the reports and drop the questions answered by earlier runs
+            work = {}
+            for name in report_names:
+                blob_name = name if name in catalog.etags else catalog.find(name)
+                if blob_name is None:
+                    for question in questions:
+                        write({"report": name, "question": question, "status": "error", "error": "No matching report"})
+                    continue
+                todo = [question for question in questions if (blob_name, question) not in done]
+                self.stats["skipped"] += len(questions) - len(todo)
+                if todo:
+                    work.setdefault(blob_name, []).extend(todo)
+
+            blob_names = list(work)
+            batches = [blob_names[i:i + self.reports_per_batch] for i in range(0, len(blob_names), self.reports_per_batch)]
+            prefetch = ThreadPoolExecutor(max_workers=1) # Ingests the next batch while this one is answered
+            pool = ThreadPoolExecutor(max_workers=self.concurrency)
+            try:
+                next_batch = prefetch.submit(self._ingest, {b: catalog.etags.get(b) for b in batches[0]}) if batches else None
+                for number in range(len(batches)):
+                    reports, errors = next_batch.result()
+                    for blob_name, error in errors.items():
+                        for question in work[blob_name]:
+                            write({"report": blob_name, "question": question, "status": "error", "error": error})
+                    if number + 1 < len(batches):
+                        next_batch = prefetch.submit(self._ingest, {b: catalog.etags.get(b) for b in batches[number + 1]})
+                    futures = [pool.submit(self.answer, blob_name, reports[blob_name], question)
+                               for blob_name in batches[number] if blob_name in reports
+                               for question in work[blob_name]]
+                    for future in as_completed(futures):
+                        write(future.result())
+            finally:
+                pool.shutdown(cancel_futures=True)
+                prefetch.shutdown(cancel_futures=True)
+        return self.stats
+
+# ==============================================================================
+# Part 4 - Command Line Interface
+# ==============================================================================
+def read_lines(path):
+    """Read the non-empty lines of a text file"""
+    with open(path, encoding="utf-8") as lines:
+        return [line.strip() for line in lines if line.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a set of questions for many annual reports without the GUI")
+    parser.add_argument("--questions", required=True, help="Text file with one question per line")
+    parser.add_argument("--reports", help="Text file with one report per line ('Equinor 2020' or a blob name)")
+    parser.add_argument("--report", action="append", default=[], help="A report to include (repeatable)")
+    parser.add_argument("--output", default="answers.jsonl", help="JSONL output, also used to resume a run")
+    parser.add_argument("--rpm", type=int, default=60, help="Requests per minute allowed by the deployment")
+    parser.add_argument("--tpm", type=int, default=60000, help="Tokens per minute allowed by the deployment")
+    parser.add_argument("--concurrency", type=int, default=8, help="Completions in flight at the same time")
+    parser.add_argument("--max-context-tokens", type=int, default=bot.REPORT_TOKEN_BUDGET,
+                        help="Report tokens sent with each question")
+    parser.add_argument("--no-key-figures", action="store_true", help="Always ask the model, even for metric questions")
+    parser.add_argument("--metrics-log", help="Write a JSON line per timed stage to this file ('-' for stderr)")
+    parser.add_argument("--metrics-prom", help="Write a Prometheus text snapshot of the stage timings to this file")
+    args = parser.parse_args()
+    if args.metrics_log or args.metrics_prom:
+        metrics.enable(args.metrics_log)
+
+    reports = (read_lines(args.reports) if args.reports else []) + args.report
+    questions = read_lines(args.questions)
+    runner = BatchRunner(args.output, rpm=args.rpm, tpm=args.tpm, concurrency=args.concurrency,
+                         max_context_tokens=args.max_context_tokens, use_key_figures=not args.no_key_figures)
+    started = time.monotonic()
+    try:
+        stats = runner.run(reports, questions,
+                           on_record=lambda record: print(f"{record['status']:5} {record['report']}: {record['question']}"))
+    finally:
+        bot.get_report_ingestor().close()
+    elapsed = time.monotonic() - started
+    print(f"{stats['answered']} answered ({stats['cached']} from the cache, {stats['key_figures']} from key figures), "
+          f"{stats['failed']} failed, {stats['skipped']} already done, in {elapsed:.1f}s")
+    print(f"Rate limiter: {runner.limiter.stats['throttled']} throttled, "
+          f"waited {runner.limiter.stats['wait_seconds']:.1f}s")
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+
+# Run the main function when the script is executed
+if __name__ == '__main__':
+    main()
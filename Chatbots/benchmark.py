@@ -0,0 +1,721 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For pointing the chatbot caches at a scratch directory
+import io # For building the gzipped bulk dumps in memory
+import csv # For the bulk lookup input file
+import sys # For the platform-specific peak RSS unit
+import gzip # For compressing the bulk dumps like Brreg does
+import json # For the fake API bodies and the results file
+import math # For nearest-rank percentiles
+import time # For timing the operations
+import random # For deterministic synthetic data
+import asyncio # For running the bulk enricher
+import hashlib # For file names of recorded responses and blob ETags
+import argparse # For the command line entry point
+import resource # For the peak resident set size of each scenario
+import tempfile # For the scratch directory of each scenario
+import threading # For serving the fakes next to the scenario
+import multiprocessing # Every scenario runs in a fresh process, so peak RSS is its own
+from queue import Empty # For noticing a scenario process that died without a result
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # Local stand-ins for the services
+from urllib.parse import urlsplit, parse_qsl, urlencode # For matching requests and building next links
+from Breg_bot import BrregAPI, HTTPTransport # Brreg client and pooled transport under test
+
+# ==============================================================================
+# Part 2 - Synthetic Brreg Data
+# ==============================================================================
+ENTITY_BASE = 900000000 # Organisation number of synthetic enhet 0
+SUB_ENTITY_BASE = 800000000 # Organisation number of synthetic underenhet 0
+KOMMUNER = [("0301", "OSLO"), ("4601", "BERGEN"), ("5001", "TRONDHEIM"), ("1103", "STAVANGER"), ("3201", "BÆRUM")]
+FORMS = [("AS", "Aksjeselskap"), ("ASA", "Allmennaksjeselskap"), ("ENK", "Enkeltpersonforetak"),
+         ("NUF", "Norskregistrert utenlandsk foretak"), ("DA", "Ansvarlig selskap med delt ansvar")]
+INDUSTRIES = [("62.010", "Programmeringstjenester"), ("47.110", "Butikkhandel med bredt vareutvalg"),
+              ("06.100", "Utvinning av råolje"), ("64.190", "Bankvirksomhet ellers"), ("41.200", "Oppføring av bygninger")]
+
+def make_entity(i):
+    """Deterministic enhet number i, shaped like the Brreg API documents"""
+    rng = random.Random(i)
+    kommunenummer, kommune = rng.choice(KOMMUNER)
+    form, form_name = rng.choice(FORMS)
+    industry, industry_name = rng.choice(INDUSTRIES)
+    return {
+        "organisasjonsnummer": str(ENTITY_BASE + i),
+        "navn": f"Firma {i} {form}",
+        "organisasjonsform": {"kode": form, "beskrivelse": form_name},
+        "registreringsdatoEnhetsregisteret": f"{1995 + i % 28}-0{1 + i % 9}-1{i % 10}",
+        "naeringskode1": {"kode": industry, "beskrivelse": industry_name},
+        "antallAnsatte": rng.randint(0, 500),
+        "forretningsadresse": {"adresse": [f"Storgata {i % 200 + 1}"], "postnummer": f"{rng.randint(1, 9989):04d}",
+                               "poststed": kommune, "kommunenummer": kommunenummer, "kommune": kommune},
+        "epostadresse": f"post@firma{i}.no",
+        "hjemmeside": f"www.firma{i}.no",
+        "stiftelsesdato": f"{1990 + i % 30}-02-03",
+        "sisteInnsendteAarsregnskap": str(2023 - i % 3),
+    }
+
+def make_sub_entity(i, entities):
+    """Deterministic underenhet number i, belonging to one of the first `entities` enheter"""
+    parent = make_entity(i % entities)
+    return dict(parent, organisasjonsnummer=str(SUB_ENTITY_BASE + i), navn=f"{parent['navn']} avd. {i}",
+                organisasjonsform={"kode": "BEDR", "beskrivelse": "Underenhet til næringsdrivende"},
+                overordnetEnhet=parent["organisasjonsnummer"],
+                beliggenhetsadresse=parent["forretningsadresse"])
+
+def make_roles(orgnr):
+    """Roles document of an enhet, with a daglig leder and a revisor"""
+    return {"rollegrupper": [
+        {"type": {"kode": "DAGL"}, "roller": [{"type": {"kode": "DAGL", "beskrivelse": "Daglig leder"},
+                                               "person": {"navn": {"fornavn": "Kari", "etternavn": f"Nordmann {orgnr[-3:]}"}}}]},
+        {"type": {"kode": "REVI"}, "roller": [{"type": {"kode": "REVI", "beskrivelse": "Revisor"},
+                                               "enhet": {"navn": ["REVISJON AS"]}}]},
+    ]}
+
+# ==============================================================================
+# Part 3 - Fake Brreg HTTP Server (recorded responses and paginated dumps)
+# ==============================================================================
+def request_key(path_and_query):
+    """Normalize a request path so the order of its query parameters does not matter"""
+    parts = urlsplit(path_and_query)
+    return parts.path + ("?" + urlencode(sorted(parse_qsl(parts.query))) if parts.query else "")
+
+class RecordingTransport(HTTPTransport):
+    """HTTPTransport that saves every JSON response, so real Brreg traffic can be replayed offline"""
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, url, headers=None, params=None, stream=False):
+        response = super().get(url, headers=headers, params=params, stream=stream)
+        if response.status_code == 200 and not stream:
+            parts = urlsplit(response.url)
+            key = request_key(parts.path + ("?" + parts.query if parts.query else ""))
+            name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+            with open(os.path.join(self.directory, f"{name}.json"), "w", encoding="utf-8") as output:
+                json.dump({"request": key, "status": 200, "body": response.json()}, output, ensure_ascii=False)
+        return response
+
+def load_recordings(directory):
+    """Read the responses saved by RecordingTransport into {request key: (status, body bytes)}"""
+    recordings = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as recording:
+                entry = json.load(recording)
+            recordings[entry["request"]] = (entry["status"], json.dumps(entry["body"], ensure_ascii=False).encode("utf-8"))
+    return recordings
+
+class _BrregHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like data.brreg.no
+
+    def do_GET(self):
+        fake = self.server.fake
+        fake.requests += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+        recorded = fake.recordings.get(request_key(self.path))
+        if recorded is not None:
+            return self._send(*recorded)
+
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        path = parts.path.removeprefix("/enhetsregisteret/api/").strip("/").split("/")
+        kind = path[0]
+        if kind not in ("enheter", "underenheter"):
+            return self._send(404, b'{"feilmelding": "Ukjent ressurs"}')
+        if len(path) == 2 and path[1] == "lastned":
+            return self._send(200, fake.dump(kind), "application/gzip")
+        if len(path) >= 2:
+            unit = fake.unit(kind, path[1])
+            if unit is None:
+                return self._send(404, b'{"feilmelding": "Fant ikke enhet"}')
+            body = make_roles(path[1]) if path[2:] == ["roller"] else unit
+            return self._send(200, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+        self._send(200, json.dumps(fake.search(kind, query, parts.path), ensure_ascii=False).encode("utf-8"))
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass # Keep the benchmark output clean
+
+class FakeBrregServer:
+    """Local HTTP stand-in for data.brreg.no with synthetic enheter and underenheter.
+
+    Serves searches (navn and organisasjonsnummer filters, paginated with next links), single
+    units, roles and the gzipped lastned dumps. Requests found in `recordings` are replayed
+    instead; `latency` adds a fixed delay to every request.
+    """
+
+    def __init__(self, entities=10000, sub_entities=None, latency=0.0, recordings=None):
+        self.entities = entities
+        self.sub_entities = entities // 2 if sub_entities is None else sub_entities
+        self.latency = latency
+        self.recordings = recordings or {}
+        self.requests = 0
+        self._dumps = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _BrregHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def api(self, pool_size=10):
+        """Return a BrregAPI talking to this server"""
+        api = BrregAPI(transport=HTTPTransport(pool_size=pool_size))
+        api.BASE_URL = self.url
+        return api
+
+    def unit(self, kind, orgnr):
+        """Return the enhet or underenhet with an organisation number, or None"""
+        if not orgnr.isdigit():
+            return None
+        base, count = (ENTITY_BASE, self.entities) if kind == "enheter" else (SUB_ENTITY_BASE, self.sub_entities)
+        i = int(orgnr) - base
+        if not 0 <= i < count:
+            return None
+        return make_entity(i) if kind == "enheter" else make_sub_entity(i, self.entities)
+
+    def search(self, kind, query, path):
+        """Build one result page of a search"""
+        if "organisasjonsnummer" in query:
+            units = [self.unit(kind, orgnr) for orgnr in query["organisasjonsnummer"].split(",")]
+            units = [unit for unit in units if unit is not None]
+        else:
+            count = self.entities if kind == "enheter" else self.sub_entities
+            make = make_entity if kind == "enheter" else (lambda i: make_sub_entity(i, self.entities))
+            name = query.get("navn", "").lower()
+            units = [unit for unit in map(make, range(count)) if name in unit["navn"].lower()]
+        page, size = int(query.get("page", 0)), int(query.get("size", 20))
+        pages = max(1, -(-len(units) // size))
+        body = {"_embedded": {kind: units[page * size:(page + 1) * size]},
+                "page": {"size": size, "totalElements": len(units), "totalPages": pages, "number": page},
+                "_links": {}}
+        if not body["_embedded"][kind]:
+            del body["_embedded"] # Brreg leaves out _embedded when nothing matched
+        if page + 1 < pages:
+            body["_links"]["next"] = {"href": f"{self.url}{path}?{urlencode(dict(query, page=page + 1))}"}
+        return body
+
+    def dump(self, kind):
+        """Return the gzipped JSON array of every unit of a kind (built once)"""
+        with self._lock:
+            if kind not in self._dumps:
+                buffer = io.BytesIO()
+                with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=1) as output:
+                    count = self.entities if kind == "enheter" else self.sub_entities
+                    output.write(b"[")
+                    for i in range(count):
+                        unit = make_entity(i) if kind == "enheter" else make_sub_entity(i, self.entities)
+                        output.write((b"," if i else b"") + json.dumps(unit, ensure_ascii=False).encode("utf-8"))
+                    output.write(b"]")
+                self._dumps[kind] = buffer.getvalue()
+            return self._dumps[kind]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# ==============================================================================
+# Part 4 - Fake Blob Container with Generated Annual Reports
+# ==============================================================================
+REPORT_WORDS = ("revenue operating income margin dividend cash flow investments capital expenditure "
+                "production emissions employees risk market outlook strategy segment growth debt equity "
+                "impairment guidance shareholders board sustainability costs efficiency contracts").split()
+
+def make_report_pdf(company, year, pages):
+    """Generate an annual report PDF: a letter, an income statement, a balance sheet and narrative pages"""
+    import fitz # PyMuPDF, only needed for the report scenarios
+    rng = random.Random(f"{company}-{year}")
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), f"{company} annual report {year}\nLetter from the CEO", fontsize=14)
+
+    for title, rows in (("Consolidated income statement", ("Revenues", "Operating income", "Net income")),
+                        ("Balance sheet", ("Total assets", "Total equity", "Total liabilities"))):
+        page = doc.new_page()
+        page.insert_text((72, 60), title, fontsize=14)
+        page.insert_text((72, 80), "(in NOK million)", fontsize=9)
+        for x, text in ((380, str(year)), (460, str(year - 1))):
+            page.insert_text((x, 100), text, fontsize=9)
+        for number, label in enumerate(rows):
+            y = 115 + 15 * number
+            page.insert_text((72, y), label, fontsize=9)
+            for x in (380, 460):
+                page.insert_text((x, y), f"{rng.randint(1, 99)} {rng.randint(100, 999)}", fontsize=9)
+
+    for number in range(3, pages):
+        page = doc.new_page()
+        text = " ".join(rng.choice(REPORT_WORDS) for _ in range(400)) # About 2,800 characters per page
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), f"{company} {year} - section {number}\n{text}", fontsize=8)
+    data = doc.tobytes(garbage=0)
+    doc.close()
+    return data
+
+class _BlobProperties:
+    def __init__(self, name, etag):
+        self.name = name
+        self.etag = etag
+        self.last_modified = None
+
+class _Download:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+    def chunks(self):
+        for start in range(0, len(self.data), 4 * 1024 * 1024):
+            yield self.data[start:start + 4 * 1024 * 1024]
+
+class _BlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.blob_name = name
+
+    def get_blob_properties(self):
+        return _BlobProperties(self.blob_name, self.container.etag(self.blob_name))
+
+    def download_blob(self, max_concurrency=1, **kwargs):
+        self.container.downloads += 1
+        return _Download(self.container.blob(self.blob_name))
+
+class _BlobPages:
+    def __init__(self, blobs, page_size):
+        self.blobs = blobs
+        self.page_size = page_size
+
+    def __iter__(self):
+        return iter(self.blobs)
+
+    def by_page(self, continuation_token=None):
+        for start in range(0, len(self.blobs), self.page_size):
+            yield iter(self.blobs[start:start + self.page_size])
+
+class FakeContainerClient:
+    """In-process stand-in for an Azure ContainerClient holding generated annual reports.
+
+    Reports are named like 'equinor-2022.pdf' and generated on first use (or all at once with
+    generate(), so generation is not part of a measurement).
+    """
+
+    def __init__(self, companies=("Equinor", "DNB", "Telenor", "Orkla", "Mowi", "Yara"), years=(2021, 2022, 2023),
+                 pages=300):
+        self.companies = list(companies)
+        self.pages = pages
+        self.names = {f"{company.lower()}-{year}.pdf": (company, year) for company in companies for year in years}
+        self.downloads = 0
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def blob(self, name):
+        """Return the PDF bytes of a blob"""
+        with self._lock:
+            if name not in self._blobs:
+                if name not in self.names:
+                    raise KeyError(f"The specified blob does not exist: {name}")
+                self._blobs[name] = make_report_pdf(*self.names[name], self.pages)
+            return self._blobs[name]
+
+    def etag(self, name):
+        """ETag of a blob, known without generating it since the content only depends on its name"""
+        return '"' + hashlib.md5(f"{name}:{self.pages}".encode("utf-8")).hexdigest() + '"'
+
+    def generate(self, names=None):
+        """Generate the given reports (all by default) ahead of the measurement"""
+        for name in names or self.names:
+            self.blob(name)
+
+    def list_blobs(self, name_starts_with=None, results_per_page=5000, **kwargs):
+        blobs = [_BlobProperties(name, self.etag(name))
+                 for name in sorted(self.names) if not name_starts_with or name.startswith(name_starts_with)]
+        return _BlobPages(blobs, results_per_page or 5000)
+
+    def get_blob_client(self, blob):
+        return _BlobClient(self, blob)
+
+# ==============================================================================
+# Part 5 - Fake Azure OpenAI Chat Completions Endpoint
+# ==============================================================================
+class _CompletionsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        fake = self.server.fake
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prompt_tokens = sum(len(message.get("content") or "") for message in request["messages"]) // 4
+        tokens = min(fake.reply_tokens, request.get("max_tokens") or fake.reply_tokens)
+        with fake.lock:
+            fake.calls += 1
+            fake.prompt_tokens += prompt_tokens
+            fake.completion_tokens += tokens
+        words = [REPORT_WORDS[(fake.calls + i) % len(REPORT_WORDS)] + " " for i in range(tokens)]
+        time.sleep(fake.latency) # Time to first token
+
+        if not request.get("stream"):
+            time.sleep(tokens / fake.tokens_per_second)
+            body = json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(words)}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                          "total_tokens": prompt_tokens + tokens},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = 5 # Tokens per streamed chunk
+        for start in range(0, tokens, step):
+            self._event({"role": "assistant", "content": "".join(words[start:start + step])}, None, request)
+            time.sleep(min(step, tokens - start) / fake.tokens_per_second)
+        self._event({}, "stop", request)
+        self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _event(self, delta, finish_reason, request):
+        event = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": request.get("model", "gpt-4o"),
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        self._chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+class FakeCompletionsServer:
+    """Local HTTP stand-in for an Azure OpenAI deployment.
+
+    Answers every chat completion (plain or streamed) with reply_tokens tokens after `latency`
+    seconds, then at tokens_per_second; the real AzureOpenAI client is pointed at it.
+    """
+
+    def __init__(self, latency=0.3, tokens_per_second=400.0, reply_tokens=150):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.calls = self.prompt_tokens = self.completion_tokens = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _CompletionsHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def client(self):
+        """Return an AzureOpenAI client talking to this server"""
+        from openai import AzureOpenAI
+        return AzureOpenAI(api_key="benchmark", api_version="2023-05-15", azure_endpoint=self.url, max_retries=0)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# ==============================================================================
+# Part 6 - Scenarios
+# ==============================================================================
+def percentile(samples, q):
+    """The q-th percentile (0-100) of a list of numbers, by nearest rank"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def timed(func, samples):
+    """Wrap func so the duration of every call is appended to samples"""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+    return wrapper
+
+def result(operations, unit, seconds, samples, **extra):
+    """Summarize a scenario run: throughput and p50/p99 latency in milliseconds"""
+    return {"operations": operations, "unit": unit, "seconds": round(seconds, 3),
+            "throughput": round(operations / seconds, 2) if seconds else None,
+            "p50_ms": round(percentile(samples, 50) * 1000, 2) if samples else None,
+            "p99_ms": round(percentile(samples, 99) * 1000, 2) if samples else None,
+            **extra}
+
+def _recordings(options):
+    """Recorded Brreg responses to replay, if a --recordings directory was given"""
+    return load_recordings(options.recordings) if options.recordings else None
+
+def bulk_lookups(options, scratch):
+    """Enrich a CSV of organisation numbers (with duplicates and invalid numbers) through the bulk enricher"""
+    from brreg_enrich import BulkEnricher
+    server = FakeBrregServer(options.entities, latency=options.brreg_latency, recordings=_recordings(options))
+    try:
+        rng = random.Random(0)
+        input_path = os.path.join(scratch, "lookups.csv")
+        with open(input_path, "w", newline="", encoding="utf-8") as output:
+            writer = csv.writer(output)
+            writer.writerow(["organisasjonsnummer"])
+            for i in range(options.lookups):
+                choice = rng.random()
+                if choice < 0.8:
+                    writer.writerow([ENTITY_BASE + rng.randrange(options.entities)])
+                elif choice < 0.95:
+                    writer.writerow([SUB_ENTITY_BASE + rng.randrange(server.sub_entities)])
+                else:
+                    writer.writerow(["12345"])
+
+        api = server.api(pool_size=options.concurrency)
+        samples = []
+        api._get = timed(api._get, samples) # Latency of every Brreg request
+        enricher = BulkEnricher(api=api, concurrency=options.concurrency, rate=1e6)
+        started = time.perf_counter()
+        stats = asyncio.run(enricher.enrich_csv(input_path, os.path.join(scratch, "enriched.csv"),
+                                                failures_path=os.path.join(scratch, "failures.csv")))
+        return result(stats["rows"], "rows", time.perf_counter() - started, samples,
+                      requests=stats["requests"], failed=stats["failed"])
+    finally:
+        server.close()
+
+def dump_export(options, scratch):
+    """Stream the enheter dump from the server and write it to CSV for Excel"""
+    server = FakeBrregServer(options.dump_entities, sub_entities=0)
+    try:
+        server.dump("enheter") # Built before the clock starts
+        api = server.api()
+        samples = [] # Seconds per 10,000 records
+        count = 0
+
+        def records():
+            nonlocal count
+            mark = time.perf_counter()
+            for record in api.iter_extract(api.iter_entities_dump()):
+                count += 1
+                if count % 10000 == 0:
+                    now = time.perf_counter()
+                    samples.append(now - mark)
+                    mark = now
+                yield record
+
+        started = time.perf_counter()
+        api.save_to_csv(records(), filename=os.path.join(scratch, "enheter.csv"))
+        return result(count, "records", time.perf_counter() - started, samples,
+                      latency_unit="per 10k records", dump_bytes=len(server.dump("enheter")))
+    finally:
+        server.close()
+
+def _report_bot(scratch, completions):
+    """Import financial_report_bot with its caches in scratch and the fakes in place of Azure"""
+    os.environ["REPORT_CACHE_DIR"] = os.path.join(scratch, "report_cache")
+    os.environ["KEY_FIGURE_DB"] = os.path.join(scratch, "key_figures.sqlite")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(scratch, "llm_cache.sqlite")
+    import financial_report_bot as bot
+    client = completions.client()
+    bot.get_client = lambda: client
+    return bot
+
+REPORT_QUESTIONS = [
+    "How did revenue and operating income develop compared to the year before?",
+    "What do the reports say about dividends and shareholder returns?",
+    "Compare the capital expenditure and investment plans.",
+    "Which risks do the companies highlight in their outlook?",
+    "How do the companies describe their sustainability and emissions targets?",
+    "What is said about debt, equity and financing?",
+]
+
+def report_comparison(options, scratch):
+    """Ingest several multi-hundred-page reports cold, then compare them across a set of questions"""
+    completions = FakeCompletionsServer(options.llm_latency, options.tokens_per_second, options.reply_tokens)
+    container = FakeContainerClient(pages=options.pages)
+    bot = _report_bot(scratch, completions)
+    bot.get_container_client = lambda: container
+    try:
+        catalog = bot.get_report_catalog()
+        catalog.refresh()
+        blobs = [catalog.find(f"{company} 2023") for company in container.companies[:options.reports]]
+        container.generate(blobs) # Generated before the clock starts
+        blobs = {name: catalog.etags[name] for name in blobs}
+
+        started = time.perf_counter()
+        reports = bot.ingest_reports(blobs)
+        ingest_seconds = time.perf_counter() - started
+        samples = []
+        analyze = timed(bot.ChatbotGUI.analyze_reports, samples)
+        questions = (REPORT_QUESTIONS * options.questions)[:options.questions]
+        for question in questions:
+            analyze(question, reports)
+        seconds = time.perf_counter() - started
+        bot.get_report_ingestor().close() # Joins the extraction processes, so their peak RSS is counted
+        return result(len(questions), "questions", seconds, samples, ingest_seconds=round(ingest_seconds, 3),
+                      pages=sum(report.page_count for report in reports.values()), model_calls=completions.calls,
+                      prompt_tokens=completions.prompt_tokens,
+                      workers_peak_rss_mb=peak_rss_mb(resource.RUSAGE_CHILDREN))
+    finally:
+        bot.get_report_ingestor().close()
+        completions.close()
+
+BRREG_QUESTIONS = [
+    "How many employees does the company have?",
+    "Where is the company located?",
+    "What industry is the company in?",
+    "When was the company founded?",
+    "What is the organisation form?",
+    "Which annual report was submitted last?",
+    "What is the website and e-mail address?",
+    "Summarize the company in two sentences.",
+]
+
+def repeat_questions(options, scratch):
+    """Ask the Brreg chatbot the same questions for several rounds, rephrased after the first"""
+    os.environ["LLM_CACHE_PATH"] = os.path.join(scratch, "llm_cache.sqlite")
+    import Breg_bot
+    from llm_cache import get_completion_cache
+    completions = FakeCompletionsServer(options.llm_latency, options.tokens_per_second, options.reply_tokens)
+    server = FakeBrregServer(options.entities, latency=options.brreg_latency, recordings=_recordings(options))
+    Breg_bot.client = completions.client()
+    try:
+        api = server.api()
+        records = api.extract_data(api.search_entities("Firma 42"))
+        samples = []
+        ask = timed(Breg_bot.ask_azure_openai, samples)
+        started = time.perf_counter()
+        for round_number in range(options.rounds):
+            for question in BRREG_QUESTIONS:
+                ask(question if round_number % 2 == 0 else f"Please tell me: {question.lower()}", records)
+        cache = get_completion_cache()
+        return result(len(samples), "questions", time.perf_counter() - started, samples,
+                      model_calls=completions.calls, cache_hit_ratio=round(cache.hit_ratio(), 3))
+    finally:
+        server.close()
+        completions.close()
+
+SCENARIOS = {
+    "bulk_lookups": bulk_lookups,
+    "dump_export": dump_export,
+    "report_comparison": report_comparison,
+    "repeat_questions": repeat_questions,
+}
+
+# ==============================================================================
+# Part 7 - Running Scenarios in Fresh Processes
+# ==============================================================================
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB (ru_maxrss is in KB on Linux and in bytes on macOS)"""
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _run_in_child(name, options, queue):
+    try:
+        with tempfile.TemporaryDirectory() as scratch:
+            outcome = SCENARIOS[name](options, scratch)
+        outcome["peak_rss_mb"] = peak_rss_mb()
+    except Exception as e:
+        outcome = {"error": f"{type(e).__name__}: {e}"}
+    queue.put(outcome)
+
+def run_scenario(name, options):
+    """Run one scenario in a new process and return its results"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_in_child, args=(name, options, queue))
+    process.start()
+    while True:
+        try:
+            outcome = queue.get(timeout=1)
+            break
+        except Empty:
+            if process.is_alive():
+                continue
+            try:
+                outcome = queue.get(timeout=1) # The result may still be in the pipe after the exit
+            except Empty:
+                process.join()
+                outcome = {"error": f"exit code {process.exitcode}"} # Killed, e.g. by the OOM killer
+            break
+    process.join()
+    return dict(scenario=name, **outcome)
+
+def compare(results, baseline):
+    """Print the change in throughput and p99 latency against an earlier results file"""
+    previous = {entry["scenario"]: entry for entry in baseline}
+    for entry in results:
+        before = previous.get(entry["scenario"])
+        if not before or "error" in entry or "error" in before:
+            continue
+        changes = []
+        for field in ("throughput", "p99_ms", "peak_rss_mb"):
+            if before.get(field) and entry.get(field) is not None:
+                changes.append(f"{field} {100 * (entry[field] - before[field]) / before[field]:+.1f}%")
+        print(f"  {entry['scenario']:18} " + ", ".join(changes))
+
+# ==============================================================================
+# Part 8 - Command Line Interface
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark both chatbots offline against local stand-ins for "
+                                                 "Brreg, Blob Storage and Azure OpenAI")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, all by default)")
+    parser.add_argument("--entities", type=int, default=20000, help="Enheter served by the fake Brreg API")
+    parser.add_argument("--lookups", type=int, default=5000, help="Rows in the bulk lookup input")
+    parser.add_argument("--dump-entities", type=int, default=200000, help="Enheter in the bulk dump")
+    parser.add_argument("--concurrency", type=int, default=16, help="Brreg requests in flight in bulk lookups")
+    parser.add_argument("--recordings", help="Directory of Brreg responses saved by RecordingTransport to replay")
+    parser.add_argument("--brreg-latency", type=float, default=0.005, help="Seconds added to every Brreg request")
+    parser.add_argument("--reports", type=int, default=4, help="Reports compared per question")
+    parser.add_argument("--pages", type=int, default=300, help="Pages per generated report")
+    parser.add_argument("--questions", type=int, default=4, help="Questions in the report comparison")
+    parser.add_argument("--rounds", type=int, default=4, help="Rounds of repeated Brreg questions")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds to the first token of a completion")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="Completion token throughput")
+    parser.add_argument("--reply-tokens", type=int, default=150, help="Tokens in every completion")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against the results JSON of an earlier run")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        outcome = run_scenario(name, args)
+        results.append(outcome)
+        if "error" in outcome:
+            print(f"{name:18} failed: {outcome['error']}")
+            continue
+        extra = {key: value for key, value in outcome.items() if key not in
+                 ("scenario", "operations", "unit", "seconds", "throughput", "p50_ms", "p99_ms", "peak_rss_mb")}
+        print(f"{name:18} {outcome['operations']} {outcome['unit']} in {outcome['seconds']}s "
+              f"({outcome['throughput']} {outcome['unit']}/s), p50 {outcome['p50_ms']} ms, p99 {outcome['p99_ms']} ms, "
+              f"peak RSS {outcome['peak_rss_mb']} MB {extra}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            print("Change against the baseline:")
+            compare(results, json.load(baseline))
+
+# Run the main function when the script is executed
+if __name__ == '__main__':
+    main()
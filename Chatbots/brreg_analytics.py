@@ -0,0 +1,330 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import re # For reading aggregate questions
+import argparse # For the command line builder
+from array import array # Compact buffers while streaming the dumps
+from Breg_bot import BrregAPI # Bulk dump iterators
+try:
+    import numpy as np # Columnar arrays and vectorized aggregation
+except ImportError: # numpy is only needed for the analytics engine
+    np = None
+
+# ==============================================================================
+# Part 2 - Columnar Tables with Categorical Codes
+# ==============================================================================
+KINDS = ("enheter", "underenheter")
+# Low-cardinality columns stored as int32 codes into a list of distinct values ("" is always code 0)
+CATEGORICAL_FIELDS = ("organisasjonsform", "naeringskode", "kommunenummer")
+NUMERIC_FIELDS = ("organisasjonsnummer", "antallAnsatte", "overordnetEnhet")
+PREFIX_FIELDS = ("naeringskode",) # Filters on these match code prefixes, e.g. '62' matches '62.010'
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("The analytics engine needs numpy, install it with 'pip install numpy'")
+
+class ColumnTable:
+    """The entities of one register as NumPy columns; categorical columns hold codes into self.categories"""
+
+    def __init__(self, columns, categories):
+        self.columns = columns # name -> ndarray, all of the same length
+        self.categories = categories # categorical name -> list of distinct values
+
+    def __len__(self):
+        return len(self.columns["organisasjonsnummer"])
+
+    @classmethod
+    def from_records(cls, records, kommune_names=None):
+        """Build a table from entity documents (any iterable, e.g. a streamed dump)"""
+        _require_numpy()
+        lookups = {name: {"": 0} for name in CATEGORICAL_FIELDS}
+        buffers = {name: array("i") for name in CATEGORICAL_FIELDS}
+        buffers.update(organisasjonsnummer=array("I"), antallAnsatte=array("i"), overordnetEnhet=array("I"))
+        for entity in records:
+            address = entity.get("forretningsadresse") or entity.get("beliggenhetsadresse") or {}
+            values = {
+                "organisasjonsform": entity.get("organisasjonsform", {}).get("kode", ""),
+                "naeringskode": entity.get("naeringskode1", {}).get("kode", ""),
+                "kommunenummer": address.get("kommunenummer", ""),
+            }
+            for name, value in values.items():
+                lookup = lookups[name]
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(lookup)
+                buffers[name].append(code)
+            buffers["organisasjonsnummer"].append(int(entity["organisasjonsnummer"]))
+            buffers["antallAnsatte"].append(int(entity.get("antallAnsatte") or 0))
+            buffers["overordnetEnhet"].append(int(entity.get("overordnetEnhet") or 0))
+            if kommune_names is not None and values["kommunenummer"]:
+                kommune_names.setdefault(values["kommunenummer"], address.get("kommune", ""))
+
+        columns = {name: np.frombuffer(buffer, dtype=np.int32 if buffer.typecode == "i" else np.uint32).copy()
+                   for name, buffer in buffers.items()}
+        return cls(columns, {name: list(lookup) for name, lookup in lookups.items()})
+
+    def codes_matching(self, name, value):
+        """Return the codes of a categorical column matching a value, a prefix or any of a list of values"""
+        wanted = [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+        if name in PREFIX_FIELDS:
+            return [code for code, category in enumerate(self.categories[name])
+                    if category and any(category.startswith(w) for w in wanted)]
+        return [code for code, category in enumerate(self.categories[name]) if category in wanted]
+
+# ==============================================================================
+# Part 3 - Vectorized Filter / Group-by / Count / Sum with the Parent Join
+# ==============================================================================
+class BrregAnalytics:
+    """Exact aggregates over every enhet and underenhet, computed with NumPy.
+
+    Underenheter are joined to their enhet through overordnetEnhet, so their filters and
+    groups can use the parent's fields as 'parent.<field>'.
+    """
+
+    def __init__(self, tables, kommune_names):
+        _require_numpy()
+        self.tables = tables # kind -> ColumnTable
+        self.kommune_names = kommune_names # kommunenummer -> kommune name
+        self._link_parents()
+
+    def _link_parents(self):
+        """Precompute the row of the parent enhet of every underenhet (-1 if it is not in the register)"""
+        entities, sub_entities = self.tables["enheter"], self.tables["underenheter"]
+        orgnrs = entities.columns["organisasjonsnummer"]
+        parents = sub_entities.columns["overordnetEnhet"]
+        if not len(orgnrs):
+            sub_entities.columns["parent"] = np.full(len(parents), -1, dtype=np.int64)
+            return
+        order = np.argsort(orgnrs, kind="stable")
+        rows = order[np.searchsorted(orgnrs, parents, sorter=order).clip(0, len(orgnrs) - 1)]
+        sub_entities.columns["parent"] = np.where(orgnrs[rows] == parents, rows, -1).astype(np.int64)
+
+    @classmethod
+    def build(cls, entities, sub_entities):
+        """Build the engine from two iterables of entity documents"""
+        kommune_names = {}
+        return cls({"enheter": ColumnTable.from_records(entities, kommune_names),
+                    "underenheter": ColumnTable.from_records(sub_entities, kommune_names)}, kommune_names)
+
+    @classmethod
+    def from_dumps(cls, entities_source=None, sub_entities_source=None, api=None):
+        """Build the engine from the bulk downloads (local files, or streamed from Brreg if None)"""
+        api = api or BrregAPI()
+        return cls.build(api.iter_entities_dump(entities_source), api.iter_sub_entities_dump(sub_entities_source))
+
+    def save(self, path):
+        """Write every column and category list to one .npz file"""
+        arrays = {}
+        for kind, table in self.tables.items():
+            for name, column in table.columns.items():
+                if name != "parent":
+                    arrays[f"{kind}/{name}"] = column
+            for name, categories in table.categories.items():
+                arrays[f"{kind}/{name}/categories"] = np.array(categories, dtype=str)
+        arrays["kommune/numbers"] = np.array(list(self.kommune_names), dtype=str)
+        arrays["kommune/names"] = np.array(list(self.kommune_names.values()), dtype=str)
+        with open(path, "wb") as out:
+            np.savez(out, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load an engine written by save()"""
+        _require_numpy()
+        with np.load(path) as data:
+            tables = {}
+            for kind in KINDS:
+                columns = {name: data[f"{kind}/{name}"] for name in NUMERIC_FIELDS + CATEGORICAL_FIELDS}
+                categories = {name: data[f"{kind}/{name}/categories"].tolist() for name in CATEGORICAL_FIELDS}
+                tables[kind] = ColumnTable(columns, categories)
+            kommune_names = dict(zip(data["kommune/numbers"].tolist(), data["kommune/names"].tolist()))
+        return cls(tables, kommune_names)
+
+    def _column(self, kind, name):
+        """Return (table, codes or values) for a field, following 'parent.' into the enheter table"""
+        table = self.tables[kind]
+        if name.startswith("parent."):
+            if kind != "underenheter":
+                raise ValueError("Only underenheter have a parent")
+            parent_table = self.tables["enheter"]
+            field = name[len("parent."):]
+            parent = table.columns["parent"]
+            values = parent_table.columns[field][np.maximum(parent, 0)]
+            return parent_table, field, np.where(parent >= 0, values, 0) # Code 0 / value 0 without a parent
+        return table, name, table.columns[name]
+
+    def mask(self, kind="enheter", **filters):
+        """Boolean mask of the rows matching every filter.
+
+        Categorical filters take a value or a list (naeringskode matches prefixes); numeric
+        filters take a value or a (low, high) range, either end may be None.
+        """
+        table = self.tables[kind]
+        mask = np.ones(len(table), dtype=bool)
+        for name, value in filters.items():
+            if value is None:
+                continue
+            source, field, column = self._column(kind, name)
+            if field in CATEGORICAL_FIELDS:
+                mask &= np.isin(column, source.codes_matching(field, value))
+            elif isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    mask &= column >= low
+                if high is not None:
+                    mask &= column <= high
+            else:
+                mask &= column == value
+        return mask
+
+    def aggregate(self, kind="enheter", group_by=None, measure=None, filters=None, group_prefix=None, limit=None):
+        """Count (and sum measure) over the filtered rows, optionally per group.
+
+        group_by is a categorical field (or 'parent.<field>'); group_prefix groups codes by their
+        first characters, e.g. 2 for NACE divisions. Returns [(group, count, sum)] largest first.
+        """
+        mask = self.mask(kind, **(filters or {}))
+        weights = None
+        if measure is not None:
+            weights = self._column(kind, measure)[2][mask].astype(np.float64)
+        if group_by is None:
+            return [("all", int(mask.sum()), float(weights.sum()) if weights is not None else None)]
+
+        source, field, codes = self._column(kind, group_by)
+        codes = codes[mask]
+        categories = source.categories[field]
+        if group_prefix:
+            labels = sorted({category[:group_prefix] for category in categories})
+            remap = np.array([labels.index(category[:group_prefix]) for category in categories], dtype=np.int32)
+            codes, categories = remap[codes], labels
+        counts = np.bincount(codes, minlength=len(categories))
+        sums = np.bincount(codes, weights=weights, minlength=len(categories)) if weights is not None else None
+        order = np.argsort(-(sums if sums is not None else counts), kind="stable")
+        rows = [(categories[code] or "(none)", int(counts[code]), float(sums[code]) if sums is not None else None)
+                for code in order if counts[code]]
+        return rows[:limit] if limit else rows
+
+    def group_label(self, group_by, value):
+        """Readable label of a group, e.g. '0301 OSLO' for a kommunenummer"""
+        if group_by.endswith("kommunenummer") and value in self.kommune_names:
+            return f"{value} {self.kommune_names[value]}"
+        return value
+
+# ==============================================================================
+# Part 4 - Answering Aggregate Questions in the Chatbot
+# ==============================================================================
+AGGREGATE_PATTERN = re.compile(r"\b(how many|number of|count|total|sum of|antall|hvor mange)\b", re.I)
+# Wording that makes a count or sum about the population of the register rather than one company
+REGISTER_PATTERN = re.compile(
+    r"\b(all|every|companies|firms|businesses|entities|organi[sz]ations|enheter|underenheter|sub-?entities|"
+    r"branches|establishments|selskaper|foretak|bedrifter|alle|register|registeret|enhetsregisteret|registered|registrert|"
+    r"nationwide|norway|norge)\b", re.I)
+# With a company in the entity field, unit words alone ("How many establishments?") are about that company
+REGISTER_WIDE_PATTERN = re.compile(
+    r"\b(all|every|alle|register|registeret|enhetsregisteret|registered|registrert|nationwide|norway|norge)\b", re.I)
+# References to one company ("How many branches does it have?")
+PRONOUN_PATTERN = re.compile(r"\b(it|its|they|their|them|(the|this) company|dens|selskapet|firmaet|foretaket|bedriften)\b",
+                             re.I)
+GROUP_PATTERNS = [
+    (re.compile(r"\b(by|per|fordelt på)\s+(kommune|municipalit\w*)", re.I), "kommunenummer", None),
+    (re.compile(r"\b(by|per|fordelt på)\s+(industry|industries|nace|sector|næring\w*)", re.I), "naeringskode", 2),
+    (re.compile(r"\b(by|per|fordelt på)\s+(organi[sz]ation form|company form|form|type|organisasjonsform)", re.I),
+     "organisasjonsform", None),
+]
+EMPLOYEE_PATTERN = re.compile(r"\b(employees?|employee count|ansatte|staff|headcount)\b", re.I)
+SUB_ENTITY_PATTERN = re.compile(r"\b(underenhet\w*|sub-?entit\w*|branch\w*|establishments?)\b", re.I)
+NACE_PATTERN = re.compile(r"\b(?:nace|næringskode|naeringskode|industry code)\s*([\d.]+\d)", re.I)
+ORGNR_PATTERN = re.compile(r"\b\d{3}\s?\d{3}\s?\d{3}\b")
+# Capitalized words that do not name a company
+COMMON_NAMES = frozenset("i norway norge nace brreg enhetsregisteret brønnøysund".split())
+
+def names_entity(question, analytics, entity_name=None):
+    """True if the question is about one company: it has an org number, the entity name, or a proper name.
+
+    Capitalized words other than the first are taken as names unless they are an organisation
+    form code, a kommune or a known register word.
+    """
+    if ORGNR_PATTERN.search(question):
+        return True
+    lowered = question.lower()
+    if entity_name and entity_name.strip() and entity_name.strip().lower() in lowered:
+        return True
+    known = {name.lower() for name in analytics.kommune_names.values()} | COMMON_NAMES
+    forms = {form for table in analytics.tables.values() for form in table.categories["organisasjonsform"]}
+    for word in re.findall(r"[\wÆØÅæøå-]+", question)[1:]:
+        if word[0].isupper() and word not in forms and word.lower() not in known:
+            return True
+    return False
+
+def parse_aggregate_question(question, analytics, entity_name=None):
+    """Turn a question like 'employee count by kommune for ASA companies in NACE 62' into aggregate() arguments.
+
+    Returns None unless the question asks for a breakdown, or for a count or sum over the
+    register, without naming a single company or organisation number or referring to one ('How
+    many branches does it have?'). With a company in the entity field, a count also needs
+    register-wide wording: 'How many establishments?' is about that company, 'How many branches
+    are registered in Bergen?' is not.
+    """
+    grouped = [(field, prefix) for pattern, field, prefix in GROUP_PATTERNS if pattern.search(question)]
+    if not grouped and not (AGGREGATE_PATTERN.search(question) and REGISTER_PATTERN.search(question)):
+        return None
+    if names_entity(question, analytics, entity_name) or PRONOUN_PATTERN.search(question):
+        return None
+    if entity_name and entity_name.strip() and not (grouped or REGISTER_WIDE_PATTERN.search(question)):
+        return None
+    kind = "underenheter" if SUB_ENTITY_PATTERN.search(question) else "enheter"
+    query = {"kind": kind, "filters": {}}
+    if grouped:
+        query["group_by"], query["group_prefix"] = grouped[0]
+    if EMPLOYEE_PATTERN.search(question):
+        query["measure"] = "antallAnsatte"
+
+    forms = set(analytics.tables[kind].categories["organisasjonsform"])
+    wanted_forms = [word for word in re.findall(r"\b[A-ZÆØÅ]{2,5}\b", question) if word in forms]
+    if wanted_forms:
+        query["filters"]["organisasjonsform"] = wanted_forms
+    nace = NACE_PATTERN.search(question)
+    if nace:
+        query["filters"]["naeringskode"] = nace.group(1)
+    lowered = question.lower()
+    kommuner = [number for number, name in analytics.kommune_names.items()
+                if name and re.search(rf"\b(i|in)\s+{re.escape(name.lower())}\b", lowered)]
+    if kommuner:
+        query["filters"]["kommunenummer"] = kommuner
+
+    return query
+
+def describe_aggregate(analytics, query, max_groups=50):
+    """Run an aggregate query and write it as a compact table for the prompt"""
+    rows = analytics.aggregate(**query)
+    filters = ", ".join(f"{name}={value}" for name, value in query["filters"].items()) or "none"
+    header = [f"Exact aggregate over the {query['kind']} of the Enhetsregisteret (filters: {filters})."]
+    group_by = query.get("group_by")
+    measure = query.get("measure")
+    columns = [group_by or "group", "count"] + ([f"sum of {measure}"] if measure else [])
+    lines = [" | ".join(columns)]
+    for group, count, total in rows[:max_groups]:
+        label = analytics.group_label(group_by, group) if group_by else group
+        lines.append(" | ".join([label, str(count)] + ([f"{total:.0f}"] if measure else [])))
+    if len(rows) > max_groups:
+        rest = rows[max_groups:]
+        lines.append(f"(and {len(rest)} more groups with {sum(row[1] for row in rest)} entities)")
+    return "\n".join(header + lines)
+
+# ==============================================================================
+# Part 5 - Command Line Builder
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Build the columnar analytics file from the Brreg bulk downloads")
+    parser.add_argument("--output", default="brreg_columns.npz", help="Path of the columnar file")
+    parser.add_argument("--entities", help="Local enheter JSON dump (streamed from Brreg if left out)")
+    parser.add_argument("--sub-entities", help="Local underenheter JSON dump (streamed from Brreg if left out)")
+    args = parser.parse_args()
+
+    analytics = BrregAnalytics.from_dumps(args.entities, args.sub_entities)
+    analytics.save(args.output)
+    print(f"{len(analytics.tables['enheter'])} enheter and {len(analytics.tables['underenheter'])} underenheter "
+          f"written to {args.output}")
+
+# Run the main function when the script is executed
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import re # For matching URLs against the per-endpoint TTL rules
+import json # For decoding cached response bodies
+import zlib # For compressing cached response bodies on disk
+import time # For expiry and LRU timestamps
+import sqlite3 # Persistent on-disk backend that survives restarts
+import threading # For sharing one cache between threads
+from urllib.parse import urlencode # For building stable cache keys
+
+# ==============================================================================
+# Part 2 - Per-endpoint TTL Rules
+# ==============================================================================
+HOUR = 3600
+DAY = 24 * HOUR
+
+# (URL path pattern, time to live in seconds). The first matching rule wins, a TTL of 0 disables caching.
+DEFAULT_TTLS = [
+    (r"/api/oppdateringer/", 0), # Update feeds must always be read live
+    (r"/lastned", 0), # Bulk downloads are streamed, never cached
+    (r"/api/organisasjonsformer", 7 * DAY), # Reference data that almost never changes
+    (r"/api/roller/(rolletyper|rollegruppetyper)", 7 * DAY),
+    (r"/enhetsregisteret/api/?$", 7 * DAY), # Root service listing
+    (r"/api/(enheter|underenheter)/\d+(/roller)?$", 6 * HOUR), # Popular single-entity lookups
+    (r"/api/(enheter|underenheter)$", 15 * 60), # Searches
+]
+
+# ==============================================================================
+# Part 3 - Disk-backed LRU Response Cache
+# ==============================================================================
+class CacheEntry:
+    """A cached response body with its validators"""
+    __slots__ = ("body", "etag", "last_modified", "expires_at")
+
+    def __init__(self, body, etag, last_modified, expires_at):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires_at
+
+    def json(self):
+        """Decode the cached JSON body"""
+        return json.loads(zlib.decompress(self.body))
+
+    def validators(self):
+        """Conditional request headers for revalidating a stale entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class ResponseCache:
+    """Persistent HTTP response cache with per-endpoint TTLs, LRU eviction and revalidation"""
+
+    def __init__(self, path="brreg_cache.sqlite", max_bytes=256 * 1024 * 1024, ttls=None):
+        self.max_bytes = max_bytes # Upper bound for the compressed bodies kept on disk
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls if ttls is not None else DEFAULT_TTLS)]
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def ttl_for(self, url):
+        """Return the time to live for a URL, or 0 if it should not be cached"""
+        path = url.split("?", 1)[0]
+        for pattern, ttl in self.ttls:
+            if pattern.search(path):
+                return ttl
+        return 0
+
+    def lookup(self, url, params=None, headers=None):
+        """Return (key, entry) for a request; key is None if the URL is not cacheable"""
+        if not self.ttl_for(url):
+            return None, None
+        key = self._key(url, params, headers)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT body, etag, last_modified, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return key, None
+            entry = CacheEntry(*row)
+            if entry.fresh:
+                self.stats["hits"] += 1
+                with self.conn:
+                    self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            else:
+                self.stats["misses"] += 1 # Counted as a hit instead if the server answers 304
+        return key, entry
+
+    def store(self, key, url, response):
+        """Store a 200 response and evict least recently used entries above max_bytes"""
+        body = zlib.compress(response.content)
+        now = time.time()
+        with self._lock, self.conn:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, body, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                 now + self.ttl_for(url), now, len(body)))
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self.stats["stores"] += 1
+            self._evict()
+
+    def refresh(self, key, url):
+        """Extend a stale entry after the server confirmed it with 304 Not Modified"""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?",
+                              (now + self.ttl_for(url), now, key))
+            self.stats["misses"] -= 1
+            self.stats["revalidated"] += 1
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.stats["evictions"] += 1
+
+    @staticmethod
+    def _key(url, params, headers):
+        """Build a cache key from the URL, sorted query parameters and Accept header"""
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        accept = (headers or {}).get("Accept", "")
+        return f"{url}?{query}|{accept}"
+
+    def hit_ratio(self):
+        """Share of lookups answered without downloading the body again"""
+        served = self.stats["hits"] + self.stats["revalidated"]
+        total = served + self.stats["misses"]
+        return served / total if total else 0.0
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+            self.total_bytes = 0
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
@@ -0,0 +1,246 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import re # For cleaning organisation numbers
+import csv # For streaming the input and output files
+import time # For the rate limiter and the run summary
+import asyncio # For overlapping many lookups without a thread per organisation number
+import argparse # For the command line entry point
+from functools import partial # For handing blocking calls to the executor
+from concurrent.futures import ThreadPoolExecutor # Runs the pooled requests calls
+from Breg_bot import BrregAPI, HTTPTransport, ENTITY_FIELDS # Brreg client, pooled transport and record fields
+
+# ==============================================================================
+# Part 2 - Global Rate Limiter
+# ==============================================================================
+class AsyncRateLimiter:
+    """Token bucket shared by every lookup, so the whole run stays under Brreg's request rate"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate # Requests per second
+        self.burst = burst or max(1.0, rate) # Requests allowed back to back
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock: # Waiters are served in order
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+# ==============================================================================
+# Part 3 - Bulk Enrichment of Organisation Numbers
+# ==============================================================================
+ENRICH_FIELDS = ("registertype", "overordnetEnhet") + ENTITY_FIELDS + ("roller",)
+
+def clean_orgnr(value):
+    """Return a 9-digit organisation number, or None if the value is not one"""
+    digits = re.sub(r"[\s.\-]", "", str(value or ""))
+    return digits if len(digits) == 9 and digits.isdigit() else None
+
+def summarize_roles(document):
+    """Summarize the current roles of an entity as 'Daglig leder: Kari Nordmann; ...'"""
+    roles = []
+    for group in (document or {}).get("rollegrupper", []):
+        for role in group.get("roller", []):
+            if role.get("fratraadt"):
+                continue
+            person = role.get("person", {}).get("navn")
+            if person:
+                holder = " ".join(person.get(part) for part in ("fornavn", "mellomnavn", "etternavn") if person.get(part))
+            else:
+                holder = " ".join(role.get("enhet", {}).get("navn", []))
+            roles.append(f"{role.get('type', {}).get('beskrivelse', '')}: {holder}")
+    return "; ".join(roles)
+
+class BulkEnricher:
+    """Looks up many organisation numbers with bounded concurrency under a global rate limit.
+
+    Numbers are deduplicated and looked up batch_size at a time with the organisasjonsnummer
+    search filter, first as enheter and then, for those not found, as underenheter. Roles can
+    only be fetched one entity at a time.
+    """
+
+    def __init__(self, api=None, concurrency=16, rate=10.0, batch_size=100, include_roles=True, window=5000):
+        self.api = api or BrregAPI(transport=HTTPTransport(pool_size=concurrency))
+        self.concurrency = concurrency # Requests in flight at the same time
+        self.rate = rate # Requests per second for the whole run
+        self.batch_size = batch_size # Organisation numbers per search request
+        self.include_roles = include_roles
+        self.window = window # Input rows read ahead of the output
+        self.stats = {"rows": 0, "unique": 0, "requests": 0, "enriched": 0, "failed": 0}
+
+    async def _call(self, func, *args, **kwargs):
+        """Run a blocking BrregAPI call in the executor, within the rate limit and concurrency bound"""
+        await self._limiter.acquire()
+        async with self._semaphore:
+            self.stats["requests"] += 1
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _lookup_batch(self, orgnrs, futures):
+        """Look up a batch of organisation numbers and resolve their futures with (fields, error)"""
+        results = {}
+        try:
+            for registertype, search, key in (("enhet", self.api.search_entities, "enheter"),
+                                              ("underenhet", self.api.search_sub_entities, "underenheter")):
+                missing = [orgnr for orgnr in orgnrs if orgnr not in results]
+                if not missing:
+                    break
+                page = await self._call(search, organisasjonsnummer=missing, size=len(missing))
+                if page is None:
+                    raise RuntimeError(f"{key} lookup failed")
+                for unit in page.get("_embedded", {}).get(key, []):
+                    results[unit["organisasjonsnummer"]] = (registertype, unit)
+
+            roles = {}
+            if self.include_roles:
+                entities = [orgnr for orgnr, (registertype, _) in results.items() if registertype == "enhet"]
+                documents = await asyncio.gather(*(self._call(self.api.fetch_roles_for_entity, orgnr)
+                                                   for orgnr in entities))
+                roles = dict(zip(entities, documents))
+
+            for orgnr in orgnrs:
+                if orgnr not in results:
+                    futures[orgnr].set_result((None, "not found"))
+                    continue
+                if orgnr in roles and roles[orgnr] is None: # A failed roles call is not the same as no roles
+                    futures[orgnr].set_result((None, "roles lookup failed"))
+                    continue
+                registertype, unit = results[orgnr]
+                record = next(BrregAPI.iter_extract([unit]))
+                fields = dict(zip(ENRICH_FIELDS, (registertype, unit.get("overordnetEnhet", "")) + tuple(record) +
+                                  (summarize_roles(roles.get(orgnr)),)))
+                futures[orgnr].set_result((fields, None))
+        except Exception as e:
+            for orgnr in orgnrs:
+                if not futures[orgnr].done():
+                    futures[orgnr].set_result((None, f"{type(e).__name__}: {e}"))
+
+    async def iter_enriched(self, rows, column="organisasjonsnummer", ordered=True):
+        """Yield (row, fields, error) for every input row, in input order or as lookups finish"""
+        loop = asyncio.get_running_loop()
+        self._limiter = AsyncRateLimiter(self.rate)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        window = asyncio.Semaphore(self.window) # Stops reading when this many rows wait for output
+        queue = asyncio.Queue()
+        futures = {} # orgnr -> future shared by every row with that number
+        tasks = []
+        produced = 0
+
+        async def produce():
+            nonlocal produced
+            batch = []
+            for row in rows:
+                if window.locked() and batch:
+                    # The output may be waiting for this batch, so send it before blocking on the window
+                    tasks.append(asyncio.ensure_future(self._lookup_batch(batch, futures)))
+                    batch = []
+                await window.acquire()
+                orgnr = clean_orgnr(row.get(column))
+                if orgnr is None:
+                    future = loop.create_future()
+                    future.set_result((None, "invalid organisation number"))
+                elif orgnr in futures:
+                    future = futures[orgnr] # Duplicates share one lookup
+                else:
+                    future = futures[orgnr] = loop.create_future()
+                    batch.append(orgnr)
+                    if len(batch) == self.batch_size:
+                        tasks.append(asyncio.ensure_future(self._lookup_batch(batch, futures)))
+                        batch = []
+                produced += 1
+                if ordered:
+                    queue.put_nowait((row, future))
+                else:
+                    future.add_done_callback(lambda done, row=row: queue.put_nowait((row, done)))
+            if batch:
+                tasks.append(asyncio.ensure_future(self._lookup_batch(batch, futures)))
+            queue.put_nowait(None) # End of input; the number of rows is now in produced
+
+        producer = asyncio.ensure_future(produce())
+        yielded, total = 0, None
+        try:
+            while total is None or yielded < total:
+                item = await queue.get()
+                if item is None:
+                    total = produced
+                    continue
+                row, future = item
+                fields, error = await future
+                yielded += 1
+                window.release()
+                self.stats["rows"] += 1
+                self.stats["enriched" if error is None else "failed"] += 1
+                yield row, fields, error
+            await producer
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self.stats["unique"] = len(futures)
+
+    async def enrich_csv(self, input_path, output_path, column="organisasjonsnummer", ordered=True, failures_path=None):
+        """Stream an input CSV to an output CSV with the Brreg fields appended to every row.
+
+        Rows that could not be enriched keep empty Brreg columns, and their organisation numbers
+        are written to failures_path (same column name, so the file can be fed back in).
+        """
+        with open(input_path, newline="", encoding="utf-8-sig") as input_file, \
+                open(output_path, "w", newline="", encoding="utf-8") as output_file:
+            reader = csv.DictReader(input_file)
+            column = column if column in reader.fieldnames else reader.fieldnames[0]
+            brreg_columns = [f"brreg_{field}" for field in ENRICH_FIELDS]
+            writer = csv.writer(output_file)
+            writer.writerow(reader.fieldnames + brreg_columns)
+            failures_file = open(failures_path, "w", newline="", encoding="utf-8") if failures_path else None
+            try:
+                failures = csv.writer(failures_file) if failures_file else None
+                if failures:
+                    failures.writerow([column, "error"])
+                async for row, fields, error in self.iter_enriched(reader, column, ordered):
+                    writer.writerow([row.get(name, "") for name in reader.fieldnames] +
+                                    [(fields or {}).get(field, "") for field in ENRICH_FIELDS])
+                    if error is not None and failures:
+                        failures.writerow([row.get(column, ""), error])
+            finally:
+                if failures_file:
+                    failures_file.close()
+        return self.stats
+
+# ==============================================================================
+# Part 4 - Command Line Interface
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Enrich a CSV of organisation numbers with Brreg data")
+    parser.add_argument("input", help="CSV file with an organisation number column")
+    parser.add_argument("output", help="CSV file to write the enriched rows to")
+    parser.add_argument("--column", default="organisasjonsnummer", help="Name of the organisation number column")
+    parser.add_argument("--failures", default="enrich_failures.csv", help="CSV of organisation numbers to retry")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at the same time")
+    parser.add_argument("--rate", type=float, default=10.0, help="Requests per second for the whole run")
+    parser.add_argument("--batch-size", type=int, default=100, help="Organisation numbers per search request")
+    parser.add_argument("--no-roles", action="store_true", help="Skip the per-entity roles lookups")
+    parser.add_argument("--unordered", action="store_true", help="Write rows as they finish instead of in input order")
+    args = parser.parse_args()
+
+    enricher = BulkEnricher(concurrency=args.concurrency, rate=args.rate, batch_size=args.batch_size,
+                            include_roles=not args.no_roles)
+    started = time.monotonic()
+    stats = asyncio.run(enricher.enrich_csv(args.input, args.output, args.column, not args.unordered, args.failures))
+    elapsed = time.monotonic() - started
+    print(f"{stats['rows']} rows ({stats['unique']} unique numbers): {stats['enriched']} enriched, "
+          f"{stats['failed']} failed, {stats['requests']} requests in {elapsed:.1f}s "
+          f"({stats['rows'] / elapsed if elapsed else 0:.0f} rows/s)")
+    print(enricher.api.transport.latency_summary())
+
+# Run the main function when the script is executed
+if __name__ == '__main__':
+    main()
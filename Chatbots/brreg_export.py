@@ -0,0 +1,134 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+from datetime import date # For parsing the ISO dates of the register
+from itertools import islice # For cutting the input into row groups
+from Breg_bot import BrregAPI, ENTITY_FIELDS # Extracted record schema shared with save_to_csv
+try:
+    import pyarrow as pa # Columnar in-memory format
+    import pyarrow.dataset as ds # Partitioned dataset writer
+    import pyarrow.parquet as pq # Parquet file writer
+except ImportError: # pyarrow is only needed for the columnar export
+    pa = ds = pq = None
+
+# ==============================================================================
+# Part 2 - Typed Schema for Extracted Entities
+# ==============================================================================
+DATE_FIELDS = ('registreringsdatoEnhetsregisteret', 'stiftelsesdato')
+# Low-cardinality text columns that are stored once per distinct value
+DICTIONARY_FIELDS = ('organisasjonsform', 'naeringskode1', 'postnummer', 'poststed', 'kommune', 'kommunenummer')
+# Codes and counts that are not part of EntityRecord but are what analytics group and sum by
+EXTRA_FIELDS = ('organisasjonsform_kode', 'naeringskode1_kode', 'antallAnsatte')
+
+def entity_schema():
+    """Arrow schema of the exported entity columns"""
+    if pa is None:
+        raise ImportError("The columnar export needs pyarrow, install it with 'pip install pyarrow'")
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    fields = []
+    for name in ENTITY_FIELDS:
+        if name in DATE_FIELDS:
+            fields.append(pa.field(name, pa.date32()))
+        elif name in DICTIONARY_FIELDS:
+            fields.append(pa.field(name, dictionary))
+        elif name == 'sisteInnsendteAarsregnskap':
+            fields.append(pa.field(name, pa.int16()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    fields.append(pa.field('organisasjonsform_kode', dictionary))
+    fields.append(pa.field('naeringskode1_kode', dictionary))
+    fields.append(pa.field('antallAnsatte', pa.int32()))
+    return pa.schema(fields)
+
+def _parse_date(value):
+    """Parse an ISO date, returning None for empty or malformed values"""
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def _parse_int(value):
+    """Parse an integer, returning None for empty or malformed values"""
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def _record_batch(entities, schema):
+    """Build one typed RecordBatch from a list of raw entity documents"""
+    columns = {name: [] for name in schema.names}
+    for entity, record in zip(entities, BrregAPI.iter_extract(entities)):
+        for name, value in zip(ENTITY_FIELDS, record):
+            if name in DATE_FIELDS:
+                value = _parse_date(value)
+            elif name == 'sisteInnsendteAarsregnskap':
+                value = _parse_int(value)
+            else:
+                value = value or None # Empty strings become nulls, which cost nothing in Parquet
+            columns[name].append(value)
+        columns['organisasjonsform_kode'].append((entity.get('organisasjonsform') or {}).get('kode'))
+        columns['naeringskode1_kode'].append((entity.get('naeringskode1') or {}).get('kode'))
+        columns['antallAnsatte'].append(_parse_int(entity.get('antallAnsatte')))
+
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(columns[field.name], pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _iter_batches(entities, schema, row_group_size):
+    """Cut an iterable of entity documents into typed RecordBatches"""
+    entities = iter(entities)
+    while True:
+        chunk = list(islice(entities, row_group_size)) # Only one row group is held in memory
+        if not chunk:
+            return
+        yield _record_batch(chunk, schema)
+
+# ==============================================================================
+# Part 3 - Writing Parquet/Arrow Files
+# ==============================================================================
+def export_entities(entities, path, file_format='parquet', partition_by_kommune=False,
+                    row_group_size=100_000, compression='zstd'):
+    """Write raw entity documents (API pages, iter_entities, bulk dump records) as typed columns.
+
+    With partition_by_kommune, path is a directory with one kommunenummer=<code> folder per
+    municipality. Returns the number of rows written.
+    """
+    if file_format not in ('parquet', 'arrow'):
+        raise ValueError(f"Unknown format '{file_format}', use 'parquet' or 'arrow'")
+    schema = entity_schema()
+    if isinstance(entities, dict):
+        embedded = entities.get('_embedded', {}) # A single result page
+        entities = embedded.get('enheter') or embedded.get('underenheter') or []
+
+    count = 0
+    def counted(batches):
+        nonlocal count
+        for batch in batches:
+            count += batch.num_rows
+            yield batch
+    batches = counted(_iter_batches(entities, schema, row_group_size))
+
+    if partition_by_kommune:
+        partitioning = ds.partitioning(pa.schema([schema.field('kommunenummer')]), flavor='hive')
+        file_options = None
+        if file_format == 'parquet':
+            file_options = ds.ParquetFileFormat().make_write_options(compression=compression)
+        ds.write_dataset(batches, path, schema=schema, format='parquet' if file_format == 'parquet' else 'ipc',
+                         partitioning=partitioning, file_options=file_options,
+                         max_rows_per_group=row_group_size, existing_data_behavior='overwrite_or_ignore')
+    elif file_format == 'parquet':
+        with pq.ParquetWriter(path, schema, compression=compression) as writer:
+            for batch in batches:
+                writer.write_batch(batch, row_group_size=row_group_size)
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+
+    print(f"Data saved to {path} ({count} rows)")
+    return count
@@ -0,0 +1,237 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import json # For the header of the on-disk index format
+import struct # For the fixed-size header length
+import argparse # For the command line index builder
+from array import array # Compact typed arrays instead of per-role Python objects
+from Breg_bot import BrregAPI, iter_dump_records # Roles download and streaming dump parser
+
+# ==============================================================================
+# Part 2 - Array-backed Person/Representative <-> Organisation Index
+# ==============================================================================
+BOARD_ROLES = ("LEDE", "NEST", "MEDL", "VARA", "OBS") # Chair, deputy chair, member, deputy member, observer
+FILE_MAGIC = b"BRROLES1" # Identifies the on-disk index format
+
+class RoleIndex:
+    """Bipartite index of role holders and organisations built from the total roles inventory.
+
+    Role holders are people (keyed by birth date and name) or representative entities (keyed by
+    organisation number). Every role is one edge (holder, organisation, role type, resigned flag)
+    stored in typed arrays, with CSR offsets for both directions.
+    """
+
+    def __init__(self):
+        self.holder_keys = [] # "P|<fodselsdato>|<name>" or "E|<orgnr>|<name>", indexed by holder id
+        self.holder_ids = {}
+        self.org_numbers = array("I") # Organisation number per org id
+        self.org_ids = {}
+        self.role_codes = [] # Interned role type codes, indexed by role id
+        self.role_ids = {}
+
+        # Edge arrays, in insertion order while building
+        self.edge_holder = array("I")
+        self.edge_org = array("I")
+        self.edge_role = array("B")
+        self.edge_resigned = array("B")
+
+        # CSR layout filled in by finalize(): edges sorted by holder and by organisation
+        self.holder_offsets = array("I")
+        self.holder_edges = array("I")
+        self.org_offsets = array("I")
+        self.org_edges = array("I")
+        self._names = None # Lower-case name -> holder ids, built on first name lookup
+
+    # --------------------------------------------------------------------------
+    # Building
+    # --------------------------------------------------------------------------
+    @classmethod
+    def build(cls, documents):
+        """Build an index from role documents (the totalbestand dump or fetch_roles_for_entity results)"""
+        index = cls()
+        for document in documents:
+            index.add_document(document)
+        index.finalize()
+        return index
+
+    def add_document(self, document, orgnr=None):
+        """Add the roles of one organisation"""
+        orgnr = int(orgnr or document["organisasjonsnummer"])
+        org_id = self.org_ids.get(orgnr)
+        if org_id is None:
+            org_id = self.org_ids[orgnr] = len(self.org_numbers)
+            self.org_numbers.append(orgnr)
+
+        for group in document.get("rollegrupper", []):
+            for role in group.get("roller", []):
+                holder_key = self._holder_key(role)
+                if holder_key is None:
+                    continue
+                holder_id = self.holder_ids.get(holder_key)
+                if holder_id is None:
+                    holder_id = self.holder_ids[holder_key] = len(self.holder_keys)
+                    self.holder_keys.append(holder_key)
+                code = role.get("type", {}).get("kode", "")
+                role_id = self.role_ids.get(code)
+                if role_id is None:
+                    role_id = self.role_ids[code] = len(self.role_codes)
+                    self.role_codes.append(code)
+
+                self.edge_holder.append(holder_id)
+                self.edge_org.append(org_id)
+                self.edge_role.append(role_id)
+                self.edge_resigned.append(1 if role.get("fratraadt") else 0)
+
+    @staticmethod
+    def _holder_key(role):
+        """Build the interned key of the person or entity holding a role"""
+        person = role.get("person")
+        if person:
+            name = person.get("navn", {})
+            full_name = " ".join(part for part in (name.get("fornavn"), name.get("mellomnavn"),
+                                                   name.get("etternavn")) if part)
+            return f"P|{person.get('fodselsdato', '')}|{full_name}"
+        entity = role.get("enhet")
+        if entity and entity.get("organisasjonsnummer"):
+            name = entity.get("navn", "")
+            if isinstance(name, list): # Entity names are returned as a list of lines
+                name = " ".join(name)
+            return f"E|{entity['organisasjonsnummer']}|{name}"
+        return None
+
+    def finalize(self):
+        """Sort the edges into CSR layout for holder -> orgs and org -> holders lookups"""
+        self.holder_offsets, self.holder_edges = self._csr(self.edge_holder, len(self.holder_keys))
+        self.org_offsets, self.org_edges = self._csr(self.edge_org, len(self.org_numbers))
+        self._names = None
+
+    @staticmethod
+    def _csr(keys, size):
+        """Counting sort of edge ids by key, returning (offsets, edge ids)"""
+        offsets = array("I", bytes(4 * (size + 1)))
+        for key in keys:
+            offsets[key + 1] += 1
+        for i in range(size):
+            offsets[i + 1] += offsets[i]
+        position = array("I", offsets[:-1]) if size else array("I")
+        edges = array("I", bytes(4 * len(keys)))
+        for edge, key in enumerate(keys):
+            edges[position[key]] = edge
+            position[key] += 1
+        return offsets, edges
+
+    # --------------------------------------------------------------------------
+    # Queries
+    # --------------------------------------------------------------------------
+    def find_holders(self, name, birth_date=None):
+        """Return holder ids whose name matches (case-insensitive), optionally with a birth date"""
+        if self._names is None:
+            self._names = {}
+            for holder_id, key in enumerate(self.holder_keys):
+                self._names.setdefault(key.split("|", 2)[2].lower(), []).append(holder_id)
+        holder_ids = self._names.get(" ".join(name.lower().split()), [])
+        if birth_date:
+            holder_ids = [h for h in holder_ids if self.holder_keys[h].split("|", 2)[1] == str(birth_date)]
+        return holder_ids
+
+    def roles_for_holder(self, holder_id, role_codes=None, include_resigned=False):
+        """Return (organisasjonsnummer, role code) for every role held by a holder id"""
+        results = []
+        for i in range(self.holder_offsets[holder_id], self.holder_offsets[holder_id + 1]):
+            edge = self.holder_edges[i]
+            if self.edge_resigned[edge] and not include_resigned:
+                continue
+            code = self.role_codes[self.edge_role[edge]]
+            if role_codes is None or code in role_codes:
+                results.append((f"{self.org_numbers[self.edge_org[edge]]:09d}", code))
+        return results
+
+    def boards_for_person(self, name, birth_date=None, include_resigned=False):
+        """Return {holder key: [(organisasjonsnummer, role code), ...]} of the board seats of a person"""
+        return {self.holder_keys[h]: self.roles_for_holder(h, BOARD_ROLES, include_resigned)
+                for h in self.find_holders(name, birth_date)}
+
+    def officers_of(self, orgnrs, role_codes=None, include_resigned=False):
+        """Return {organisasjonsnummer: [(holder key, role code), ...]} for many organisations at once"""
+        results = {}
+        for orgnr in orgnrs:
+            org_id = self.org_ids.get(int(orgnr))
+            officers = []
+            if org_id is not None:
+                for i in range(self.org_offsets[org_id], self.org_offsets[org_id + 1]):
+                    edge = self.org_edges[i]
+                    if self.edge_resigned[edge] and not include_resigned:
+                        continue
+                    code = self.role_codes[self.edge_role[edge]]
+                    if role_codes is None or code in role_codes:
+                        officers.append((self.holder_keys[self.edge_holder[edge]], code))
+            results[f"{int(orgnr):09d}"] = officers
+        return results
+
+    # --------------------------------------------------------------------------
+    # Fast reload format
+    # --------------------------------------------------------------------------
+    _ARRAYS = ("org_numbers", "edge_holder", "edge_org", "edge_role", "edge_resigned",
+               "holder_offsets", "holder_edges", "org_offsets", "org_edges")
+
+    def save(self, path):
+        """Write the index as a header plus the raw bytes of every array"""
+        keys_blob = "\n".join(self.holder_keys).encode("utf-8")
+        header = {
+            "role_codes": self.role_codes,
+            "keys_bytes": len(keys_blob),
+            "arrays": [(name, getattr(self, name).typecode, len(getattr(self, name))) for name in self._ARRAYS],
+        }
+        header_blob = json.dumps(header).encode("utf-8")
+        with open(path, "wb") as index_file:
+            index_file.write(FILE_MAGIC)
+            index_file.write(struct.pack("<Q", len(header_blob)))
+            index_file.write(header_blob)
+            index_file.write(keys_blob)
+            for name in self._ARRAYS:
+                getattr(self, name).tofile(index_file)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save()"""
+        index = cls()
+        with open(path, "rb") as index_file:
+            if index_file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"{path} is not a role index file")
+            header_length, = struct.unpack("<Q", index_file.read(8))
+            header = json.loads(index_file.read(header_length))
+            keys_blob = index_file.read(header["keys_bytes"]).decode("utf-8")
+            index.holder_keys = keys_blob.split("\n") if keys_blob else []
+            for name, typecode, length in header["arrays"]:
+                values = array(typecode)
+                values.fromfile(index_file, length)
+                setattr(index, name, values)
+        index.role_codes = header["role_codes"]
+        index.role_ids = {code: i for i, code in enumerate(index.role_codes)}
+        index.holder_ids = {key: i for i, key in enumerate(index.holder_keys)}
+        index.org_ids = {orgnr: i for i, orgnr in enumerate(index.org_numbers)}
+        return index
+
+# ==============================================================================
+# Part 3 - Building the Index from the Total Roles Download
+# ==============================================================================
+def build_role_index(index_path, dump_path=None, api=None):
+    """Build and save a RoleIndex from a downloaded totalbestand file (or stream it from the API)"""
+    api = api or BrregAPI()
+    documents = iter_dump_records(dump_path, "json") if dump_path else api.iter_total_roles_dump()
+    index = RoleIndex.build(documents)
+    index.save(index_path)
+    print(f"Indexed {len(index.edge_holder)} roles of {len(index.holder_keys)} holders "
+          f"in {len(index.org_numbers)} organisations to {index_path}")
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the role index from the total roles inventory")
+    parser.add_argument("--index", default="brreg_roles.idx", help="Path of the index file")
+    parser.add_argument("--dump", help="Downloaded totalbestand file (streamed from the API if omitted)")
+    args = parser.parse_args()
+    build_role_index(args.index, args.dump)
+
+# Run the main function when the script is executed
+if __name__ == '__main__':
+    main()
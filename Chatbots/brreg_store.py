@@ -0,0 +1,292 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For checking and creating snapshot files
+import json # For storing the full entity documents
+import sqlite3 # Embedded database engine with FTS5 full-text search
+import threading # For sharing one connection between the GUI and worker threads
+import time # For recording when the snapshot was built
+import argparse # For the command line snapshot builder
+from Breg_bot import BrregAPI, iter_dump_records # Live API and streaming dump parser
+
+# ==============================================================================
+# Part 2 - Local Snapshot Store for the Enhetsregisteret
+# ==============================================================================
+KINDS = ("enheter", "underenheter") # Entities and sub-entities are stored in separate tables
+
+# Query parameter -> indexed column used to filter searches the same way as the Brreg API
+FILTER_COLUMNS = {
+    "kommunenummer": "kommunenummer",
+    "naeringskode": "naeringskode",
+    "organisasjonsform": "organisasjonsform",
+    "overordnetEnhet": "overordnet_enhet",
+}
+
+class BrregStore:
+    """SQLite snapshot of the bulk downloads, indexed for the lookups the chatbot makes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL") # Readers are not blocked while syncing
+        self._lock = threading.Lock()
+        self._create_schema()
+
+    def _create_schema(self):
+        """Create the tables, indexes and full-text search tables if they are missing"""
+        with self._lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            for kind in KINDS:
+                # The organisation number doubles as the rowid, so lookups hit the table b-tree directly
+                self.conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {kind} (
+                        orgnr INTEGER PRIMARY KEY,
+                        navn TEXT,
+                        kommunenummer TEXT,
+                        naeringskode TEXT,
+                        organisasjonsform TEXT,
+                        overordnet_enhet TEXT,
+                        data TEXT NOT NULL
+                    )""")
+                for column in FILTER_COLUMNS.values():
+                    self.conn.execute(f"CREATE INDEX IF NOT EXISTS {kind}_{column} ON {kind} ({column})")
+                self.conn.execute(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {kind}_fts USING fts5(
+                        navn, content='{kind}', content_rowid='orgnr', prefix='2 3'
+                    )""")
+                self._create_fts_triggers(kind)
+
+    def _create_fts_triggers(self, kind):
+        """Keep the full-text index in step with single-row upserts and deletes"""
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {kind}_ai AFTER INSERT ON {kind} BEGIN
+                INSERT INTO {kind}_fts (rowid, navn) VALUES (new.orgnr, new.navn);
+            END""")
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {kind}_ad AFTER DELETE ON {kind} BEGIN
+                INSERT INTO {kind}_fts ({kind}_fts, rowid, navn) VALUES ('delete', old.orgnr, old.navn);
+            END""")
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {kind}_au AFTER UPDATE ON {kind} BEGIN
+                INSERT INTO {kind}_fts ({kind}_fts, rowid, navn) VALUES ('delete', old.orgnr, old.navn);
+                INSERT INTO {kind}_fts (rowid, navn) VALUES (new.orgnr, new.navn);
+            END""")
+
+    @staticmethod
+    def _row(entity):
+        """Turn an API/bulk document into a table row"""
+        address = entity.get("forretningsadresse") or entity.get("beliggenhetsadresse") or {}
+        return (
+            int(entity["organisasjonsnummer"]),
+            entity.get("navn", ""),
+            address.get("kommunenummer"),
+            (entity.get("naeringskode1") or {}).get("kode"),
+            (entity.get("organisasjonsform") or {}).get("kode"),
+            entity.get("overordnetEnhet"),
+            json.dumps(entity, ensure_ascii=False, separators=(",", ":")),
+        )
+
+    def build_from_dump(self, source, kind="enheter", batch_size=10000):
+        """Replace the kind table with the records of a JSON bulk download (path or file object)"""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind '{kind}', expected one of {KINDS}")
+        count = 0
+        with self._lock:
+            self.conn.execute("PRAGMA synchronous=OFF") # The snapshot can be rebuilt if the build is interrupted
+            with self.conn:
+                # Drop the per-row triggers and rebuild the full-text index once at the end instead
+                for suffix in ("ai", "ad", "au"):
+                    self.conn.execute(f"DROP TRIGGER IF EXISTS {kind}_{suffix}")
+                self.conn.execute(f"DELETE FROM {kind}")
+                batch = []
+                for entity in iter_dump_records(source, "json"):
+                    batch.append(self._row(entity))
+                    if len(batch) >= batch_size:
+                        self.conn.executemany(f"INSERT OR REPLACE INTO {kind} VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    self.conn.executemany(f"INSERT OR REPLACE INTO {kind} VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                    count += len(batch)
+                self.conn.execute(f"INSERT INTO {kind}_fts ({kind}_fts) VALUES ('rebuild')")
+                self._create_fts_triggers(kind)
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (f"{kind}_built_at", str(time.time())))
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA optimize")
+        return count
+
+    def upsert(self, kind, entities):
+        """Insert or replace entity documents, returning the number written"""
+        rows = [self._row(entity) for entity in entities]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f"""INSERT INTO {kind} VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (orgnr) DO UPDATE SET navn = excluded.navn,
+                        kommunenummer = excluded.kommunenummer, naeringskode = excluded.naeringskode,
+                        organisasjonsform = excluded.organisasjonsform,
+                        overordnet_enhet = excluded.overordnet_enhet, data = excluded.data""",
+                rows)
+        return len(rows)
+
+    def delete(self, kind, orgnrs):
+        """Delete entities by organisation number, returning the number removed"""
+        with self._lock, self.conn:
+            cursor = self.conn.executemany(f"DELETE FROM {kind} WHERE orgnr = ?", [(int(o),) for o in orgnrs])
+        return cursor.rowcount
+
+    def get(self, kind, orgnr):
+        """Return the stored document for an organisation number, or None"""
+        try:
+            key = int(str(orgnr).replace(" ", ""))
+        except ValueError:
+            return None
+        with self._lock:
+            row = self.conn.execute(f"SELECT data FROM {kind} WHERE orgnr = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def search(self, kind, name=None, page=0, size=20, **filters):
+        """Return (documents, total) for a name prefix search combined with Brreg-style filters"""
+        where = []
+        params = []
+        if name:
+            # Every word of the name must match the start of a word in the entity name
+            terms = [word.replace('"', '""') for word in name.split()]
+            match = " ".join(f'"{term}"*' for term in terms if term)
+            if match:
+                where.append(f"orgnr IN (SELECT rowid FROM {kind}_fts WHERE {kind}_fts MATCH ?)")
+                params.append(match)
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key == "organisasjonsnummer":
+                column = "orgnr"
+                values = [int(v) for v in self._split(value)]
+            elif key in FILTER_COLUMNS:
+                column = FILTER_COLUMNS[key]
+                values = self._split(value)
+            else:
+                raise ValueError(f"Filter '{key}' is not supported by the local snapshot")
+            if key == "naeringskode":
+                # Brreg matches industry codes by prefix, e.g. 62 matches 62.010 and 62.020
+                where.append("(" + " OR ".join(f"{column} GLOB ?" for _ in values) + ")")
+                params.extend(f"{v}*" for v in values)
+            else:
+                where.append(f"{column} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM {kind} {clause}", params).fetchone()[0]
+            rows = self.conn.execute(f"SELECT data FROM {kind} {clause} ORDER BY navn LIMIT ? OFFSET ?",
+                                     params + [size, page * size]).fetchall()
+        return [json.loads(row[0]) for row in rows], total
+
+    @staticmethod
+    def _split(value):
+        """Accept a comma-separated string or a list of filter values"""
+        if isinstance(value, (list, tuple, set)):
+            return [str(v) for v in value]
+        return [v.strip() for v in str(value).split(",") if v.strip()]
+
+    def get_meta(self, key, default=None):
+        """Read a value from the meta table (build times, sync cursors)"""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """Write a value to the meta table"""
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+# ==============================================================================
+# Part 3 - LocalBrregAPI served from the Snapshot
+# ==============================================================================
+class LocalBrregAPI(BrregAPI):
+    """BrregAPI whose entity searches and lookups are answered from a local BrregStore.
+
+    All other methods (roles, updates, downloads, ...) still go to the live API.
+    """
+
+    def __init__(self, store, transport=None):
+        super().__init__(transport)
+        self.store = store if isinstance(store, BrregStore) else BrregStore(store)
+
+    def search_entities(self, name=None, page=0, size=20, **filters):
+        """Search entities in the snapshot, returning a Brreg-shaped result page"""
+        return self._search("enheter", name, page, size, filters)
+
+    def iter_entities(self, name=None, page_size=100, **filters):
+        """Yield every matching entity from the snapshot"""
+        return self._iter("enheter", name, page_size, filters)
+
+    def fetch_entity(self, orgnr):
+        """Fetch an entity from the snapshot"""
+        return self.store.get("enheter", orgnr)
+
+    def search_sub_entities(self, name=None, page=0, size=20, **filters):
+        """Search sub-entities in the snapshot, returning a Brreg-shaped result page"""
+        return self._search("underenheter", name, page, size, filters)
+
+    def iter_sub_entities(self, name=None, page_size=100, **filters):
+        """Yield every matching sub-entity from the snapshot"""
+        return self._iter("underenheter", name, page_size, filters)
+
+    def fetch_sub_entity(self, orgnr):
+        """Fetch a sub-entity from the snapshot"""
+        return self.store.get("underenheter", orgnr)
+
+    def _search(self, kind, name, page, size, filters):
+        """Run a search and wrap the hits in the same HAL structure the API returns"""
+        documents, total = self.store.search(kind, name, page=page, size=size, **filters)
+        result = {"page": {"size": size, "totalElements": total,
+                           "totalPages": -(-total // size) if size else 0, "number": page}}
+        if documents:
+            result["_embedded"] = {kind: documents}
+        return result
+
+    def _iter(self, kind, name, page_size, filters):
+        """Yield all hits of a search, one page at a time"""
+        page = 0
+        while True:
+            documents, total = self.store.search(kind, name, page=page, size=page_size, **filters)
+            yield from documents
+            page += 1
+            if page * page_size >= total:
+                return
+
+# ==============================================================================
+# Part 4 - Building a Snapshot from the Bulk Downloads
+# ==============================================================================
+def build_snapshot(db_path, download_dir=".", api=None, keep_downloads=True):
+    """Download the entity and sub-entity dumps and load them into a BrregStore"""
+    api = api or BrregAPI()
+    store = BrregStore(db_path)
+    os.makedirs(download_dir, exist_ok=True)
+    downloads = (("enheter", api.download_entities), ("underenheter", api.download_sub_entities))
+    for kind, download in downloads:
+        dump_path = os.path.join(download_dir, f"{kind}.json.gz")
+        print(f"Downloading {kind} to {dump_path}...")
+        if not download(dest=dump_path):
+            raise RuntimeError(f"Could not download the {kind} dump")
+        count = store.build_from_dump(dump_path, kind)
+        print(f"Loaded {count} {kind} into {db_path}")
+        if not keep_downloads:
+            os.remove(dump_path)
+    return store
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a local snapshot of the Enhetsregisteret")
+    parser.add_argument("--db", default="brreg.sqlite", help="Path of the SQLite snapshot")
+    parser.add_argument("--download-dir", default=".", help="Where the bulk downloads are stored")
+    parser.add_argument("--remove-downloads", action="store_true", help="Delete the dumps after loading")
+    args = parser.parse_args()
+    build_snapshot(args.db, args.download_dir, keep_downloads=not args.remove_downloads).close()
+
+# Run the main function when the script is executed
+if __name__ == '__main__':
+    main()
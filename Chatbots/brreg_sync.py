@@ -0,0 +1,146 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import time # For timestamps of the sync runs
+import argparse # For the command line nightly refresh
+from datetime import datetime, timezone # For formatting the dato parameter of the update feeds
+from Breg_bot import BrregAPI # Live API used to read the update feeds and changed entities
+from brreg_store import BrregStore # Local copy of the register that is kept up to date
+
+# ==============================================================================
+# Part 2 - Incremental Sync Engine driven by the oppdateringer Endpoints
+# ==============================================================================
+# Per kind: update feed method, embedded key of the feed, and search method used to batch-fetch entities
+FEEDS = {
+    "enheter": ("fetch_entity_updates", "oppdaterteEnheter", "search_entities"),
+    "underenheter": ("fetch_sub_entity_updates", "oppdaterteUnderenheter", "search_sub_entities"),
+}
+
+DELETE_TYPES = ("Sletting", "Fjernet") # endringstype values meaning the unit left the register
+GONE_STATUSES = (404, 410) # Statuses of a unit lookup meaning the unit is not in the register
+SYNC_OVERLAP = 24 * 3600 # Start this many seconds before the snapshot build, since the dump is produced earlier
+
+class SyncEngine:
+    """Applies the Brreg update feeds to a BrregStore, remembering the last oppdateringsid processed"""
+
+    def __init__(self, store, api=None, page_size=10000, batch_size=100):
+        self.store = store if isinstance(store, BrregStore) else BrregStore(store)
+        self.api = api or BrregAPI() # Must be the live API, not a LocalBrregAPI on the same store
+        self.page_size = page_size # Number of updates read per feed request (Brreg allows up to 10000)
+        self.batch_size = batch_size # Number of organisation numbers fetched per search request
+
+    def sync(self, kind, since_date=None):
+        """Apply every update after the stored cursor and return counts of what changed"""
+        fetch_updates, embedded_key, _ = FEEDS[kind]
+        cursor_key = f"{kind}_oppdateringsid"
+        cursor = self.store.get_meta(cursor_key)
+        if cursor is None and since_date is None:
+            built_at = self.store.get_meta(f"{kind}_built_at")
+            if built_at is None:
+                raise RuntimeError(f"No sync cursor or snapshot build time for {kind}, pass since_date")
+            since_date = self._format_date(float(built_at) - SYNC_OVERLAP)
+
+        stats = {"updates": 0, "upserted": 0, "deleted": 0, "requests": 0}
+        while True:
+            if cursor is not None:
+                page = getattr(self.api, fetch_updates)(since_id=int(cursor) + 1, size=self.page_size)
+            else:
+                page = getattr(self.api, fetch_updates)(since_date=since_date, size=self.page_size)
+            stats["requests"] += 1
+            if page is None:
+                raise RuntimeError(f"Could not read the {kind} update feed")
+            updates = page.get("_embedded", {}).get(embedded_key, [])
+            if not updates:
+                break
+
+            upserted, deleted, requests_made = self._apply(kind, updates)
+            stats["updates"] += len(updates)
+            stats["upserted"] += upserted
+            stats["deleted"] += deleted
+            stats["requests"] += requests_made
+
+            # Store the cursor after every applied page, so an interrupted run continues from here
+            cursor = max(update["oppdateringsid"] for update in updates)
+            self.store.set_meta(cursor_key, cursor)
+            if len(updates) < self.page_size:
+                break
+
+        self.store.set_meta(f"{kind}_synced_at", time.time())
+        return stats
+
+    def sync_all(self):
+        """Sync entities and sub-entities"""
+        return {kind: self.sync(kind) for kind in FEEDS}
+
+    def _apply(self, kind, updates):
+        """Fetch the changed units of one feed page and upsert/delete them in the store"""
+        # Only the latest change per organisation number matters (the feed is ordered by oppdateringsid)
+        latest = {}
+        for update in updates:
+            latest[update["organisasjonsnummer"]] = update.get("endringstype")
+        removed = [orgnr for orgnr, change in latest.items() if change in DELETE_TYPES]
+        changed = [orgnr for orgnr, change in latest.items() if change not in DELETE_TYPES]
+
+        requests_made = 0
+        upserted = 0
+        search = getattr(self.api, FEEDS[kind][2])
+        for start in range(0, len(changed), self.batch_size):
+            batch = changed[start:start + self.batch_size]
+            page = search(organisasjonsnummer=batch, size=len(batch))
+            requests_made += 1
+            if page is None: # A failed request says nothing about the units, so the page is not applied
+                raise RuntimeError(f"Could not fetch the changed {kind}")
+            entities = page.get("_embedded", {}).get(kind, [])
+            returned = {entity["organisasjonsnummer"] for entity in entities}
+            # Units left out of the search result are looked up one by one; only 404/410 means deleted
+            for orgnr in batch:
+                if orgnr not in returned:
+                    entity = self._fetch_unit(kind, orgnr)
+                    requests_made += 1
+                    if entity is None:
+                        removed.append(orgnr)
+                    else:
+                        entities.append(entity)
+            current = [entity for entity in entities if not entity.get("slettedato")]
+            removed.extend(entity["organisasjonsnummer"] for entity in entities if entity.get("slettedato"))
+            upserted += self.store.upsert(kind, current)
+
+        deleted = self.store.delete(kind, removed) if removed else 0
+        return upserted, deleted, requests_made
+
+    def _fetch_unit(self, kind, orgnr):
+        """Fetch one unit; return None if Brreg answers 404/410 and raise on any other failure"""
+        url = f"{self.api.BASE_URL}/enhetsregisteret/api/{kind}/{orgnr}"
+        response = self.api.transport.get(url, headers=self.api.headers)
+        with response:
+            if response.status_code in GONE_STATUSES:
+                return None
+            if response.status_code != 200:
+                raise RuntimeError(f"Could not fetch {kind} {orgnr}: HTTP {response.status_code}")
+            return response.json()
+
+    @staticmethod
+    def _format_date(timestamp):
+        """Format a unix timestamp the way the dato parameter expects it"""
+        moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+# ==============================================================================
+# Part 3 - Nightly Refresh from the Command Line
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Apply the Brreg update feeds to a local snapshot")
+    parser.add_argument("--db", default="brreg.sqlite", help="Path of the SQLite snapshot")
+    parser.add_argument("--since", help="ISO 8601 start time if the snapshot has no sync cursor yet")
+    args = parser.parse_args()
+
+    engine = SyncEngine(args.db)
+    for kind in FEEDS:
+        stats = engine.sync(kind, since_date=args.since)
+        print(f"{kind}: {stats['updates']} updates, {stats['upserted']} upserted, "
+              f"{stats['deleted']} deleted using {stats['requests']} requests")
+    print(engine.api.transport.latency_summary())
+
+# Run the main function when the script is executed
+if __name__ == '__main__':
+    main()
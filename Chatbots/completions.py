@@ -0,0 +1,66 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+# The AzureOpenAI client and the CompletionCache are passed in by the chatbots, so this module has no setup of its own
+from perf_metrics import metrics # Per-stage timings, token usage and cache hits
+from token_budget import count_tokens # For the token usage of streamed replies, which Azure does not report
+
+# ==============================================================================
+# Part 2 - Chat Completions shared by both Chatbots
+# ==============================================================================
+def create_completion(client, messages, on_token=None, cancel_event=None, cache=None, question=None,
+                      data_version=None, **options):
+    """Run a chat completion and return the reply text.
+
+    With on_token, the reply is streamed and on_token(text) is called for every fragment as
+    it arrives. Setting cancel_event stops the stream and returns the text received so far.
+    With a CompletionCache, cached replies are returned without calling the model (and are not
+    streamed); question and data_version enable its near-duplicate tier.
+    """
+    with metrics.span("completion", model=options.get("model"), streamed=on_token is not None) as span:
+        if cache is not None:
+            key, near_key = cache.keys(messages, question, data_version, **options)
+            reply = cache.get(key, near_key)
+            if reply is not None:
+                span.set(cache_hits=1)
+                return reply
+            span.set(cache_misses=1)
+        reply = _complete(client, messages, on_token, cancel_event, span, **options)
+        if cache is not None and reply and not (cancel_event is not None and cancel_event.is_set()):
+            cache.put(key, near_key, reply) # Never cache a cut-off reply
+        return reply
+
+def _complete(client, messages, on_token, cancel_event, span, **options):
+    """Call the model, streaming when there is a token callback or a cancel event"""
+    if on_token is None and cancel_event is None:
+        response = client.chat.completions.create(messages=messages, **options)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        return response.choices[0].message.content
+
+    stream = client.chat.completions.create(messages=messages, stream=True, **options)
+    parts = []
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if not chunk.choices: # Azure sends the content filter results without choices
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if not parts:
+                    # Its own stage, so the time to first token gets a histogram instead of a sum
+                    metrics.record("completion_first_token", span.elapsed(), model=options.get("model"))
+                parts.append(text)
+                if on_token is not None:
+                    on_token(text)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close() # Release the connection, also when the stream was cancelled
+    reply = "".join(parts)
+    if metrics.enabled: # Counted locally, so only while the metrics are on
+        span.set(prompt_tokens=sum(count_tokens(message["content"]) for message in messages),
+                 completion_tokens=count_tokens(reply))
+    return reply
@@ -2,9 +2,20 @@
 # Part 1 - Install necessary packages
 # ==============================================================================
 import os # For interacting with environment variables
+from functools import lru_cache # For creating the Azure clients once, on first use
 from azure.storage.blob import BlobServiceClient #For interacting with Azure Blob Storage
 import fitz #PyMuPDF, used to extract text from PDFs
-from openai import AzureOpenAI # For interacting with Azure OpenAI GPT model's
+from report_cache import ReportTextCache # Persistent cache of extracted report text
+from report_ingest import ReportIngestor # Parallel download and page-level text extraction
+from report_catalog import ReportCatalog # Company -> year -> blob index with fuzzy matching
+from key_figures import KeyFigureStore, answer_from_key_figures, key_figure_context # Income/balance/cash-flow key figures
+from report_retrieval import ReportIndexStore, as_report_text, select_passages # BM25 passage retrieval
+from report_mapreduce import map_reduce # Per-report summaries for comparisons of many reports
+from token_budget import count_tokens # Local token counting for the prompt budget
+from completions import create_completion # Chat completions, streamed when the GUI asks for it
+from llm_cache import data_version, get_completion_cache # Shared cache of completion replies
+from gui_worker import GuiWorker # Runs downloads, parsing and completions off the Tk thread
+from perf_metrics import metrics # Per-stage timings of downloads, parsing, prompts and completions
 import tkinter as tk # For creating a graphical user interface (GUI)
 from tkinter import ttk, scrolledtext # Additional widgets for the GUI
 
@@ -15,12 +26,16 @@ from tkinter import ttk, scrolledtext # Additional widgets for the GUI
 os.environ["AZURE_OPENAI_API_KEY"] = "add API key here"
 os.environ["AZURE_OPENAI_ENDPOINT"] = "add endpoint here"
 
-# Initialize the Azure OpenAI client to interact with the GPT-4 models
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"), # Fetches API key from the environment variable
-    api_version="2023-05-15", # Version of  the API to use
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT") # Fetches the endpoint URL from the environment
-)
+# The clients are created on first use, so the GUI opens without waiting for Azure
+@lru_cache(maxsize=None)
+def get_client():
+    """Return the Azure OpenAI client used to interact with the GPT-4 models"""
+    from openai import AzureOpenAI # For interacting with Azure OpenAI GPT model's (slow to import, so done here)
+    return AzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"), # Fetches API key from the environment variable
+        api_version="2023-05-15", # Version of  the API to use
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT") # Fetches the endpoint URL from the environment
+    )
 
 # ==============================================================================
 # Part 2 - Azure Blob Storage Setup
@@ -30,53 +45,85 @@ connection_string = "DefaultEndpointsProtocol=https;AccountName=ban443;AccountKe
 # Specify the containter name
 container_name ="chatbot-data"
 
+@lru_cache(maxsize=None)
+def get_container_client():
+    """Return a Container Client to interact with the specified containter"""
+    # Create a BlobServiceClient object using the connection string
+    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+    return blob_service_client.get_container_client(container_name)
 
-# Create a BlobServiceClient object using the connection string
-blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-
-# Create a Container Client to interact with the specified containter
-container_client = blob_service_client.get_container_client(container_name)
-
-# Print available reports (blobs) stored in the Azure container
-print("Welcome to the this chatbot!")
-print("The reports you can ask questions about are the following: ")
-blobs=container_client.list_blobs()
-for blob in blobs:
-    print(" - ", blob.name) # Display each blob name(file name) that is available in the container
+@lru_cache(maxsize=None)
+def get_report_catalog():
+    """Return the company -> year -> report index over the container (listed lazily, page by page)"""
+    return ReportCatalog(get_container_client(), prefix=os.getenv("REPORT_PREFIX", ""))
 
 # ==============================================================================
 # Part 3 - Downloading and Extracting Text from PDFs
 # ==============================================================================
-# Function to download a PDF file from Azure Blob Storage and extract its text content
-def download_pdf(blob_name):
-    """Downloads PDF file from Azure Blob Storage and extracts text"""
-    blob_client = container_client.get_blob_client(blob_name) # Get the BlobClient for the file
-    pdf_content=blob_client.download_blob().readall() # Download the blob's content
+# The caches are opened on first use, so importing this module (e.g. from batch_runner or a
+# worker process) creates no files
+@lru_cache(maxsize=None)
+def get_report_cache():
+    """Return the on-disk cache of extracted text per blob version, so known reports are not downloaded or parsed again"""
+    return ReportTextCache(os.getenv("REPORT_CACHE_DIR", "report_cache"))
+
+@lru_cache(maxsize=None)
+def get_key_figure_store():
+    """Return the store of key figures from the statement tables, so direct metric questions skip the LLM"""
+    return KeyFigureStore(os.getenv("KEY_FIGURE_DB", "key_figures.sqlite"))
+
+# Downloads reports concurrently and extracts page ranges (and key figures) in a process pool
+@lru_cache(maxsize=None)
+def get_report_ingestor():
+    return ReportIngestor(get_container_client(), get_report_cache(), figure_store=get_key_figure_store())
 
-    #Save the PDF content to a local file
-    pdf_path = f'downloaded_{blob_name}'
-    with open(pdf_path, 'wb') as pdf_file:
-        pdf_file.write(pdf_content)
-
-    # Extract and return the text from the PDF file
-    return extract_text_from_pdf(pdf_path)
+# Function to download a PDF file from Azure Blob Storage and extract its text content
+def download_pdf(blob_name, etag=None):
+    """Downloads PDF file from Azure Blob Storage and extracts text, using the cache when possible"""
+    with metrics.span("download_pdf", blob=blob_name) as span:
+        text = download_pdfs({blob_name: etag})[blob_name]
+        span.set(chars=len(text))
+        return text
+
+# Function to download and extract several reports in parallel
+def download_pdfs(blobs, on_progress=None, cancel_event=None):
+    """Downloads {blob name: etag or None} concurrently and returns {blob name: text}.
+
+    Reports that were cancelled before they finished are left out of the result.
+    """
+    reports = ingest_reports(blobs, on_progress=on_progress, cancel_event=cancel_event)
+    return {blob_name: report.text for blob_name, report in reports.items()}
+
+# Function returning the extracted reports with their page offsets
+def ingest_reports(blobs, on_progress=None, cancel_event=None):
+    """Like download_pdfs, but returns {blob name: ReportText}"""
+    return get_report_ingestor().ingest(blobs, on_progress=on_progress, cancel_event=cancel_event)
+
+# Function to extract the text of every page from a PDF file or PDF bytes using PyMuPDF
+def extract_pages_from_pdf(pdf_source):
+    """Extracts the text of each page from a PDF path or PDF bytes"""
+    with metrics.span("extract_text_from_pdf") as span:
+        if isinstance(pdf_source, (bytes, bytearray)):
+            doc = fitz.open(stream=pdf_source, filetype="pdf") # Open the PDF from memory
+            span.set(bytes=len(pdf_source))
+        else:
+            doc = fitz.open(pdf_source)
+        with doc:
+            pages = [page.get_text() for page in doc]
+        span.set(pages=len(pages))
+        return pages
 
 # Function to extract text from a locally saved PDF file using PyMuPDF
 def extract_text_from_pdf(pdf_path):
-    """Extracts text from PDF file"""
-    text = " "
-    # Open the PDF file using PyMuPDF and extract text from each page
-    with fitz.open(pdf_path) as doc:
-        for page in doc:
-            text += page.get_text() # Append text from each page to the text variable
-    return text # Return the complete extracted text
+    """Extracts text from PDF file (a path or PDF bytes)"""
+    return "".join(extract_pages_from_pdf(pdf_path)) # Join the page texts once instead of appending per page
 
 # ==============================================================================
 # Part 4 - Function to Ask GPT-4 a Question
 # ==============================================================================
 # Function to ask GPT-4 a question based on the extracted PDF text and the user's question
-def ask_gpt4(question, context):
-    """Generates a response using GPT-4 based on a provided context and question."""
+def ask_gpt4(question, context, on_token=None, cancel_event=None):
+    """Generates a response using GPT-4 based on a provided context and question (streamed to on_token if given)."""
     # Create a prompt combining the PDF content and the user's question
     prompt = (
         f"The following is a summary of a financial year-end report:\n\n"
@@ -86,27 +133,75 @@ def ask_gpt4(question, context):
     )
 
     try:
-        # Send the prompt to Azure OpenAI GPT-4 and get a response
-        response = client.chat.completions.create(
-            model="GPT4o-API",  # GPT-4 deployment
-            messages=[
+        # Send the prompt to Azure OpenAI GPT-4 and return the response text
+        return create_completion(
+            get_client(),
+            [
                 {"role": "system", "content": "You are a helpful assistant analyzing financial reports."},
                 {"role": "user", "content": prompt}
             ],
+            on_token=on_token, # Called with each streamed piece of the answer
+            cancel_event=cancel_event, # Stops the stream when set
+            cache=get_completion_cache(), # Repeated or rephrased questions over the same report are answered at once
+            question=question,
+            data_version=data_version(context),
+            model="GPT4o-API",  # GPT-4 deployment
             max_tokens=1000, # Limit the response length
             temperature=0.3 # Control randomness in the response
         )
 
-        # Extract and return the response content
-        content = response.choices[0].message.content
-        return content # Return the resposne text
-
     except Exception as e:
         return f"Error with OpenAI API: {str(e)}" # Return the error message in case of failure
 
 # ==============================================================================
 # Part 5 - Main Chatbot GUI Class
 # ==============================================================================
+REPORT_TOKEN_BUDGET = 12000 # Maximum number of report tokens sent with a question
+MAP_REDUCE_MIN_REPORTS = 3 # Comparisons of this many reports that do not fit are summarized per report first
+
+# Persisted BM25 indexes, so analyze_reports only sends the passages relevant to a question
+@lru_cache(maxsize=None)
+def get_report_index_store():
+    """Return the BM25 indexes of the reports, kept next to their cached text"""
+    return ReportIndexStore(os.getenv("REPORT_CACHE_DIR", "report_cache"))
+
+@metrics.timed("report_prompt")
+def build_report_request(question, report_texts, max_context_tokens=REPORT_TOKEN_BUDGET, key_figures=""):
+    """Build the completion request (messages and options) for a question about one or more reports.
+
+    Shared by analyze_reports and the batch runner, so both send the same prompt. key_figures
+    are lines from the statement tables, sent along with the report text.
+    """
+    reports = {blob_name: as_report_text(blob_name, text) for blob_name, text in report_texts.items()}
+    if sum(count_tokens(report.text) for report in reports.values()) <= max_context_tokens:
+        prompt = "The following are summaries of annual reports:\n\n"
+        for i, (blob_name, report) in enumerate(reports.items(), 1):
+            prompt += f"Report {i} ({blob_name}):\n{report.text}\n\n"
+    else:
+        passages = select_passages(question, reports, get_report_index_store(), max_context_tokens)
+        prompt = "The following are the passages of annual reports most relevant to the question:\n\n"
+        for i, (blob_name, report_passages) in enumerate(passages.items(), 1):
+            prompt += f"Report {i} ({blob_name}):\n"
+            for page, text in report_passages:
+                prompt += f"[page {page + 1}] {text}\n"
+            prompt += "\n"
+
+    if key_figures:
+        prompt += f"Key figures from the statement tables of the reports:\n{key_figures}\n\n"
+    prompt += f"Based on the above reports, please answer the following question:\n{question}"
+
+    return {
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant analyzing financial reports."},
+            {"role": "user", "content": prompt}
+        ],
+        "question": question,
+        "data_version": data_version(key_figures, *((name, report.text) for name, report in reports.items())),
+        "model": "GPT4o-API",
+        "max_tokens": 1000,
+        "temperature": 0.3
+    }
+
 class ChatbotGUI:
     def __init__(self, master):
         """Initialize the GUI components and attach them to the master window"""
@@ -119,12 +214,14 @@ class ChatbotGUI:
 
         # Initialize instance attributes to store user input, blobs, and extracted text
         self.company_year_entry = None  # Input for the company names and years
-        self.report_names = []  # List of available report names (from blobs)
-        self.report_texts = {}  # Dictionary to store extracted text from the reports
+        self.report_texts = {}  # Dictionary to store extracted text (ReportText) from the reports
         self.current_blobs = []  # Store the names of the reports being analyzed
 
         self.create_widgets()  # Create the GUI widgets
-        self.load_blob_names()  # Load available report names from Blob Storage
+
+        # Network calls, parsing and completions run on a worker thread that posts back to the GUI
+        self.worker = GuiWorker(master)
+        self.load_blob_names()  # Index the available reports in the background
 
     def create_widgets(self):
         """Create input fields and buttons for the chatbot interface"""
@@ -138,80 +235,136 @@ class ChatbotGUI:
         self.question_entry = ttk.Entry(self.master, width=70)
         self.question_entry.pack(pady=5)
 
-        # Create and display a button to submit the question
-        ttk.Button(self.master, text="Ask", command=self.ask_question).pack(pady=10)
+        # Create and display buttons to submit the question and to cancel a running one
+        ttk.Button(self.master, text="Ask", command=self.ask_question).pack(pady=(10, 0))
+        ttk.Button(self.master, text="Cancel", command=self.cancel_question).pack(pady=5)
 
         # Scrollable text box for displaying the conversation
         self.chat_display = scrolledtext.ScrolledText(self.master, wrap=tk.WORD, width=80, height=20)
         self.chat_display.pack(padx=10, pady=10, expand=True, fill=tk.BOTH)
 
     def load_blob_names(self):
-        """Load available reports from the blob container"""
-        available_blobs = container_client.list_blobs()
-        self.report_names = [blob.name for blob in available_blobs]
+        """List the reports of the blob container in the background; questions can be asked meanwhile"""
+        get_report_catalog().start_refresh(
+            on_done=lambda count: self.worker.post(self.write, f"{count} reports are available.\n\n"),
+            on_error=lambda e: self.worker.post(self.show_error, e))
 
     def ask_question(self):
         """Handle the user's question and fetch the appropriate reports"""
         # Split the input by commas to handle multiple company-year pairs
-        company_years = [entry.strip().lower().replace(" ", "-") + ".pdf" for entry in self.company_year_entry.get().split(',') if entry]
+        company_years = [entry.strip() for entry in self.company_year_entry.get().split(',') if entry.strip()]
         question = self.question_entry.get()
 
         if not company_years or not question:
             self.chat_display.insert(tk.END, "Please enter at least one company name, year, and a question.\n\n")
             return
 
+        if self.worker.busy:
+            self.write("Please wait for the current request to finish, or press Cancel.\n\n")
+            return
+
+        # Show the question right away; progress and the streamed answer follow as they arrive
+        self.write(f"You: {question}\n")
+        self.question_entry.delete(0, tk.END)
+        self.worker.submit(self.answer_question, question, company_years,
+                           on_done=lambda text: self.write(f"{text}\n\n"), on_error=self.show_error)
+
+    def answer_question(self, task, question, company_years):
+        """Runs on the worker thread: finds and ingests the reports and streams the answer to the chat display"""
+        # Look up each company-year in the report index (exact, then prefix-listed, then fuzzy)
+        catalog = get_report_catalog()
         matching_blobs = []
         for company_year in company_years:
-            matching_blob = next((report_name for report_name in self.report_names if company_year in report_name.lower()), None)
-            if matching_blob:
+            matching_blob = catalog.find(company_year)
+            if matching_blob and matching_blob not in matching_blobs:
                 matching_blobs.append(matching_blob)
 
         if not matching_blobs:
-            self.chat_display.insert(tk.END, "No matching reports found.\n\n")
-            return
-
-        try:
-            # Download and extract text from each matching report
-            for blob in matching_blobs:
-                if blob not in self.current_blobs:
-                    self.report_texts[blob] = download_pdf(blob)
-                    self.current_blobs.append(blob)
-                    self.chat_display.insert(tk.END, f"Extracted text from {blob}...\n")
-
-            # Analyze or compare multiple reports using GPT-4
-            answer = self.analyze_reports(question, self.report_texts)
-            self.chat_display.insert(tk.END, f"Analyzing reports...\n")
-            self.chat_display.insert(tk.END, f"You: {question}\n")
-            self.chat_display.insert(tk.END, f"Bot: {answer}\n\n")
-        except Exception as e:
-            self.chat_display.insert(tk.END, f"Error: {str(e)}\n\n")
-
-        self.question_entry.delete(0, tk.END)
+            return "No matching reports found."
+
+        # Download and extract text from all new matching reports in parallel
+        new_blobs = {blob: catalog.etags.get(blob) for blob in matching_blobs if blob not in self.current_blobs}
+        if new_blobs:
+            reports = ingest_reports(new_blobs, on_progress=lambda *progress: task.post(self.show_progress, *progress),
+                                     cancel_event=task.cancel_event)
+            self.report_texts.update(reports)
+            for blob in reports:
+                self.current_blobs.append(blob)
+                task.post(self.write, f"Extracted text from {blob}...\n")
+        if task.cancelled:
+            return "Bot: (cancelled)"
+
+        # Answer pure metric lookups from the key figure store, without a model round trip
+        answer = answer_from_key_figures(question, matching_blobs, get_key_figure_store())
+        if answer is not None:
+            return f"Bot (from the statement tables): {answer}"
+        key_figures = key_figure_context(question, matching_blobs, get_key_figure_store()) # Other questions get them as context
+
+        # Analyze or compare only the reports named in this question using GPT-4, showing tokens as they arrive
+        task.post(self.write, "Analyzing reports...\nBot: ")
+        streamed = []
+
+        def on_token(text):
+            streamed.append(text)
+            task.post(self.write, text)
+
+        answer = self.analyze_reports(question, {blob: self.report_texts[blob] for blob in matching_blobs
+                                                 if blob in self.report_texts},
+                                      on_token=on_token, cancel_event=task.cancel_event,
+                                      on_progress=lambda done, total: task.post(self.show_summaries, done, total),
+                                      key_figures=key_figures)
+        if task.cancelled:
+            return " (cancelled)"
+        return answer if answer != "".join(streamed) else "" # Errors are not streamed, so show them here
+
+    def cancel_question(self):
+        """Stop the running request; reports that finished ingesting are kept"""
+        self.worker.cancel()
+
+    def write(self, text):
+        """Append text to the chat display (only called on the Tk thread)"""
+        self.chat_display.insert(tk.END, text)
         self.chat_display.see(tk.END)
 
-    @staticmethod
-    def analyze_reports(question, report_texts):
-        """Analyze multiple reports based on the provided question"""
-        prompt = "The following are summaries of annual reports:\n\n"
-        for i, (blob_name, text) in enumerate(report_texts.items(), 1):
-            prompt += f"Report {i} ({blob_name}):\n{text}\n\n"
+    def show_error(self, error):
+        self.write(f"Error: {str(error)}\n\n")
 
-        prompt += f"Based on the above reports, please answer the following question:\n{question}"
+    def show_progress(self, blob_name, stage, done_pages, total_pages):
+        """Show the ingestion progress of a report"""
+        if stage == "extracting":
+            self.write(f"{blob_name}: {done_pages}/{total_pages} pages extracted\n")
 
+    def show_summaries(self, done, total):
+        """Show how many report sections have been summarized for a comparison"""
+        self.write(f"[{done}/{total} report sections summarized] ")
+
+    @staticmethod
+    def analyze_reports(question, report_texts, max_context_tokens=REPORT_TOKEN_BUDGET, on_token=None, cancel_event=None,
+                        on_progress=None, key_figures=""):
+        """Analyze multiple reports based on the provided question.
+
+        If the full texts do not fit within max_context_tokens, only the BM25 best-matching
+        passages of each report are sent, or, when comparing MAP_REDUCE_MIN_REPORTS or more
+        reports, each report is summarized for the question first (on_progress(done, total)
+        follows the summaries). With on_token, the answer is streamed as it arrives.
+        """
         try:
-            response = client.chat.completions.create(
-                model="GPT4o-API",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant analyzing financial reports."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.3
+            reports = {blob_name: as_report_text(blob_name, text) for blob_name, text in report_texts.items()}
+            if (len(reports) >= MAP_REDUCE_MIN_REPORTS
+                    and sum(count_tokens(report.text) for report in reports.values()) > max_context_tokens):
+                return map_reduce(get_client(), question, reports, get_report_index_store(), cache=get_completion_cache(),
+                                  on_token=on_token, cancel_event=cancel_event, on_progress=on_progress,
+                                  key_figures=key_figures)
+
+            request = build_report_request(question, reports, max_context_tokens, key_figures)
+            return create_completion(
+                get_client(),
+                on_token=on_token,
+                cancel_event=cancel_event,
+                cache=get_completion_cache(),
+                **request
             )
 
-            content = response.choices[0].message.content
-            return content
-
         except Exception as e:
             return f"Error with OpenAI API: {str(e)}"
 
@@ -219,6 +372,8 @@ class ChatbotGUI:
 # Part 6 - Main Function to Run the GUI
 # ==============================================================================
 def main():
+    print("Welcome to the this chatbot!")
+    print("Ask about any company and year; the available reports are listed in the background.")
     root = tk.Tk()  # Create the main window
     ChatbotGUI(root)  # Create an instance of ChatbotGUI, attaching it to the main window
     root.mainloop()  # Start the Tkinter event loop to display the window
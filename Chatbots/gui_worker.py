@@ -0,0 +1,103 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import queue # Thread-safe queue for handing GUI updates to the Tk thread
+import threading # For the cancel flag of a running task
+import time # For bounding the work done per poll
+from concurrent.futures import ThreadPoolExecutor # Background thread running the requests
+
+# ==============================================================================
+# Part 2 - Background Tasks
+# ==============================================================================
+class BackgroundTask:
+    """A job running on the worker thread, with a cancel flag and a way to post GUI updates"""
+
+    def __init__(self, worker):
+        self.cancel_event = threading.Event() # Passed on to ingestion and streamed completions
+        self._worker = worker
+
+    def post(self, callback, *args):
+        """Run callback(*args) on the Tk thread"""
+        self._worker.post(callback, *args)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+# ==============================================================================
+# Part 3 - Worker Thread with a Queue polled from the Tk Event Loop
+# ==============================================================================
+class GuiWorker:
+    """Runs jobs on a background thread and delivers their updates on the Tk thread.
+
+    Jobs never touch widgets themselves: they post callbacks to a thread-safe queue, which
+    the Tk thread drains every poll_ms milliseconds with root.after.
+    """
+
+    def __init__(self, root, poll_ms=30, max_poll_seconds=0.05):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.max_poll_seconds = max_poll_seconds # Keeps the window responsive while many tokens arrive
+        self.current = None # The BackgroundTask that is running, if any
+        self._updates = queue.SimpleQueue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gui-worker")
+        self._poll_id = root.after(poll_ms, self._poll)
+
+    @property
+    def busy(self):
+        return self.current is not None
+
+    def post(self, callback, *args):
+        """Queue callback(*args) to run on the Tk thread (safe to call from any thread)"""
+        self._updates.put((callback, args))
+
+    def submit(self, job, *args, on_done=None, on_error=None):
+        """Run job(task, *args) on the worker thread.
+
+        on_done(result) or on_error(exception) is called on the Tk thread when the job ends.
+        """
+        task = BackgroundTask(self)
+        self.current = task
+
+        def run():
+            try:
+                result = job(task, *args)
+            except Exception as e:
+                self.post(self._finish, task, on_error, e)
+            else:
+                self.post(self._finish, task, on_done, result)
+
+        self._executor.submit(run)
+        return task
+
+    def cancel(self):
+        """Ask the running task to stop; returns False if nothing is running"""
+        if self.current is None:
+            return False
+        self.current.cancel()
+        return True
+
+    def _finish(self, task, callback, value):
+        if self.current is task:
+            self.current = None
+        if callback is not None:
+            callback(value)
+
+    def _poll(self):
+        deadline = time.monotonic() + self.max_poll_seconds
+        while time.monotonic() < deadline:
+            try:
+                callback, args = self._updates.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+        self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def close(self):
+        """Cancel the running task and stop polling"""
+        self.cancel()
+        self.root.after_cancel(self._poll_id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
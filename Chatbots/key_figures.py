@@ -0,0 +1,347 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import re # For recognising years, numbers, units and line items
+import sqlite3 # Queryable per-company, per-year store of key figures
+import threading # For sharing the store between the GUI and ingestion threads
+import fitz # PyMuPDF, used for the word positions of the statement tables
+
+# ==============================================================================
+# Part 2 - Statement, Unit and Line Item Vocabulary
+# ==============================================================================
+# Headings that identify the page of each primary statement (English and Norwegian reports)
+STATEMENT_HEADINGS = {
+    "income": re.compile(r"income statement|statement of (comprehensive )?income|profit and loss|"
+                         r"resultatregnskap", re.I),
+    "balance": re.compile(r"balance sheet|statement of financial position|\bbalanse\b", re.I),
+    "cash_flow": re.compile(r"(statement of )?cash flows?( statement)?\b|kontantstrøm", re.I),
+}
+
+# Unit statements and the factor that turns a reported number into whole currency units
+UNIT_PATTERNS = [
+    (re.compile(r"\b(NOK|USD|EUR)\s*(in\s+)?billions?\b|\b(NOK|USD|EUR)\s*bn\b|\bMRD\s*NOK\b", re.I), 1e9),
+    (re.compile(r"\b(NOK|USD|EUR)\s*(in\s+)?millions?\b|\bMNOK\b|\bMUSD\b|\b(NOK|USD|EUR)\s*m\b|"
+                r"\bin millions\b|\bmillioner\b|\bmill\.?\s*kr", re.I), 1e6),
+    (re.compile(r"\b(NOK|USD|EUR)\s*(in\s+)?thousands?\b|\bTNOK\b|\bNOK\s*1\s*000\b|\bin thousands\b|"
+                r"\bhele tusen\b|\b1\s*000\s*kr", re.I), 1e3),
+]
+CURRENCY_PATTERN = re.compile(r"\b(NOK|USD|EUR)\b|\b(MNOK|TNOK)\b|\bkr\b", re.I)
+
+# Normalized line item -> canonical metric; the first matching pattern wins
+LINE_ITEMS = [
+    ("revenue", r"(total )?(operating )?revenues?( and other income)?$|(net )?sales$|(sum )?driftsinntekter$|"
+                r"(sum )?salgsinntekter?$"),
+    ("ebitda", r"(adjusted )?ebitda$"),
+    ("operating_income", r"(net )?operating (income|profit)$|ebit$|(sum )?driftsresultat$"),
+    ("profit_before_tax", r"(net )?(income|profit) before (income )?tax(es)?$|(ordinært )?resultat før skatt(ekostnad)?$"),
+    ("net_income", r"net (income|profit)( for the year)?$|(profit|result) for the (year|period)$|"
+                   r"profit after tax$|årsresultat$"),
+    ("total_assets", r"total assets$|sum eiendeler$"),
+    ("total_equity", r"total equity$|sum egenkapital$"),
+    ("total_liabilities", r"total liabilities$|sum gjeld$"),
+    ("cash", r"cash and cash equivalents( at (the )?end of (the )?(year|period))?$|"
+             r"(bankinnskudd|kontanter)( og kontanter| og bankinnskudd)?$"),
+    ("operating_cash_flow", r"(net )?cash flows? (provided by|from|generated from) operating activities$|"
+                            r"(netto )?kontantstrøm(mer)? fra operasjonelle aktiviteter$"),
+]
+LINE_ITEM_PATTERNS = [(metric, re.compile(pattern)) for metric, pattern in LINE_ITEMS]
+
+YEAR_PATTERN = re.compile(r"^(19|20)\d{2}$")
+NUMBER_PATTERN = re.compile(r"^[(\-–−]?\d[\d.,]*\)?$")
+
+# ==============================================================================
+# Part 3 - Table Detection from PyMuPDF Word Positions
+# ==============================================================================
+def _rows(page, tolerance=3.0):
+    """Group the words of a page into visual rows, each sorted left to right"""
+    rows = []
+    for x0, y0, x1, y1, word, *_ in sorted(page.get_text("words"), key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        middle = (y0 + y1) / 2
+        if rows and abs(rows[-1][0] - middle) <= tolerance:
+            rows[-1][1].append((x0, x1, word))
+        else:
+            rows.append([middle, [(x0, x1, word)]])
+    return [sorted(words) for _, words in rows]
+
+def _merge_number_groups(words):
+    """Join numbers split by thousands spaces (e.g. '1 234 567') back into one token"""
+    merged = []
+    for x0, x1, word in words:
+        if (merged and NUMBER_PATTERN.match(merged[-1][2]) and re.match(r"^\d{3}([.,]\d+)?\)?$", word)
+                and not merged[-1][2].endswith(")") and x0 - merged[-1][1] < (x1 - x0) / len(word) * 1.2):
+            merged[-1] = (merged[-1][0], x1, merged[-1][2] + word)
+        else:
+            merged.append((x0, x1, word))
+    return merged
+
+def parse_number(token):
+    """Parse a reported figure such as '(1 234,5)', '1,234.5' or '-12' into a float"""
+    negative = token.startswith(("(", "-", "–", "−")) or token.endswith(")")
+    digits = token.strip("()-–−")
+    if "," in digits and "." in digits:
+        # The separator that comes last is the decimal separator
+        decimal = "," if digits.rfind(",") > digits.rfind(".") else "."
+        digits = digits.replace("." if decimal == "," else ",", "").replace(decimal, ".")
+    elif "," in digits or "." in digits:
+        separator = "," if "," in digits else "."
+        groups = digits.split(separator)
+        # '1,234' and '1.234.567' use the separator for thousands, '12,5' and '0.75' for decimals
+        if len(groups) > 2 or (len(groups[-1]) == 3 and len(groups[0]) <= 3 and groups[0] != "0"):
+            digits = digits.replace(separator, "")
+        else:
+            digits = digits.replace(separator, ".")
+    value = float(digits)
+    return -value if negative else value
+
+def normalize_label(words):
+    """Lower-case a line item label and drop note references and punctuation"""
+    label = " ".join(words).lower()
+    label = re.sub(r"\s*/\s*\(?(loss|tap)\)?", "", label) # 'Net income/(loss)' -> 'net income'
+    label = re.sub(r"[^\w\s]", " ", label)
+    label = re.sub(r"\b(note|noter?)\b.*$", "", label) # Text after a note column heading
+    label = re.sub(r"\s\d{1,2}(\s\d{1,2})*$", "", label.strip()) # Trailing note numbers
+    return " ".join(label.split())
+
+def match_metric(label):
+    """Return the canonical metric for a normalized label, or None"""
+    for metric, pattern in LINE_ITEM_PATTERNS:
+        if pattern.match(label):
+            return metric
+    return None
+
+def page_unit(text):
+    """Return (scale, currency) stated on a page, defaulting to whole units"""
+    scale = 1.0
+    for pattern, factor in UNIT_PATTERNS:
+        if pattern.search(text):
+            scale = factor
+            break
+    currency = CURRENCY_PATTERN.search(text)
+    code = currency.group(0).upper() if currency else ""
+    return scale, {"MNOK": "NOK", "TNOK": "NOK", "KR": "NOK"}.get(code, code)
+
+def statement_pages(pages, lines=12, max_line_length=60):
+    """Return the numbers of the pages whose extracted text may start with a statement heading.
+
+    Only the short leading lines of each page are searched, so the word positions are read for
+    a few candidate pages instead of the whole report.
+    """
+    numbers = []
+    for number, text in enumerate(pages):
+        leading = text.split("\n", lines)[:lines]
+        heading_text = " ".join(line.strip() for line in leading if len(line.strip()) <= max_line_length)
+        if any(pattern.search(heading_text) for pattern in STATEMENT_HEADINGS.values()):
+            numbers.append(number)
+    return numbers
+
+def find_key_figures(pdf_source, page_numbers=None):
+    """Detect the primary statement tables of a PDF (a path or bytes) and return their key figures.
+
+    page_numbers limits the search to those pages (e.g. from statement_pages()). Returns a list of
+    (year, metric, value in whole currency units, currency, page number, statement). Only the first
+    value found for each (year, metric) is kept, so notes do not override statements.
+    """
+    figures = {}
+    doc = fitz.open(stream=pdf_source, filetype="pdf") if isinstance(pdf_source, (bytes, bytearray)) else fitz.open(pdf_source)
+    with doc:
+        for number in range(doc.page_count) if page_numbers is None else page_numbers:
+            rows = _rows(doc[number])
+            heading_text = " ".join(word for row in rows[:12] for _, _, word in row)
+            statements = [name for name, pattern in STATEMENT_HEADINGS.items() if pattern.search(heading_text)]
+            if not statements:
+                continue
+            statement = statements[0]
+            scale, currency = page_unit(" ".join(word for row in rows for _, _, word in row))
+
+            year_columns = None # [(x centre, year)] of the latest header row
+            for row in rows:
+                row = _merge_number_groups(row)
+                years = [((x0 + x1) / 2, int(word)) for x0, x1, word in row if YEAR_PATTERN.match(word)]
+                if len(years) >= 2 and len(row) <= len(years) + 4:
+                    year_columns = years
+                    continue
+                if year_columns is None:
+                    continue
+
+                numbers = [(x0, x1, word) for x0, x1, word in row if NUMBER_PATTERN.match(word)]
+                label_words = [word for _, _, word in row if not NUMBER_PATTERN.match(word)]
+                metric = match_metric(normalize_label(label_words))
+                if metric is None or not numbers:
+                    continue
+
+                # Assign each number to the closest year column; numbers far from every column are note references
+                spacing = min(abs(a[0] - b[0]) for a, b in zip(year_columns, year_columns[1:])) or 40
+                for x0, x1, word in numbers:
+                    centre, year = min(year_columns, key=lambda column: abs(column[0] - (x0 + x1) / 2))
+                    if abs(centre - (x0 + x1) / 2) > spacing / 2:
+                        continue
+                    try:
+                        value = parse_number(word) * scale
+                    except ValueError:
+                        continue
+                    figures.setdefault((year, metric), (year, metric, value, currency, number, statement))
+    return list(figures.values())
+
+# ==============================================================================
+# Part 4 - Per-company, Per-year Key Figure Store
+# ==============================================================================
+BLOB_NAME_PATTERN = re.compile(r"^(?P<company>.+?)[-_ ]+(?P<year>(19|20)\d{2})\b")
+
+def parse_blob_name(blob_name):
+    """Split a report name like 'equinor-2020.pdf' into ('equinor', 2020), or (None, None)"""
+    match = BLOB_NAME_PATTERN.match(blob_name.rsplit("/", 1)[-1].lower())
+    if not match:
+        return None, None
+    return match.group("company").replace("_", "-").replace(" ", "-"), int(match.group("year"))
+
+class KeyFigureStore:
+    """SQLite store of key figures, queryable by company, year and metric"""
+
+    def __init__(self, path="key_figures.sqlite"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS figures (
+                    company TEXT, year INTEGER, metric TEXT, value REAL, currency TEXT,
+                    source_blob TEXT, page INTEGER, statement TEXT,
+                    PRIMARY KEY (company, year, metric)
+                )""")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS processed (report_key TEXT PRIMARY KEY)")
+
+    def is_processed(self, report_key):
+        """Whether the figures of a report version have already been extracted"""
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM processed WHERE report_key = ?", (report_key,)).fetchone() is not None
+
+    def add(self, report_key, blob_name, figures):
+        """Store the figures of a report; the report's own year wins over comparative columns of later reports"""
+        company, report_year = parse_blob_name(blob_name)
+        with self._lock, self.conn:
+            if company is not None:
+                for year, metric, value, currency, page, statement in figures:
+                    replace = "REPLACE" if year == report_year else "IGNORE"
+                    self.conn.execute(f"INSERT OR {replace} INTO figures VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (company, year, metric, value, currency, blob_name, page + 1, statement))
+            self.conn.execute("INSERT OR IGNORE INTO processed VALUES (?)", (report_key,))
+
+    def get(self, company, year, metric):
+        """Return (value, currency, source blob, page) or None"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT value, currency, source_blob, page FROM figures WHERE company = ? AND year = ? AND metric = ?",
+                (company, year, metric)).fetchone()
+
+# ==============================================================================
+# Part 5 - Answering Direct Metric Questions
+# ==============================================================================
+# Question wording -> metric (or ratio of two metrics); longer phrases are listed first
+QUESTION_METRICS = [
+    ("ebitda margin", ("ratio", "ebitda", "revenue")),
+    ("operating margin", ("ratio", "operating_income", "revenue")),
+    ("ebit margin", ("ratio", "operating_income", "revenue")),
+    ("net margin", ("ratio", "net_income", "revenue")),
+    ("profit margin", ("ratio", "net_income", "revenue")),
+    ("equity ratio", ("ratio", "total_equity", "total_assets")),
+    ("ebitda", "ebitda"),
+    ("operating profit", "operating_income"), ("operating income", "operating_income"), ("ebit", "operating_income"),
+    ("profit before tax", "profit_before_tax"), ("pre-tax", "profit_before_tax"),
+    ("net income", "net_income"), ("net profit", "net_income"), ("årsresultat", "net_income"),
+    ("operating cash flow", "operating_cash_flow"), ("cash flow from operations", "operating_cash_flow"),
+    ("total assets", "total_assets"), ("total equity", "total_equity"), ("total liabilities", "total_liabilities"),
+    ("cash", "cash"),
+    ("revenue", "revenue"), ("revenues", "revenue"), ("sales", "revenue"), ("turnover", "revenue"),
+    ("driftsinntekter", "revenue"),
+]
+NARRATIVE_PATTERN = re.compile(r"\b(why|explain|describe|reason|strategy|risk|outlook|summar|discuss|how did|what drove)", re.I)
+# Words a pure lookup may contain besides metrics, years and company names
+LOOKUP_WORDS = frozenset(
+    "what whats was were is are the a of for in and or vs versus compared compare to from between with "
+    "how much did does do have has had its their s report reported reports total year years company companies "
+    "give me show tell list please value values figure figures number numbers change asa as group "
+    "million billion nok usd eur hva var er i og for til fra med sammenlignet med hvor mye".split()
+)
+
+def _find_metrics(question):
+    """Return the metrics named in a question and the question with their phrases removed"""
+    text = question.lower()
+    found = []
+    for phrase, metric in QUESTION_METRICS:
+        if re.search(rf"\b{re.escape(phrase)}\b", text):
+            text = re.sub(rf"\b{re.escape(phrase)}\b", " ", text) # So 'ebitda margin' is not also read as 'ebitda'
+            if metric not in found:
+                found.append(metric)
+    return found, text
+
+def requested_metrics(question, blob_names=()):
+    """Return the metrics of a pure lookup question, or [] if the question needs more than the figures.
+
+    A pure lookup only consists of metrics, years, the companies of blob_names and LOOKUP_WORDS,
+    so 'What drove the drop in net income?' or 'How did revenue develop?' are left to the LLM.
+    """
+    if NARRATIVE_PATTERN.search(question):
+        return []
+    found, rest = _find_metrics(question)
+    company_words = {word for blob_name in blob_names
+                     for word in re.findall(r"[^\W\d_]+", (parse_blob_name(blob_name)[0] or ""))}
+    rest = re.sub(r"\b(19|20)\d{2}\b", " ", rest)
+    if any(word not in LOOKUP_WORDS and word not in company_words for word in re.findall(r"[^\W\d_]+", rest)):
+        return []
+    return found
+
+def _format_value(value, currency):
+    for factor, suffix in ((1e9, "billion"), (1e6, "million"), (1e3, "thousand")):
+        if abs(value) >= factor:
+            return f"{currency} {value / factor:,.1f} {suffix}".strip()
+    return f"{currency} {value:,.0f}".strip()
+
+def _figure_lines(metrics, blob_names, store, complete=True):
+    """Describe the figures of every metric and report; with complete, return None if any is missing"""
+    lines = []
+    for metric in metrics:
+        is_ratio = isinstance(metric, tuple)
+        label = f"{metric[1]} / {metric[2]}" if is_ratio else metric
+        label = label.replace("_", " ")
+        values = []
+        for blob_name in blob_names:
+            company, year = parse_blob_name(blob_name)
+            if company is None:
+                if complete:
+                    return None
+                continue
+            if is_ratio:
+                numerator, denominator = store.get(company, year, metric[1]), store.get(company, year, metric[2])
+                if not numerator or not denominator or not denominator[0]:
+                    if complete:
+                        return None # Missing figures are left to the LLM
+                    continue
+                lines.append(f"{company.title()} {year} {label}: {100 * numerator[0] / denominator[0]:.1f}% "
+                             f"(pages {numerator[3]} and {denominator[3]} of {numerator[2]})")
+            else:
+                found = store.get(company, year, metric)
+                if not found:
+                    if complete:
+                        return None
+                    continue
+                values.append((company, year, found[0]))
+                lines.append(f"{company.title()} {year} {label}: {_format_value(found[0], found[1])} "
+                             f"(page {found[3]} of {found[2]})")
+        # Show the change between consecutive years of the same company
+        for (company_a, year_a, value_a), (company_b, year_b, value_b) in zip(values, values[1:]):
+            if company_a == company_b and year_a != year_b and value_a:
+                lines.append(f"{company_a.title()} {label} change {year_a} to {year_b}: "
+                             f"{(value_b - value_a) / abs(value_a) * 100:+.1f}%")
+    return lines
+
+def answer_from_key_figures(question, blob_names, store):
+    """Answer a pure metric lookup from the store, or return None so the LLM is asked instead"""
+    metrics = requested_metrics(question, blob_names)
+    if not metrics:
+        return None
+    lines = _figure_lines(metrics, blob_names, store)
+    return "\n".join(lines) if lines else None
+
+def key_figure_context(question, blob_names, store):
+    """The stored figures of the metrics a question mentions, as extra context for the LLM ('' if none)"""
+    metrics, _ = _find_metrics(question)
+    return "\n".join(_figure_lines(metrics, blob_names, store, complete=False)) if metrics else ""
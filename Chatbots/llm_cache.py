@@ -0,0 +1,165 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For the cache location
+import re # For normalizing questions
+import json # For stable cache keys
+import zlib # For compressing cached replies on disk
+import time # For expiry and LRU timestamps
+import hashlib # For hashing prompts and data versions
+import sqlite3 # Persistent on-disk backend that survives restarts
+import threading # For sharing one cache between the GUI worker and other threads
+
+# ==============================================================================
+# Part 2 - Cache Keys
+# ==============================================================================
+DAY = 24 * 3600
+FILLER_WORDS = frozenset(
+    "a an the please can could would you me tell show give what what's whats is are was were "
+    "kan du hva er var vennligst".split()
+)
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def data_version(*parts):
+    """Fingerprint of the data a prompt is built from (records, report texts, ...)"""
+    return _digest([str(part) for part in parts])
+
+def normalize_question(question):
+    """Lower-case the question and drop punctuation and filler words, so small rephrasings match"""
+    words = re.findall(r"\w+", question.lower())
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+# ==============================================================================
+# Part 3 - Disk-backed Completion Cache
+# ==============================================================================
+class CompletionCache:
+    """Persistent cache of chat completion replies with TTL and LRU size eviction.
+
+    The exact tier is keyed by (deployment, messages, max_tokens, temperature). The optional
+    near-duplicate tier is keyed by (deployment, normalized question, data version), where the
+    data version fingerprints the Brreg records or reports behind the prompt, so changed data
+    never matches an old reply.
+    """
+
+    def __init__(self, path="llm_cache.sqlite", max_bytes=64 * 1024 * 1024, ttl=7 * DAY, near_duplicates=True):
+        self.max_bytes = max_bytes # Upper bound for the compressed replies kept on disk
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    near_key TEXT,
+                    reply BLOB NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS completions_near_key ON completions (near_key)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def key(messages, model=None, max_tokens=None, temperature=None, **options):
+        """Exact cache key of a completion request"""
+        return _digest([model, messages, max_tokens, temperature, options])
+
+    def keys(self, messages, question=None, data_version=None, **options):
+        """Return the (exact, near-duplicate) keys of a completion request"""
+        return self.key(messages, **options), self.near_key(options.get("model"), question, data_version)
+
+    def near_key(self, model, question, version):
+        """Near-duplicate key, or None if the tier is off or the request has no question/data version"""
+        if not self.near_duplicates or not question or not version:
+            return None
+        return _digest([model, normalize_question(question), version])
+
+    def get(self, key, near_key=None):
+        """Return a cached reply for the exact key, then for the near-duplicate key, or None"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT key, reply FROM completions WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            stat = "hits"
+            if row is None and near_key is not None:
+                row = self.conn.execute(
+                    "SELECT key, reply FROM completions WHERE near_key = ? AND expires_at > ? "
+                    "ORDER BY last_access DESC LIMIT 1", (near_key, now)).fetchone()
+                stat = "near_hits"
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats[stat] += 1
+            with self.conn:
+                self.conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, row[0]))
+        return zlib.decompress(row[1]).decode("utf-8")
+
+    def put(self, key, near_key, reply):
+        """Store a reply and evict least recently used entries above max_bytes"""
+        body = zlib.compress(reply.encode("utf-8"))
+        now = time.time()
+        with self._lock, self.conn:
+            old = self.conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, near_key, body, now + self.ttl, now, len(body)))
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self.stats["stores"] += 1
+            self._evict(now)
+
+    def _evict(self, now):
+        """Delete expired entries, then least recently used ones until the cache fits in max_bytes"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        self.conn.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM completions ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                return
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.stats["evictions"] += 1
+
+    def hit_ratio(self):
+        """Share of lookups answered from the cache"""
+        served = self.stats["hits"] + self.stats["near_hits"]
+        total = served + self.stats["misses"]
+        return served / total if total else 0.0
+
+    def clear(self):
+        """Remove every cached reply"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM completions")
+            self.total_bytes = 0
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
+
+# ==============================================================================
+# Part 4 - Cache shared by both Chatbots
+# ==============================================================================
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+def get_completion_cache():
+    """Open the shared cache at LLM_CACHE_PATH on first use (an empty LLM_CACHE_PATH turns it off)"""
+    global _shared_cache
+    path = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+    if not path:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = CompletionCache(path, near_duplicates=os.getenv("LLM_CACHE_NEAR_DUPLICATES", "1") != "0")
+        return _shared_cache
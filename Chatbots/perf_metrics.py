@@ -0,0 +1,201 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For the settings in environment variables
+import sys # For logging to stderr
+import json # For the structured span logs
+import time # For timing the spans
+import atexit # For writing the Prometheus snapshot when the program exits
+import threading # For spans finishing on several threads at once
+from bisect import bisect_left # For finding the histogram bucket of a duration
+from functools import wraps # For the timed() decorator
+
+# ==============================================================================
+# Part 2 - Spans
+# ==============================================================================
+# Upper bounds in seconds of the duration histogram buckets (the last bucket is +Inf)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Span:
+    """Times one stage; numeric fields set on it are summed per stage, all fields are logged"""
+    __slots__ = ("metrics", "stage", "fields", "started", "failed")
+
+    def __init__(self, metrics, stage, fields):
+        self.metrics = metrics
+        self.stage = stage
+        self.fields = fields
+        self.started = None
+        self.failed = False
+
+    def set(self, **fields):
+        """Add fields such as bytes=..., pages=..., cache_hits=1 to the span"""
+        self.fields.update(fields)
+
+    def fail(self):
+        """Count the span as an error of its stage, for failures reported without an exception"""
+        self.failed = True
+
+    def elapsed(self):
+        """Seconds since the span started"""
+        return time.perf_counter() - self.started
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.stage, self.elapsed(), error=self.failed or exc_type is not None, **self.fields)
+        return False
+
+class _NullSpan:
+    """Stands in for a Span while the metrics are off, so instrumented code pays one attribute check"""
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+    def fail(self):
+        pass
+
+    def elapsed(self):
+        return 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+# ==============================================================================
+# Part 3 - Per-stage Aggregates with JSON and Prometheus Export
+# ==============================================================================
+class Metrics:
+    """Per-stage timings and counters for both chatbots.
+
+    Every finished span updates a duration histogram and the sums of its numeric fields
+    (bytes, pages, prompt_tokens, completion_tokens, cache_hits, ...). With a log path, every
+    span is also written as one JSON line ('-' logs to stderr).
+    """
+
+    def __init__(self, enabled=False, log_path=None):
+        self.enabled = enabled
+        self._log = None
+        self._lock = threading.Lock()
+        self.reset()
+        if log_path:
+            self.log_to(log_path)
+
+    def enable(self, log_path=None):
+        """Start recording spans (and logging them to log_path, if given)"""
+        if log_path:
+            self.log_to(log_path)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def log_to(self, path):
+        """Write every finished span as a JSON line to path ('-' for stderr)"""
+        self._log = sys.stderr if path == "-" else open(path, "a", encoding="utf-8")
+
+    def reset(self):
+        """Forget every recorded span"""
+        with self._lock:
+            self.stages = {} # stage -> {"count", "errors", "seconds", "max_seconds", "buckets", "totals"}
+
+    def span(self, stage, **fields):
+        """Return a context manager timing one stage, e.g. `with metrics.span("pdf_extract") as span:`"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage, fields)
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as a stage"""
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Span(self, stage, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def record(self, stage, seconds=None, error=False, **fields):
+        """Add one observation of a stage; without seconds only its counters are updated"""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                              "buckets": [0] * (len(BUCKETS) + 1), "totals": {}}
+            if seconds is not None:
+                entry["count"] += 1
+                entry["seconds"] += seconds
+                entry["max_seconds"] = max(entry["max_seconds"], seconds)
+                entry["buckets"][bisect_left(BUCKETS, seconds)] += 1
+            if error:
+                entry["errors"] += 1
+            totals = entry["totals"]
+            for name, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[name] = totals.get(name, 0) + value
+            if self._log is not None:
+                line = {"ts": round(time.time(), 3), "stage": stage, **fields}
+                if seconds is not None:
+                    line["seconds"] = round(seconds, 6)
+                if error:
+                    line["error"] = True
+                self._log.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+                self._log.flush()
+
+    def snapshot(self):
+        """Return a copy of the aggregates with the average duration of every stage"""
+        with self._lock:
+            return {stage: {**entry["totals"], # Field sums never hide the stage's own aggregates
+                            "count": entry["count"], "errors": entry["errors"],
+                            "seconds": entry["seconds"], "max_seconds": entry["max_seconds"],
+                            "avg_seconds": entry["seconds"] / entry["count"] if entry["count"] else 0.0}
+                    for stage, entry in self.stages.items()}
+
+    def prometheus_text(self, prefix="chatbot"):
+        """Render the aggregates in the Prometheus text exposition format"""
+        lines = [f"# HELP {prefix}_stage_seconds Time spent per stage",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        with self._lock:
+            stages = sorted(self.stages.items())
+            for stage, entry in stages:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), entry["buckets"]):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {entry["seconds"]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+            lines += [f"# HELP {prefix}_stage_errors_total Spans that ended with an exception or failed",
+                      f"# TYPE {prefix}_stage_errors_total counter"]
+            lines += [f'{prefix}_stage_errors_total{{stage="{stage}"}} {entry["errors"]}' for stage, entry in stages]
+            names = sorted({name for _, entry in stages for name in entry["totals"]})
+            for name in names:
+                lines += [f"# TYPE {prefix}_{name}_total counter"]
+                lines += [f'{prefix}_{name}_total{{stage="{stage}"}} {entry["totals"][name]:g}'
+                          for stage, entry in stages if name in entry["totals"]]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the Prometheus snapshot to a file (e.g. for the node exporter textfile collector)"""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as output:
+            output.write(self.prometheus_text())
+        os.replace(temporary, path) # Scrapers never see a half-written file
+
+# ==============================================================================
+# Part 4 - Metrics shared by both Chatbots
+# ==============================================================================
+# Off unless CHATBOT_METRICS=1; CHATBOT_METRICS_LOG is the JSON log and CHATBOT_METRICS_PROM the
+# Prometheus snapshot written at exit
+metrics = Metrics(enabled=os.getenv("CHATBOT_METRICS", "0") != "0", log_path=os.getenv("CHATBOT_METRICS_LOG"))
+if metrics.enabled and os.getenv("CHATBOT_METRICS_PROM"):
+    atexit.register(metrics.write_prometheus, os.getenv("CHATBOT_METRICS_PROM"))
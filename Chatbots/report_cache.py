@@ -0,0 +1,100 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For managing the cache directory
+import gzip # For compressing the cached text
+import json # For the page offsets and metadata
+import hashlib # For content-addressed cache keys
+import tempfile # For unique temporary files while an entry is written
+import threading # For reports being ingested in parallel
+from itertools import accumulate # For turning page lengths into offsets
+
+# ==============================================================================
+# Part 2 - Extracted Report Text
+# ==============================================================================
+class ReportText:
+    """Extracted text of a report with the offset where every page starts"""
+    __slots__ = ("blob_name", "text", "page_offsets")
+
+    def __init__(self, blob_name, text, page_offsets):
+        self.blob_name = blob_name
+        self.text = text
+        self.page_offsets = page_offsets # len(pages) + 1 offsets into text
+
+    @classmethod
+    def from_pages(cls, blob_name, pages):
+        """Join page texts once, remembering where each page starts"""
+        return cls(blob_name, "".join(pages), [0] + list(accumulate(len(page) for page in pages)))
+
+    @property
+    def page_count(self):
+        return len(self.page_offsets) - 1
+
+    def page(self, number):
+        """Return the text of a page (0-based)"""
+        return self.text[self.page_offsets[number]:self.page_offsets[number + 1]]
+
+    def pages(self):
+        """Yield the text of every page"""
+        for number in range(self.page_count):
+            yield self.page(number)
+
+# ==============================================================================
+# Part 3 - Persistent Text Cache keyed by Blob Name and ETag
+# ==============================================================================
+class ReportTextCache:
+    """On-disk cache of extracted report text, so known reports are neither downloaded nor parsed again"""
+
+    def __init__(self, cache_dir="report_cache"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(blob_name, etag=None, last_modified=None):
+        """Cache key for one version of a blob (a new upload gets a new ETag and so a new key)"""
+        version = etag or str(last_modified or "")
+        return hashlib.sha256(f"{blob_name}\0{version}".encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt.gz"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached ReportText for a key, or None"""
+        text_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            with gzip.open(text_path, "rt", encoding="utf-8", newline="") as text_file:
+                text = text_file.read()
+        except (OSError, ValueError):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return ReportText(meta["blob_name"], text, meta["page_offsets"])
+
+    def put(self, key, blob_name, pages):
+        """Store the page texts of a report and return it as a ReportText"""
+        report = ReportText.from_pages(blob_name, pages)
+        text_path, meta_path = self._paths(key)
+        # Write to temporary files first so a crash never leaves a half-written entry behind; each
+        # writer gets its own files, so two threads storing the same report never share one
+        text_fd, text_tmp = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        meta_fd, meta_tmp = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(text_fd, "wb") as raw_file, \
+                    gzip.open(raw_file, "wt", encoding="utf-8", newline="", compresslevel=6) as text_file:
+                text_file.write(report.text)
+            with os.fdopen(meta_fd, "w", encoding="utf-8") as meta_file:
+                json.dump({"blob_name": blob_name, "page_offsets": report.page_offsets}, meta_file)
+            os.replace(text_tmp, text_path)
+            os.replace(meta_tmp, meta_path) # The metadata is written last and marks the entry complete
+        except BaseException:
+            for path in (text_tmp, meta_tmp):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        return report
@@ -0,0 +1,124 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import re # For normalizing company names
+import difflib # For fuzzy matching of misspelled company names
+import threading # For refreshing the catalog in the background
+from key_figures import parse_blob_name # Splits 'equinor-2020.pdf' into company and year
+
+# ==============================================================================
+# Part 2 - Company Name Normalization
+# ==============================================================================
+IGNORED_WORDS = frozenset(
+    "asa as ab plc inc ltd group holding konsern annual report arsrapport årsrapport".split()
+)
+
+def company_key(name):
+    """Normalize a company name: 'Equinor ASA' and 'equinor-annual-report' both become 'equinor'"""
+    words = [word for word in re.findall(r"[^\W_]+", name.lower()) if word not in IGNORED_WORDS]
+    return "".join(words) or re.sub(r"\W|_", "", name.lower())
+
+# ==============================================================================
+# Part 3 - Company -> Year -> Blob Index over the Report Container
+# ==============================================================================
+class ReportCatalog:
+    """Index of the reports in a blob container by normalized company name and year.
+
+    The container is listed page by page, in the background for the full listing and with a
+    name prefix when a lookup misses, so the GUI never waits for the whole container.
+    """
+
+    def __init__(self, container_client, prefix="", page_size=5000, fuzzy_cutoff=0.8):
+        self.container_client = container_client
+        self.prefix = prefix # Folder holding the reports, if any
+        self.page_size = page_size # Blobs per listing request
+        self.fuzzy_cutoff = fuzzy_cutoff # Minimum difflib similarity for a fuzzy company match
+        self.etags = {} # blob name -> ETag
+        self.companies = {} # company key -> {year: blob name}
+        self.loaded = False # Whether a full listing has finished
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.etags)
+
+    def _list(self, prefix):
+        """Yield (name, etag) for the blobs under a prefix, one listing page at a time"""
+        blobs = self.container_client.list_blobs(name_starts_with=prefix or None, results_per_page=self.page_size)
+        for page in blobs.by_page():
+            for blob in page:
+                yield blob.name, blob.etag
+
+    def _add(self, name, etag):
+        self.etags[name] = etag
+        company, year = parse_blob_name(name)
+        if company is not None:
+            self.companies.setdefault(company_key(company), {}).setdefault(year, name)
+
+    def refresh(self, company=None):
+        """List the container again, or only the blobs whose names start with the first word of a company name.
+
+        Blob name prefixes are case-sensitive, so the word is listed as typed, lower-case,
+        capitalized and upper-case ('equinor-2023.pdf' and 'Equinor_2023.pdf'). Returns the
+        number of reports listed.
+        """
+        words = re.findall(r"[^\W_]+", company) if company else []
+        if words:
+            spellings = dict.fromkeys([words[0], words[0].lower(), words[0].capitalize(), words[0].upper()])
+            prefixes = [self.prefix + spelling for spelling in spellings]
+        else:
+            prefixes = [self.prefix]
+        listed = [blob for prefix in prefixes for blob in self._list(prefix)]
+        with self._lock:
+            stale = [name for name in self.etags if name.startswith(tuple(prefixes))]
+            for name in stale: # Rebuild the part of the index under the prefix, dropping deleted reports
+                del self.etags[name]
+            if stale:
+                self.companies = {}
+                for name, etag in self.etags.items():
+                    self._add(name, etag)
+            for name, etag in listed:
+                self._add(name, etag)
+            if company is None:
+                self.loaded = True
+        return len(listed)
+
+    def start_refresh(self, on_done=None, on_error=None):
+        """Run a full refresh on a background thread; the callbacks are called from that thread"""
+        def run():
+            try:
+                count = self.refresh()
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
+            else:
+                if on_done is not None:
+                    on_done(count)
+
+        thread = threading.Thread(target=run, name="report-catalog", daemon=True)
+        thread.start()
+        return thread
+
+    def find(self, company_year):
+        """Return the blob name for a request like 'Equinor 2020', or None.
+
+        An exact match on the normalized company name is a dictionary lookup. On a miss, the
+        blobs starting with the company name are listed, and then the closest company name is used.
+        """
+        company, year = parse_blob_name(company_year.strip())
+        if company is None:
+            return None
+        key = company_key(company)
+        with self._lock:
+            blob_name = self.companies.get(key, {}).get(year)
+        if blob_name is not None:
+            return blob_name
+
+        self.refresh(company) # Reports uploaded since the last listing
+        with self._lock:
+            blob_name = self.companies.get(key, {}).get(year)
+            if blob_name is None:
+                candidates = [name for name, years in self.companies.items() if year in years]
+                matches = difflib.get_close_matches(key, candidates, n=1, cutoff=self.fuzzy_cutoff)
+                if matches:
+                    blob_name = self.companies[matches[0]][year]
+        return blob_name
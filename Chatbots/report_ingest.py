@@ -0,0 +1,197 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For sizing the process pool
+import time # For timing the extraction of each report
+import shutil # For removing the scratch copies of the PDFs
+import tempfile # For handing each PDF to the worker processes once, as a file
+import multiprocessing # For starting the workers with spawn, which is safe from the threaded GUI
+import fitz # PyMuPDF, used to extract text from PDFs
+from perf_metrics import metrics # Per-stage timings of downloads and extraction
+from key_figures import find_key_figures, statement_pages # Statement table detection, also run in the process pool
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED # For parallel ingestion
+
+# ==============================================================================
+# Part 2 - Page-range Extraction (runs in worker processes)
+# ==============================================================================
+# This module has no import-time side effects, so worker processes can import it cheaply
+def open_pdf(pdf_source):
+    """Open a PDF given as a path or as bytes"""
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return fitz.open(stream=pdf_source, filetype="pdf")
+    return fitz.open(pdf_source)
+
+def count_pages(pdf_source):
+    """Return the number of pages of a PDF given as a path or bytes"""
+    with open_pdf(pdf_source) as doc:
+        return doc.page_count
+
+def extract_page_range(pdf_source, start, stop):
+    """Extract the text of pages [start, stop) of a PDF given as a path or bytes"""
+    with open_pdf(pdf_source) as doc:
+        return [doc[number].get_text() for number in range(start, stop)]
+
+# ==============================================================================
+# Part 3 - Parallel Report Ingestion
+# ==============================================================================
+class ReportIngestor:
+    """Downloads reports concurrently and extracts their page ranges in a process pool.
+
+    Every downloaded PDF is written once to a scratch file that the workers open by path, so
+    the bytes are not pickled again for every page range. Progress callbacks are made from the thread calling ingest(), and a threading.Event
+    passed as cancel_event stops the work that has not started yet.
+    """
+
+    def __init__(self, container_client, cache, download_workers=4, blob_concurrency=4,
+                 process_workers=None, pages_per_task=20, figure_store=None):
+        self.container_client = container_client
+        self.cache = cache # ReportTextCache, checked before and filled after ingestion
+        self.figure_store = figure_store # Optional KeyFigureStore filled from the statement tables
+        self.download_workers = download_workers # Reports downloaded at the same time
+        self.blob_concurrency = blob_concurrency # Parallel range requests per blob download
+        self.process_workers = process_workers or os.cpu_count() or 2
+        self.pages_per_task = pages_per_task # Pages extracted per process pool task
+        self._threads = None
+        self._processes = None
+
+    def _pools(self):
+        """Create the pools on first use and keep them for later questions"""
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.download_workers)
+            # Forking the threaded GUI process can deadlock the workers, so they are spawned
+            self._processes = ProcessPoolExecutor(max_workers=self.process_workers,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return self._threads, self._processes
+
+    def _download(self, blob_name, scratch):
+        """Download a blob with chunked, concurrent range requests and save it in scratch.
+
+        Returns (page count, path of the saved PDF).
+        """
+        with metrics.span("blob_download", blob=blob_name) as span:
+            blob_client = self.container_client.get_blob_client(blob_name)
+            pdf_bytes = blob_client.download_blob(max_concurrency=self.blob_concurrency).readall()
+            span.set(bytes=len(pdf_bytes))
+            descriptor, path = tempfile.mkstemp(suffix=".pdf", dir=scratch)
+            with os.fdopen(descriptor, "wb") as pdf_file:
+                pdf_file.write(pdf_bytes)
+            return count_pages(pdf_bytes), path
+
+    def ingest(self, blobs, on_progress=None, cancel_event=None):
+        """Ingest {blob name: etag or None} and return {blob name: ReportText} for every finished report.
+
+        on_progress(blob_name, stage, done_pages, total_pages) is called with the stages
+        'cached', 'downloaded', 'extracting' and 'done'. With a figure_store, the key figures
+        of every report version not seen before are extracted in the process pool as well, from
+        the pages whose extracted text starts with a statement heading.
+        """
+        def progress(blob_name, stage, done=0, total=0):
+            if on_progress is not None:
+                on_progress(blob_name, stage, done, total)
+
+        def cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        reports = {}
+        keys = {}
+        needs_figures = set()
+        sources = {} # blob name -> path of the saved PDF, kept until its key figures are submitted
+        for blob_name, etag in blobs.items():
+            if etag is None:
+                etag = self.container_client.get_blob_client(blob_name).get_blob_properties().etag
+            keys[blob_name] = self.cache.key(blob_name, etag)
+            if self.figure_store is not None and not self.figure_store.is_processed(keys[blob_name]):
+                needs_figures.add(blob_name)
+            cached = self.cache.get(keys[blob_name])
+            if cached is not None:
+                reports[blob_name] = cached
+                metrics.record("report_cache", blob=blob_name, cache_hits=1, pages=cached.page_count)
+                progress(blob_name, "cached", cached.page_count, cached.page_count)
+                if blob_name in needs_figures and not statement_pages(cached.pages()):
+                    self.figure_store.add(keys[blob_name], blob_name, []) # No statement pages, nothing to download
+                    needs_figures.discard(blob_name)
+        if len(reports) == len(blobs) and not needs_figures:
+            return reports
+
+        threads, processes = self._pools()
+
+        def submit_figures(blob_name, report):
+            """Parse the tables of the report's candidate statement pages in the process pool"""
+            candidates = statement_pages(report.pages())
+            path = sources.pop(blob_name)
+            if candidates:
+                pending[processes.submit(find_key_figures, path, candidates)] = ("figures", blob_name, 0)
+            else:
+                self.figure_store.add(keys[blob_name], blob_name, [])
+        pending = {} # future -> (kind, blob name, first page)
+        scratch = tempfile.mkdtemp(prefix="report_ingest_")
+        for blob_name in blobs:
+            if blob_name not in reports or blob_name in needs_figures:
+                pending[threads.submit(self._download, blob_name, scratch)] = ("download", blob_name, 0)
+
+        page_parts = {} # blob name -> {first page: [page texts]}
+        totals = {} # blob name -> page count
+        started = {} # blob name -> time its extraction started
+        try:
+            while pending:
+                if cancelled():
+                    break
+                done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, blob_name, start = pending.pop(future)
+                    if kind == "figures":
+                        self.figure_store.add(keys[blob_name], blob_name, future.result())
+                        continue
+                    if kind == "download":
+                        total, path = future.result()
+                        if blob_name in needs_figures:
+                            sources[blob_name] = path
+                        if blob_name in reports:
+                            submit_figures(blob_name, reports[blob_name]) # Only downloaded for its figures
+                            continue
+                        totals[blob_name] = total
+                        started[blob_name] = time.perf_counter()
+                        page_parts[blob_name] = {}
+                        progress(blob_name, "downloaded", 0, total)
+                        if total <= self.pages_per_task:
+                            # Small reports are cheaper to extract here than to ship to a process
+                            page_parts[blob_name][0] = extract_page_range(path, 0, total)
+                        else:
+                            for first in range(0, total, self.pages_per_task):
+                                last = min(total, first + self.pages_per_task)
+                                task = processes.submit(extract_page_range, path, first, last)
+                                pending[task] = ("pages", blob_name, first)
+                    else:
+                        page_parts[blob_name][start] = future.result()
+
+                    # Finish every report whose page ranges are all extracted
+                    parts = page_parts.get(blob_name)
+                    if parts is None:
+                        continue
+                    done_pages = sum(len(part) for part in parts.values())
+                    if done_pages < totals[blob_name]:
+                        if kind == "pages":
+                            progress(blob_name, "extracting", done_pages, totals[blob_name])
+                        continue
+                    pages = [page for first in sorted(parts) for page in parts[first]] # Joined once, in order
+                    reports[blob_name] = self.cache.put(keys[blob_name], blob_name, pages)
+                    if blob_name in needs_figures:
+                        submit_figures(blob_name, reports[blob_name])
+                    # Extraction runs in worker processes, so it is timed here from the download to the last page
+                    metrics.record("pdf_extract", time.perf_counter() - started[blob_name], blob=blob_name,
+                                   pages=totals[blob_name], cache_misses=1)
+                    del page_parts[blob_name]
+                    progress(blob_name, "done", totals[blob_name], totals[blob_name])
+        finally:
+            for future in pending:
+                future.cancel() # Drop work that has not started (after an error or a cancel)
+            # Workers still reading a file after a cancel keep it open, which only Windows refuses
+            shutil.rmtree(scratch, ignore_errors=True)
+        return reports
+
+    def close(self):
+        """Shut down the worker pools"""
+        if self._threads is not None:
+            self._threads.shutdown(cancel_futures=True)
+            self._processes.shutdown(cancel_futures=True)
+            self._threads = self._processes = None
@@ -0,0 +1,132 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+from bisect import bisect_right # For finding the section of a page
+from concurrent.futures import ThreadPoolExecutor, as_completed # For running the map calls concurrently
+from completions import create_completion # Chat completions shared by both chatbots
+from llm_cache import data_version # Fingerprints of the summarized sections
+from token_budget import CHARS_PER_TOKEN, truncate_to_tokens # For sizing the sections
+
+# ==============================================================================
+# Part 2 - Splitting Reports into Sections
+# ==============================================================================
+SECTION_TOKENS = 12000 # Report tokens sent with each map call
+MAX_SECTIONS_PER_REPORT = 4 # Only the sections most relevant to the question are summarized
+SUMMARY_TOKENS = 400 # Length of each map summary
+SYSTEM_PROMPT = "You are a helpful assistant analyzing financial reports."
+
+def split_sections(report, max_tokens=SECTION_TOKENS):
+    """Pack consecutive pages of a ReportText into sections of about max_tokens.
+
+    Returns [(first page, last page, text)] with every page labelled '[page N]'. Tokens are
+    estimated from the length, since counting hundreds of pages exactly would cost more than it saves.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    sections = []
+    first, parts, size = 0, [], 0
+    for number, page in enumerate(report.pages()):
+        if len(page) > max_chars:
+            page = truncate_to_tokens(page, max_tokens)
+        if parts and size + len(page) > max_chars:
+            sections.append((first, number - 1, "".join(parts)))
+            first, parts, size = number, [], 0
+        parts.append(f"[page {number + 1}]\n{page}\n")
+        size += len(page)
+    if parts:
+        sections.append((first, report.page_count - 1, "".join(parts)))
+    return sections
+
+def rank_sections(question, report, sections, index_store, max_sections=MAX_SECTIONS_PER_REPORT):
+    """Keep the max_sections sections with the highest BM25 score for the question, in page order"""
+    if len(sections) <= max_sections:
+        return sections
+    index = index_store.get(report)
+    scores = [0.0] * len(sections)
+    starts = [first for first, _, _ in sections]
+    for score, chunk_id in index.search(question):
+        page = index.chunks[chunk_id][0]
+        scores[bisect_right(starts, page) - 1] += score
+    best = sorted(range(len(sections)), key=lambda i: -scores[i])[:max_sections]
+    return [sections[i] for i in sorted(best)]
+
+# ==============================================================================
+# Part 3 - Map: Question-focused Summaries, Reduce: one Comparison
+# ==============================================================================
+def summarize_section(client, question, blob_name, section, cache=None, cancel_event=None, **options):
+    """Condense one section of a report to what matters for the question"""
+    first, last, text = section
+    prompt = (
+        f"The following are pages {first + 1}-{last + 1} of the annual report {blob_name}:\n\n{text}\n\n"
+        f"Summarize only what these pages say that helps answer the question below. Keep figures, "
+        f"years, units and page numbers. If nothing is relevant, reply 'Nothing relevant.'\n\n"
+        f"Question: {question}"
+    )
+    return create_completion(
+        client,
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        cancel_event=cancel_event,
+        cache=cache, # Cached per section and question intent, so follow-up questions reuse the summaries
+        question=question,
+        data_version=data_version(blob_name, first, last, text),
+        max_tokens=SUMMARY_TOKENS,
+        temperature=0,
+        **options
+    )
+
+def map_reduce(client, question, reports, index_store, cache=None, on_token=None, cancel_event=None,
+               on_progress=None, max_workers=16, section_tokens=SECTION_TOKENS,
+               max_sections=MAX_SECTIONS_PER_REPORT, model="GPT4o-API", key_figures=""):
+    """Answer a question about many reports: summarize sections concurrently, then compare the summaries.
+
+    reports maps blob names to ReportText. on_progress(done, total) is called as the map calls
+    finish, and the reduce answer is streamed to on_token. key_figures from the statement
+    tables are added to the reduce prompt.
+    """
+    tasks = [(blob_name, section) for blob_name, report in reports.items()
+             for section in rank_sections(question, report, split_sections(report, section_tokens),
+                                          index_store, max_sections)]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(summarize_section, client, question, blob_name, section, cache, cancel_event,
+                               model=model): (blob_name, section) for blob_name, section in tasks}
+        try:
+            for done, _ in enumerate(as_completed(futures), 1):
+                if cancel_event is not None and cancel_event.is_set():
+                    return ""
+                if on_progress is not None:
+                    on_progress(done, len(tasks))
+        finally:
+            for future in futures:
+                future.cancel() # Drop the map calls that have not started (after an error or a cancel)
+
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors and len(errors) == len(futures):
+        raise errors[0]
+
+    prompt = "The following are question-focused summaries of annual reports:\n\n"
+    for i, blob_name in enumerate(reports, 1):
+        prompt += f"Report {i} ({blob_name}):\n"
+        for future, (name, (first, last, _)) in futures.items():
+            if name == blob_name:
+                summary = "(summary unavailable)" if future.exception() else future.result()
+                prompt += f"[pages {first + 1}-{last + 1}] {summary}\n"
+        prompt += "\n"
+    if key_figures:
+        prompt += f"Key figures from the statement tables of the reports:\n{key_figures}\n\n"
+    prompt += f"Based on the above summaries, please answer the following question:\n{question}"
+
+    return create_completion(
+        client,
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        on_token=on_token,
+        cancel_event=cancel_event,
+        cache=cache,
+        model=model,
+        max_tokens=1000,
+        temperature=0.3
+    )
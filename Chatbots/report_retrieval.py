@@ -0,0 +1,162 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+import os # For managing the index directory
+import re # For tokenizing report text
+import gzip # For compressing the stored indexes
+import json # For the on-disk index format
+import math # For the BM25 idf
+import hashlib # For content-addressed index files
+import threading # For the in-memory index cache
+from collections import Counter # For term frequencies
+from report_cache import ReportText # Extracted report text with page offsets
+from token_budget import count_tokens # Local token counting for the prompt budget
+
+# ==============================================================================
+# Part 2 - Page-aware Chunking
+# ==============================================================================
+CHUNK_WORDS = 220 # Words per chunk
+CHUNK_OVERLAP = 40 # Words repeated between neighbouring chunks of the same page
+WORD_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "og i er det som en et av til på for med har de den var vi ikke om".split()
+)
+
+def tokenize(text):
+    """Lower-cased words without stopwords (numbers are kept, since years and figures matter)"""
+    return [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+
+def chunk_report(report):
+    """Split a report into (page number, start, end) chunks that never cross a page boundary"""
+    chunks = []
+    step = CHUNK_WORDS - CHUNK_OVERLAP
+    for number in range(report.page_count):
+        page_start = report.page_offsets[number]
+        spans = [match.span() for match in re.finditer(r"\S+", report.page(number))]
+        for first in range(0, max(len(spans) - CHUNK_OVERLAP, 1), step):
+            window = spans[first:first + CHUNK_WORDS]
+            if window:
+                chunks.append((number, page_start + window[0][0], page_start + window[-1][1]))
+    return chunks
+
+# ==============================================================================
+# Part 3 - BM25 Index per Report
+# ==============================================================================
+class BM25Index:
+    """Okapi BM25 over the chunks of one report; chunks are stored as offsets into the report text"""
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, chunks, lengths, postings):
+        self.chunks = chunks # [(page number, start, end)]
+        self.lengths = lengths # Number of terms per chunk
+        self.postings = postings # term -> [[chunk id, term frequency], ...]
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, report):
+        """Chunk and index a ReportText"""
+        chunks = chunk_report(report)
+        lengths = []
+        postings = {}
+        for chunk_id, (_, start, end) in enumerate(chunks):
+            terms = tokenize(report.text[start:end])
+            lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append([chunk_id, frequency])
+        return cls(chunks, lengths, postings)
+
+    def search(self, question):
+        """Return [(score, chunk id)] for chunks matching any question term, best first"""
+        scores = {}
+        total = len(self.chunks)
+        for term in set(tokenize(question)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings:
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[chunk_id] / (self.average_length or 1))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.K1 + 1) / (frequency + norm)
+        return sorted(((score, chunk_id) for chunk_id, score in scores.items()), reverse=True)
+
+    def to_json(self):
+        return {"chunks": self.chunks, "lengths": self.lengths, "postings": self.postings}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls([tuple(chunk) for chunk in data["chunks"]], data["lengths"], data["postings"])
+
+class ReportIndexStore:
+    """Builds BM25 indexes once per report text and keeps them on disk and in memory"""
+
+    def __init__(self, index_dir="report_cache", max_in_memory=32):
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+        self.max_in_memory = max_in_memory
+        self._indexes = {} # text hash -> BM25Index, oldest first
+        self._lock = threading.Lock()
+
+    def get(self, report):
+        """Return the BM25 index of a ReportText, loading or building it as needed"""
+        key = hashlib.sha256(report.text.encode("utf-8")).hexdigest()
+        with self._lock:
+            index = self._indexes.pop(key, None)
+            if index is not None:
+                self._indexes[key] = index # Move to the most recently used end
+                return index
+
+        path = os.path.join(self.index_dir, f"{key}.bm25.json.gz")
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as index_file:
+                index = BM25Index.from_json(json.load(index_file))
+        except (OSError, ValueError):
+            index = BM25Index.build(report)
+            with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as index_file:
+                json.dump(index.to_json(), index_file, separators=(",", ":"))
+            os.replace(f"{path}.tmp", path)
+
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_in_memory:
+                self._indexes.pop(next(iter(self._indexes)))
+        return index
+
+# ==============================================================================
+# Part 4 - Selecting Passages for a Question under a Token Budget
+# ==============================================================================
+def select_passages(question, reports, index_store, max_tokens, max_chunks_per_report=12):
+    """Pick the best chunks of each report for a question, taking turns between reports.
+
+    reports maps blob names to ReportText. Returns {blob name: [(page number, text)]} with the
+    passages of each report in page order. A report without any question term in it (e.g. a
+    Norwegian question about an English report) gets its leading chunks instead.
+    """
+    indexes = {name: index_store.get(report) for name, report in reports.items()} # Each report is hashed once
+    rankings = {}
+    for name, index in indexes.items():
+        rankings[name] = index.search(question) or [(0.0, chunk_id) for chunk_id in
+                                                    range(min(max_chunks_per_report, len(index.chunks)))]
+    selected = {name: [] for name in reports}
+    budget = max_tokens
+    for rank in range(max_chunks_per_report):
+        added = False
+        for name, ranking in rankings.items():
+            if rank >= len(ranking):
+                continue
+            page, start, end = indexes[name].chunks[ranking[rank][1]]
+            text = reports[name].text[start:end]
+            cost = count_tokens(text) + 8 # Plus the page label
+            if cost > budget:
+                continue
+            budget -= cost
+            selected[name].append((page, start, text))
+            added = True
+        if not added:
+            break
+    return {name: [(page, text) for page, _, text in sorted(passages)] for name, passages in selected.items()}
+
+def as_report_text(blob_name, value):
+    """Accept a ReportText or plain extracted text"""
+    return value if isinstance(value, ReportText) else ReportText(blob_name, value, [0, len(value)])
@@ -0,0 +1,41 @@
+# ==============================================================================
+# Part 1 - Install packages
+# ==============================================================================
+try:
+    import tiktoken # Local tokenizer matching the OpenAI models
+except ImportError: # Fall back to an estimate if tiktoken is not installed
+    tiktoken = None
+
+# ==============================================================================
+# Part 2 - Token Counting shared by both Chatbots
+# ==============================================================================
+ENCODING_NAME = "o200k_base" # Tokenizer used by the GPT-4o deployments
+CHARS_PER_TOKEN = 4 # Rough average for the fallback estimate
+_encoding = None
+
+def _get_encoding():
+    """Load the tokenizer once, returning None if it is unavailable"""
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception: # The encoding file may have to be downloaded, which can fail offline
+            _encoding = False
+    return _encoding or None
+
+def count_tokens(text):
+    """Count the tokens of a text with the local tokenizer, or estimate them without it"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut a text down to at most max_tokens tokens"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]